@@ -1,11 +1,18 @@
 import typer
+import asyncio
 from typing import Annotated, Optional, List
 from dataclasses import dataclass
+import hashlib
+import os
 import time
 from contextlib import contextmanager
 from pr_agent.log import get_logger
-from pr_agent.utils import load_config
+from pr_agent.utils import load_config, unpack_omega_config
 from pr_agent.git_providers import get_git_provider
+from pr_agent.llm.litellm import LiteLLMModel
+from pr_agent.pipeline import ReviewPipeline
+from pr_agent.task_inference.base import PRReviewTaskInference
+from pr_agent.task_inference.preprocessing import SortByLanguageTask
 from rich import print as rprint
 from datetime import datetime
 logger = get_logger()
@@ -59,9 +66,17 @@ def run_review(
         Optional[str],
         typer.Option("--until", "-u", help="Filter PRs by until date"),
     ] = None,
+    batch: Annotated[
+        bool,
+        typer.Option(
+            "--batch",
+            help="Review through the LLM provider's batch API: cheaper, results within 24 hours. "
+            "Rerun the same command to resume an interrupted batch.",
+        ),
+    ] = False,
 ):
     start_time = time.time()
-    logger.info(f"Starting review of PR {pr_url}")
+    logger.info(f"Starting review of PRs in {repo_url}")
     try:
         config = load_config(config_path=config_path, overrides=config_overrides)
         logger.info("Successfully loaded config")
@@ -74,14 +89,73 @@ def run_review(
         repo_url,
         config.git_provider.include,
         config.git_provider.exclude,
+        max_workers=config.git_provider.max_workers,
+        cache_dir=config.git_provider.cache.dir,
+        cache_max_size_mb=config.git_provider.cache.max_size_mb,
+        http_cache_dir=config.git_provider.cache.http_dir,
+        http_cache_max_size_mb=config.git_provider.cache.http_max_size_mb,
+        diff_backend=config.git_provider.diff_backend,
+        mirror_dir=config.git_provider.local.mirror_dir,
+        mirror_timeout=config.git_provider.local.timeout,
+        use_search_api=config.git_provider.use_search_api,
+        rate_limit=unpack_omega_config(config.git_provider.rate_limit),
+        fetch_mode=config.git_provider.fetch_mode,
+        graphql_batch_size=config.git_provider.graphql_batch_size,
     )
-    with time_block("Fetching PR files", timer):
+    llm = LiteLLMModel(**unpack_omega_config(config.llm))
+    pipeline = ReviewPipeline(
+        git_provider,
+        preprocessors=[SortByLanguageTask()],
+        inference=PRReviewTaskInference(
+            llm,
+            chunked=config.review.chunked,
+            max_chunks=config.review.max_chunks,
+            stream=config.review.stream,
+            max_output_tokens=config.review.max_output_tokens,
+            structured=config.review.structured,
+            max_repairs=config.review.max_repairs,
+            on_issue=lambda task, issue: logger.info(
+                f"{task.pr_url}: {issue.get('issue_header')} in {issue.get('relevant_file')}"
+            ),
+        ),
+        queue_size=config.pipeline.queue_size,
+        fetch_concurrency=config.pipeline.fetch_concurrency,
+        preprocess_concurrency=config.pipeline.preprocess_concurrency,
+        inference_concurrency=config.pipeline.inference_concurrency,
+    )
+    with time_block("Reviewing PRs", timer):
         since_date = datetime.strptime(since, "%Y-%m-%d") if since else None
         until_date = datetime.strptime(until, "%Y-%m-%d") if until else None
-        for pr_url in git_provider.get_closed_prs(author, since_date, until_date):
-            diff_files = git_provider.get_diff_files(pr_url)
-            
-        # TODO: process diff files
+        if batch:
+            # The same command resumes the same batch
+            batch_id = hashlib.sha256(
+                f"{repo_url}|{author}|{since}|{until}|{llm.model}".encode()
+            ).hexdigest()[:16]
+            state_path = os.path.join(
+                os.path.expanduser(config.review.batch.state_dir), f"{batch_id}.json"
+            )
+            tasks = asyncio.run(
+                pipeline.run_batch(
+                    state_path,
+                    author,
+                    since_date,
+                    until_date,
+                    poll_interval=config.review.batch.poll_interval,
+                    timeout=config.review.batch.timeout,
+                )
+            )
+        else:
+            tasks = asyncio.run(pipeline.run(author, since_date, until_date))
+
+    for task in tasks:
+        rprint(f"[bold]{task.pr_url}[/bold]")
+        rprint(task.review)
+    logger.info(f"Reviewed {len(tasks)} PRs in {timer.time_elapsed:.2f} seconds")
+    logger.info(f"API rate limit budget: {git_provider.get_rate_limit_budget()}")
+    logger.info(f"LLM usage: {llm.stats.export()}")
+    logger.info(f"LLM routing: {llm.router.get_stats()}")
+    if llm.scheduler is not None:
+        logger.info(f"LLM request scheduler: {llm.scheduler.get_stats()}")
 
 
 def main():
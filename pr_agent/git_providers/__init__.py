@@ -33,13 +33,16 @@ def parse_repo_url(repo_url: str) -> str:
 
 
 def get_git_provider(
-    repo_url: str, include: list[str] | None, exclude: list[str] | None
+    repo_url: str,
+    include: list[str] | None,
+    exclude: list[str] | None,
+    **kwargs,
 ) -> GitProvider:
     provider = parse_repo_url(repo_url)
     match provider:
         case "github":
-            return GithubProvider(repo_url, include, exclude)
+            return GithubProvider(repo_url, include, exclude, **kwargs)
         case "gitlab":
-            return GitlabProvider(repo_url, include, exclude)
+            return GitlabProvider(repo_url, include, exclude, **kwargs)
         case _:
             raise ValueError(f"Unknown git provider: {provider}")
@@ -1,18 +1,156 @@
 import os
+import re
 import shutil
 import subprocess
 from abc import ABC, abstractmethod
-from typing import Tuple, Optional
+from dataclasses import dataclass
+from typing import Callable, List, Tuple, Optional
 from datetime import datetime
 from typing import Iterator
 
+from pr_agent.algo.utils import load_large_diff
 from pr_agent.log import get_logger
-from pr_agent.types import FilePatchInfo
+from pr_agent.types import EDIT_TYPE, FilePatchInfo
 
 
 MAX_FILES_ALLOWED_FULL = 50
 
 
+@dataclass
+class ChangedFile:
+    """
+    A file changed by a PR, mirroring the attributes of the GitHub REST `File` object.
+
+    Attributes:
+        filename: Path of the file at the head commit
+        status: One of "added", "removed", "modified", "renamed", "copied", "changed"
+        additions: Number of added lines
+        deletions: Number of deleted lines
+        patch: Diff hunks of the file, None for binary or unchanged content
+        previous_filename: Path of the file at the base commit for renamed files
+        sha: Blob SHA of the file at the head commit
+    """
+
+    filename: str
+    status: str
+    additions: int = 0
+    deletions: int = 0
+    patch: Optional[str] = None
+    previous_filename: Optional[str] = None
+    sha: Optional[str] = None
+
+
+def filter_diff_files(files: list, include: List[str], exclude: List[str]) -> list:
+    """Keep files matching any `include` pattern (if given) and no `exclude` pattern."""
+    return [
+        file
+        for file in files
+        if (
+            not include
+            or any(re.search(pattern, file.filename) for pattern in include)
+        )
+        and not any(re.search(pattern, file.filename) for pattern in exclude)
+    ]
+
+
+def get_edit_type(status: str) -> EDIT_TYPE:
+    if status == "added":
+        return EDIT_TYPE.ADDED
+    elif status == "removed":
+        return EDIT_TYPE.DELETED
+    elif status == "renamed":
+        return EDIT_TYPE.RENAMED
+    elif status == "modified":
+        return EDIT_TYPE.MODIFIED
+    get_logger().error(f"Unknown edit type: {status}")
+    return EDIT_TYPE.UNKNOWN
+
+
+def build_diff_files(
+    files: list,
+    head_sha: str,
+    base_sha: str,
+    get_contents: Callable[[List[Tuple[str, str]]], List[str]],
+) -> list[FilePatchInfo]:
+    """
+    Build FilePatchInfo objects for the changed files of a PR.
+
+    Args:
+        files: Changed files, either GitHub `File` objects or `ChangedFile`s
+        head_sha: Head commit of the PR
+        base_sha: Commit the PR is compared against (usually the merge base)
+        get_contents: Fetches file contents for a list of (filepath, commit_sha)
+            pairs, returning them in the same order
+
+    Returns:
+        FilePatchInfo objects in the order of `files`
+    """
+    skip_full_content = []
+    processed_file_count = 0
+    for file in files:
+        processed_file_count += 1
+        skip = False
+        if processed_file_count >= MAX_FILES_ALLOWED_FULL and file.patch:
+            skip = True
+            if processed_file_count == MAX_FILES_ALLOWED_FULL:
+                get_logger().info(
+                    "Too many files in PR, will avoid loading full content for rest of files"
+                )
+        skip_full_content.append(skip)
+
+    # Fetch head and base contents of all files at once
+    content_requests = []
+    for file, skip in zip(files, skip_full_content):
+        if not skip:
+            content_requests.append((file.filename, head_sha))
+            content_requests.append((_get_base_filename(file), base_sha))
+    contents = iter(get_contents(content_requests))
+
+    diff_files = []
+    for file, skip in zip(files, skip_full_content):
+        patch = file.patch
+
+        if skip:
+            new_file_content = ""
+            original_file_content = ""
+        else:
+            new_file_content = next(contents)
+            original_file_content = next(contents)
+
+        if not patch:
+            patch = load_large_diff(new_file_content, original_file_content)
+
+        # count number of lines added and removed
+        if hasattr(file, "additions") and hasattr(file, "deletions"):
+            num_plus_lines = file.additions
+            num_minus_lines = file.deletions
+        else:
+            patch_lines = patch.splitlines(keepends=True)
+            num_plus_lines = len([line for line in patch_lines if line.startswith("+")])
+            num_minus_lines = len(
+                [line for line in patch_lines if line.startswith("-")]
+            )
+        file_patch_info = FilePatchInfo(
+            base_file=original_file_content,
+            head_file=new_file_content,
+            patch=patch,
+            filename=file.filename,
+            edit_type=get_edit_type(file.status),
+            num_plus_lines=num_plus_lines,
+            num_minus_lines=num_minus_lines,
+        )
+        if file.status == "renamed":
+            file_patch_info.old_filename = _get_base_filename(file)
+        diff_files.append(file_patch_info)
+    return diff_files
+
+
+def _get_base_filename(file) -> str:
+    if file.status == "renamed" and file.previous_filename:
+        return file.previous_filename
+    return file.filename
+
+
 class GitProvider(ABC):
     
     @abstractmethod
@@ -28,6 +166,10 @@ class GitProvider(ABC):
     def get_diff_files(self, pr_url: str) -> list[FilePatchInfo]:
         pass
 
+    def get_rate_limit_budget(self) -> dict:
+        """Current API rate limit budget of the provider, empty if not tracked."""
+        return {}
+
     # Clone related API
     # An object which ensures deletion of a cloned repo, once it becomes out of scope.
     # Example usage:
@@ -51,7 +193,7 @@ class GitProvider(ABC):
     # Does a shallow clone, using a forked process to support a timeout guard.
     # In case operation has failed, it is expected to throw an exception as this method does not return a value.
     def _clone_inner(
-        self, repo_url: str, dest_folder: str, operation_timeout_in_seconds: int = None
+        self, repo_url: str, dest_folder: str, operation_timeout_in_seconds: Optional[int] = None
     ) -> None:
         # The following ought to be equivalent to:
         # #Repo.clone_from(repo_url, dest_folder)
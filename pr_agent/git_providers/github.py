@@ -1,16 +1,63 @@
+import base64
+import json
 import os
 import traceback
-from typing import Optional, Tuple, List, Iterator
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple, List, Iterator
+from datetime import datetime, timezone
 from urllib.parse import urlparse
-import re
 
 from github import Auth, Github
+from github.File import File
+from github.PaginatedList import PaginatedList
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+from urllib3.util.retry import Retry
 
-from pr_agent.git_providers.base import MAX_FILES_ALLOWED_FULL, GitProvider
+from pr_agent.git_providers.base import (
+    GitProvider,
+    build_diff_files,
+    filter_diff_files,
+)
+from pr_agent.git_providers.github_graphql import (
+    CLOSED_PULL_REQUESTS_QUERY,
+    SEARCH_PULL_REQUESTS_QUERY,
+    PullRequestInfo,
+    build_pull_requests_query,
+    parse_pull_request,
+)
+from pr_agent.git_providers.http_cache import ConditionalRequestCache
+from pr_agent.git_providers.local_git import GIT_TIMEOUT_SEC, LocalGitDiffBackend
+from pr_agent.git_providers.rate_limit import RateLimitGovernor
+from pr_agent.git_providers.registry import (
+    ObjectRegistry,
+    RequestCounter,
+    RequestListeners,
+)
 from pr_agent.log import get_logger
-from pr_agent.types import EDIT_TYPE, FilePatchInfo
-from pr_agent.algo.utils import load_large_diff
+from pr_agent.types import FilePatchInfo
+from pr_agent.utils.cache import DiskCache
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CACHE_MAX_SIZE_MB = 1024
+DEFAULT_HTTP_CACHE_MAX_SIZE_MB = 256
+DEFAULT_MIRROR_DIR = "~/.cache/pr-agent/mirrors"
+PAGE_SIZE = 100
+# The search API never returns more than this many results for one query
+MAX_SEARCH_RESULTS = 1000
+DEFAULT_GRAPHQL_BATCH_SIZE = 20
+# Retries of server errors only: rate limits are left to RateLimitGovernor,
+# which PyGithub's default GithubRetry would otherwise sleep on first. GraphQL
+# queries are read-only POST requests.
+SERVER_ERROR_RETRY = Retry(
+    total=3,
+    backoff_factor=1.0,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+    respect_retry_after_header=False,
+    raise_on_status=False,
+)
 
 
 class GithubProvider(GitProvider):
@@ -19,19 +66,133 @@ class GithubProvider(GitProvider):
         repo_url: str,
         include: Optional[List[str]] = None,
         exclude: Optional[List[str]] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cache_dir: Optional[str] = None,
+        cache_max_size_mb: int = DEFAULT_CACHE_MAX_SIZE_MB,
+        http_cache_dir: Optional[str] = None,
+        http_cache_max_size_mb: int = DEFAULT_HTTP_CACHE_MAX_SIZE_MB,
+        diff_backend: str = "api",
+        mirror_dir: Optional[str] = None,
+        mirror_timeout: int = GIT_TIMEOUT_SEC,
+        use_search_api: bool = False,
+        rate_limit: Optional[Dict[str, Any]] = None,
+        fetch_mode: str = "rest",
+        graphql_batch_size: int = DEFAULT_GRAPHQL_BATCH_SIZE,
     ):
         self.max_comment_chars = 65000
         self.base_url = "https://api.github.com"
         self.exclude = exclude or []
         self.include = include or []
+        self.max_workers = max(1, max_workers)
+        # Contents addressed by commit or blob SHA are immutable, so cached
+        # entries are only ever evicted, never invalidated.
+        self.cache = (
+            DiskCache(cache_dir, cache_max_size_mb * 1024 * 1024)
+            if cache_dir
+            else None
+        )
+        if diff_backend not in ("api", "local"):
+            raise ValueError(f"Unknown diff backend: {diff_backend}")
+        self.diff_backend = diff_backend
+        self.use_search_api = use_search_api
+        if fetch_mode not in ("rest", "graphql"):
+            raise ValueError(f"Unknown fetch mode: {fetch_mode}")
+        self.fetch_mode = fetch_mode
+        self.graphql_batch_size = max(1, graphql_batch_size)
+        # Repositories, PRs, file lists and merge bases resolved during this
+        # run, so that every stage touching a PR reuses the same objects
+        self._registry = ObjectRegistry()
+        self.local_backend = (
+            LocalGitDiffBackend(mirror_dir or DEFAULT_MIRROR_DIR, mirror_timeout)
+            if diff_backend == "local"
+            else None
+        )
 
         self.client = self._create_client(self.base_url)
+        # Innermost hook, sees every request actually sent
+        self.request_listeners = RequestListeners()
+        self.request_listeners.install(self.client)
+        # Installed before the governor so that revalidation requests still pass the governor
+        self.http_cache = (
+            ConditionalRequestCache(http_cache_dir, http_cache_max_size_mb * 1024 * 1024)
+            if http_cache_dir
+            else None
+        )
+        if self.http_cache is not None:
+            self.http_cache.install(self.client)
+        self.rate_governor = RateLimitGovernor(**(rate_limit or {}))
+        self.rate_governor.install(self.client)
         self.repo_name = self._parse_repo_url(repo_url)
-        self.repo = self.client.get_repo(self.repo_name)
+        self.repo = self._get_repo(self.repo_name)
 
     def get_pr_url(self) -> str:
         return self.pr.html_url
 
+    def get_rate_limit_budget(self) -> Dict[str, Dict[str, Any]]:
+        budget = self.rate_governor.get_budget()
+        if self.http_cache is not None:
+            budget["http_cache"] = {
+                "hits": self.http_cache.hits,
+                "misses": self.http_cache.misses,
+            }
+        return budget
+
+    @contextmanager
+    def count_requests(self) -> Iterator[RequestCounter]:
+        """Count the API requests sent inside the `with` block."""
+        counter = RequestCounter()
+        self.request_listeners.add(counter.record)
+        try:
+            yield counter
+        finally:
+            self.request_listeners.remove(counter.record)
+
+    def _get_repo(self, repo_name: str) -> Repository:
+        return self._registry.get(
+            ("repo", repo_name), lambda: self.client.get_repo(repo_name)
+        )
+
+    def _get_pull(self, pr_number: int) -> PullRequest:
+        return self._registry.get(
+            ("pull", pr_number), lambda: self.repo.get_pull(pr_number)
+        )
+
+    def _get_pull_files(self, pr_number: int) -> list:
+        # Listed directly, so that PRs known from GraphQL are not fetched again
+        return self._registry.get(
+            ("files", pr_number),
+            lambda: list(
+                PaginatedList(
+                    File,
+                    self.client.requester,
+                    f"{self.repo.url}/pulls/{pr_number}/files",
+                    None,
+                )
+            ),
+        )
+
+    def _get_merge_base_sha(self, base_sha: str, head_sha: str) -> str:
+        def load() -> str:
+            try:
+                # The merge base is not exposed by the GraphQL API
+                return self.repo.compare(base_sha, head_sha).merge_base_commit.sha
+            except Exception as e:
+                get_logger().error(f"Failed to get merge base commit: {e}")
+                return base_sha
+
+        return self._registry.get(("merge_base", base_sha, head_sha), load)
+
+    def _prepare_clone_url_with_token(self, repo_url_to_clone: str) -> str | None:
+        scheme = "https://"
+        if not repo_url_to_clone.startswith(scheme):
+            get_logger().error(f"Unsupported clone url: {repo_url_to_clone}")
+            return None
+        token = os.getenv("GITHUB_TOKEN")
+        if not token:
+            get_logger().error("GitHub token is required to clone the repository.")
+            return None
+        return f"{scheme}x-access-token:{token}@{repo_url_to_clone[len(scheme):]}"
+
     @staticmethod
     def _create_client(base_url: str = "https://api.github.com"):
         token = os.getenv("GITHUB_TOKEN")
@@ -39,7 +200,16 @@ class GithubProvider(GitProvider):
             raise ValueError("GitHub token is required when using user deployment.")
         auth = Auth.Token(token)
         if auth:
-            return Github(auth=auth, base_url=base_url)
+            # Request pacing is left to RateLimitGovernor. GraphQL queries are
+            # POST requests, which PyGithub would otherwise space as writes.
+            return Github(
+                auth=auth,
+                base_url=base_url,
+                per_page=PAGE_SIZE,
+                seconds_between_requests=None,
+                seconds_between_writes=None,
+                retry=SERVER_ERROR_RETRY,
+            )
         else:
             raise ValueError("Could not authenticate to GitHub")
 
@@ -90,6 +260,9 @@ class GithubProvider(GitProvider):
         return repo_name, pr_number
 
     def _get_file_content_at_commit(self, filepath, commit_sha):
+        cache_key = f"file:{self.repo_name}:{commit_sha}:{filepath}"
+        if self.cache is not None and (cached := self.cache.get(cache_key)) is not None:
+            return cached.decode()
         try:
             file_content = str(
                 self.repo.get_contents(
@@ -98,107 +271,157 @@ class GithubProvider(GitProvider):
             )
         except Exception:
             get_logger().error(f"Failed to get content for file: {filepath}")
-            file_content = ""
+            return ""
+        if self.cache is not None:
+            self.cache.set(cache_key, file_content.encode())
         return file_content
 
+    def _get_commit_tree(self, commit_sha: str) -> Optional[Dict[str, str]]:
+        """Map every file path of a commit to its blob SHA.
+
+        Returns None when the tree cannot be listed in full (e.g. truncated
+        listings of very large repositories), so callers can fall back to
+        per-path content requests.
+        """
+        cache_key = f"tree:{self.repo_name}:{commit_sha}"
+        if self.cache is not None and (cached := self.cache.get(cache_key)) is not None:
+            return json.loads(cached)
+        try:
+            tree = self.repo.get_git_tree(commit_sha, recursive=True)
+        except Exception as e:
+            get_logger().error(f"Failed to get tree for commit {commit_sha}: {e}")
+            return None
+        if tree.truncated:
+            get_logger().info(
+                f"Tree of commit {commit_sha} is truncated, falling back to per-file requests"
+            )
+            blob_shas = None
+        else:
+            blob_shas = {
+                element.path: element.sha
+                for element in tree.tree
+                if element.type == "blob"
+            }
+        if self.cache is not None:
+            self.cache.set(cache_key, json.dumps(blob_shas).encode())
+        return blob_shas
+
+    def _get_blob_content(self, blob_sha: str) -> str:
+        cache_key = f"blob:{self.repo_name}:{blob_sha}"
+        raw_content = self.cache.get(cache_key) if self.cache is not None else None
+        if raw_content is None:
+            try:
+                blob = self.repo.get_git_blob(blob_sha)
+                if blob.encoding == "base64":
+                    raw_content = base64.b64decode(blob.content)
+                else:
+                    raw_content = str(blob.content).encode()
+            except Exception:
+                get_logger().error(f"Failed to get content for blob: {blob_sha}")
+                return ""
+            if self.cache is not None:
+                self.cache.set(cache_key, raw_content)
+        try:
+            return raw_content.decode()
+        except UnicodeDecodeError:
+            get_logger().error(f"Failed to decode content for blob: {blob_sha}")
+            return ""
+
+    def _get_files_contents_at_commits(
+        self, requests: List[Tuple[str, str]]
+    ) -> List[str]:
+        """Fetch file contents for (filepath, commit_sha) pairs concurrently.
+
+        Each commit tree is listed once and contents are downloaded as blobs
+        keyed by SHA, so a blob shared by several requests (e.g. a file that
+        is unchanged between base and head) is downloaded only once.
+        Results are returned in the same order as the requests.
+        """
+        if not requests:
+            return []
+        max_workers = min(self.max_workers, len(requests))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            commit_shas = list(dict.fromkeys(sha for _, sha in requests))
+            trees = dict(
+                zip(commit_shas, executor.map(self._get_commit_tree, commit_shas))
+            )
+
+            blob_shas = list(
+                dict.fromkeys(
+                    trees[sha][filepath]
+                    for filepath, sha in requests
+                    if trees[sha] is not None and filepath in trees[sha]
+                )
+            )
+            blobs = dict(zip(blob_shas, executor.map(self._get_blob_content, blob_shas)))
+
+            fallback_requests = [
+                (filepath, sha) for filepath, sha in requests if trees[sha] is None
+            ]
+            fallback_contents = dict(
+                zip(
+                    fallback_requests,
+                    executor.map(
+                        lambda request: self._get_file_content_at_commit(*request),
+                        fallback_requests,
+                    ),
+                )
+            )
+
+        contents = []
+        for filepath, sha in requests:
+            tree = trees[sha]
+            if tree is None:
+                contents.append(fallback_contents[(filepath, sha)])
+            else:
+                # A path missing from the tree does not exist at that commit
+                contents.append(blobs[tree[filepath]] if filepath in tree else "")
+        return contents
+
     def get_diff_files(self, pr_url: str) -> list[FilePatchInfo]:
         repo_name, pr_number = self._parse_pr_url(pr_url)
         if repo_name != self.repo_name:
             raise ValueError(
                 "The provided URL does not appear to be a GitHub PR URL for this repository"
             )
-        repo = self.client.get_repo(repo_name)
-        pr = repo.get_pull(pr_number)
-        files = list(pr.get_files())
+        if self.fetch_mode == "graphql":
+            pr_info = self._get_pull_request_info(pr_number)
+            base_sha, head_sha = pr_info.base_sha, pr_info.head_sha
+        else:
+            pr = self._get_pull(pr_number)
+            base_sha, head_sha = pr.base.sha, pr.head.sha
         try:
-            diff_files = []
-            try:
-                compare = repo.compare(pr.base.sha, pr.head.sha)
-                merge_base_commit = compare.merge_base_commit
-            except Exception as e:
-                get_logger().error(f"Failed to get merge base commit: {e}")
-                merge_base_commit = pr.base
-            if merge_base_commit.sha != pr.base.sha:
-                get_logger().info(
-                    f"Using merge base commit {merge_base_commit.sha} instead of base commit "
-                )
-            processed_file_count = 0
-            filtered_files = [
-                file
-                for file in files
-                if (
-                    not self.include
-                    or any(
-                        re.search(pattern, file.filename) for pattern in self.include
-                    )
+            if self.local_backend is not None:
+                clone_url = self._prepare_clone_url_with_token(self.repo.clone_url)
+                if not clone_url:
+                    raise ValueError("Unable to obtain url to clone")
+                diff_files = self.local_backend.get_diff_files(
+                    clone_url,
+                    repo_name,
+                    base_sha,
+                    head_sha,
+                    self.include,
+                    self.exclude,
+                    pr_number=pr_number,
+                    plain_url=self.repo.clone_url,
                 )
-                and not any(
-                    re.search(pattern, file.filename) for pattern in self.exclude
-                )
-            ]
-            for file in filtered_files:
-                patch = file.patch
-
-                processed_file_count += 1
-                skip_full_content = False
-                if processed_file_count >= MAX_FILES_ALLOWED_FULL and patch:
-                    skip_full_content = True
-                    if processed_file_count == MAX_FILES_ALLOWED_FULL:
-                        get_logger().info(
-                            "Too many files in PR, will avoid loading full content for rest of files"
-                        )
-
-                if skip_full_content:
-                    new_file_content = ""
-                else:
-                    new_file_content = self._get_file_content_at_commit(
-                        file.filename, self.pr.head.sha
-                    )
-                if skip_full_content:
-                    original_file_content = ""
-                else:
-                    original_file_content = self._get_file_content_at_commit(
-                        file.filename, merge_base_commit.sha
-                    )
-
-                if not patch:
-                    patch = load_large_diff(new_file_content, original_file_content)
-
-                if file.status == "added":
-                    edit_type = EDIT_TYPE.ADDED
-                elif file.status == "removed":
-                    edit_type = EDIT_TYPE.DELETED
-                elif file.status == "renamed":
-                    edit_type = EDIT_TYPE.RENAMED
-                elif file.status == "modified":
-                    edit_type = EDIT_TYPE.MODIFIED
-                else:
-                    get_logger().error(f"Unknown edit type: {file.status}")
-                    edit_type = EDIT_TYPE.UNKNOWN
+                self.diff_files = diff_files
+                return diff_files
 
-                # count number of lines added and removed
-                if hasattr(file, "additions") and hasattr(file, "deletions"):
-                    num_plus_lines = file.additions
-                    num_minus_lines = file.deletions
-                else:
-                    patch_lines = patch.splitlines(keepends=True)
-                    num_plus_lines = len(
-                        [line for line in patch_lines if line.startswith("+")]
-                    )
-                    num_minus_lines = len(
-                        [line for line in patch_lines if line.startswith("-")]
-                    )
-                diff_files.append(
-                    FilePatchInfo(
-                        base_file=original_file_content,
-                        head_file=new_file_content,
-                        patch=patch,
-                        filename=file.filename,
-                        edit_type=edit_type,
-                        num_plus_lines=num_plus_lines,
-                        num_minus_lines=num_minus_lines,
-                    )
+            # GraphQL lacks patches and previous paths of renamed files
+            files = self._get_pull_files(pr_number)
+            merge_base_sha = self._get_merge_base_sha(base_sha, head_sha)
+            if merge_base_sha != base_sha:
+                get_logger().info(
+                    f"Using merge base commit {merge_base_sha} instead of base commit "
                 )
+            filtered_files = filter_diff_files(files, self.include, self.exclude)
+            diff_files = build_diff_files(
+                filtered_files,
+                head_sha,
+                merge_base_sha,
+                self._get_files_contents_at_commits,
+            )
             self.diff_files = diff_files
             return diff_files
 
@@ -217,19 +440,163 @@ class GithubProvider(GitProvider):
     ) -> Iterator[str]:
         """Get closed PRs for a repository, optionally filtered by author and date range.
 
+        PRs are fetched lazily page by page, most recently updated first, and
+        listing stops at the first PR last updated before `since`. With
+        `use_search_api` enabled, filtering happens server side instead.
+
         Args:
             author: Optional GitHub username to filter PRs by
             since: Optional datetime to get PRs closed after this time
             until: Optional datetime to get PRs closed before this time
 
-        Returns:
-            List of PR URLs
+        Yields:
+            PR URLs
         """
-        prs = list(self.repo.get_pulls(state="closed", head=author, sort="updated", direction="desc"))
-        for pr in prs:
-            if pr.closed_at:
-                if since and pr.closed_at < since:
+        since = _as_utc(since)
+        until = _as_utc(until)
+        if self.fetch_mode == "graphql":
+            yield from self._list_closed_prs_graphql(author, since, until)
+            return
+        if self.use_search_api:
+            yield from self._search_closed_prs(author, since, until)
+            return
+
+        for pr in self.repo.get_pulls(state="closed", sort="updated", direction="desc"):
+            # A PR cannot be closed after its last update, so no later page can match
+            if since and pr.updated_at < since:
+                break
+            if not pr.closed_at:
+                continue
+            if since and pr.closed_at < since:
+                continue
+            if until and pr.closed_at > until:
+                continue
+            if author and pr.user.login.lower() != author.lower():
+                continue
+            # Listed PRs carry the base and head SHAs, no need to fetch them again
+            self._registry.set(("pull", pr.number), pr)
+            yield pr.html_url
+
+    def _search_closed_prs(
+        self,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Iterator[str]:
+        query = self._build_search_query(author, since, until)
+        issues = self.client.search_issues(query, sort="updated", order="desc")
+        if issues.totalCount > MAX_SEARCH_RESULTS:
+            get_logger().warning(
+                f"Search matched {issues.totalCount} PRs, but only the first "
+                f"{MAX_SEARCH_RESULTS} can be retrieved. Narrow the date range."
+            )
+        for issue in issues:
+            yield issue.html_url
+
+    def _build_search_query(
+        self,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> str:
+        query = f"repo:{self.repo_name} is:pr is:closed"
+        if author:
+            query += f" author:{author}"
+        if since and until:
+            query += f" closed:{since:%Y-%m-%dT%H:%M:%SZ}..{until:%Y-%m-%dT%H:%M:%SZ}"
+        elif since:
+            query += f" closed:>={since:%Y-%m-%dT%H:%M:%SZ}"
+        elif until:
+            query += f" closed:<={until:%Y-%m-%dT%H:%M:%SZ}"
+        return query
+
+    def _graphql(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        _, response = self.client.requester.graphql_query(query, variables)
+        return response["data"]
+
+    def _store_pull_request_info(self, pr_info: PullRequestInfo):
+        self._registry.set(("pull_info", pr_info.number), pr_info)
+
+    def get_pull_request_infos(
+        self, pr_numbers: List[int]
+    ) -> Dict[int, PullRequestInfo]:
+        """Fetch metadata of PRs over GraphQL, `graphql_batch_size` PRs per query."""
+        owner, name = self.repo_name.split("/")
+        pr_infos = {}
+        for start in range(0, len(pr_numbers), self.graphql_batch_size):
+            batch = pr_numbers[start : start + self.graphql_batch_size]
+            repository = self._graphql(
+                build_pull_requests_query(batch), {"owner": owner, "name": name}
+            )["repository"]
+            for i in range(len(batch)):
+                pr_info = parse_pull_request(repository[f"pr{i}"])
+                self._store_pull_request_info(pr_info)
+                pr_infos[pr_info.number] = pr_info
+        return pr_infos
+
+    def _get_pull_request_info(self, pr_number: int) -> PullRequestInfo:
+        return self._registry.get(
+            ("pull_info", pr_number),
+            lambda: self.get_pull_request_infos([pr_number])[pr_number],
+        )
+
+    def _list_closed_prs_graphql(
+        self,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Iterator[str]:
+        """List closed PRs over GraphQL, prefetching metadata of a whole page per query."""
+        owner, name = self.repo_name.split("/")
+        cursor = None
+        while True:
+            if self.use_search_api:
+                connection = self._graphql(
+                    SEARCH_PULL_REQUESTS_QUERY,
+                    {
+                        "query": self._build_search_query(author, since, until)
+                        + " sort:updated-desc",
+                        "first": self.graphql_batch_size,
+                        "cursor": cursor,
+                    },
+                )["search"]
+            else:
+                connection = self._graphql(
+                    CLOSED_PULL_REQUESTS_QUERY,
+                    {
+                        "owner": owner,
+                        "name": name,
+                        "first": self.graphql_batch_size,
+                        "cursor": cursor,
+                    },
+                )["repository"]["pullRequests"]
+
+            for node in connection["nodes"]:
+                if not node:
+                    continue
+                pr_info = parse_pull_request(node)
+                # A PR cannot be closed after its last update, so no later page can match
+                if since and pr_info.updated_at and pr_info.updated_at < since:
+                    return
+                if not pr_info.closed_at:
                     continue
-                if until and pr.closed_at > until:
+                if since and pr_info.closed_at < since:
                     continue
-                yield pr.html_url
+                if until and pr_info.closed_at > until:
+                    continue
+                if author and (pr_info.author or "").lower() != author.lower():
+                    continue
+                self._store_pull_request_info(pr_info)
+                yield pr_info.url
+
+            page_info = connection["pageInfo"]
+            if not page_info["hasNextPage"]:
+                return
+            cursor = page_info["endCursor"]
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Treat naive datetimes as UTC so they compare with GitHub timestamps."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence
+
+PULL_REQUEST_FIELDS = """
+fragment PullRequestFields on PullRequest {
+  number
+  url
+  closedAt
+  updatedAt
+  author { login }
+  baseRefOid
+  headRefOid
+}
+"""
+
+CLOSED_PULL_REQUESTS_QUERY = (
+    """
+query($owner: String!, $name: String!, $first: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(
+      states: [CLOSED, MERGED]
+      orderBy: {field: UPDATED_AT, direction: DESC}
+      first: $first
+      after: $cursor
+    ) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...PullRequestFields }
+    }
+  }
+}
+"""
+    + PULL_REQUEST_FIELDS
+)
+
+SEARCH_PULL_REQUESTS_QUERY = (
+    """
+query($query: String!, $first: Int!, $cursor: String) {
+  search(query: $query, type: ISSUE, first: $first, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes { ... on PullRequest { ...PullRequestFields } }
+  }
+}
+"""
+    + PULL_REQUEST_FIELDS
+)
+
+def build_pull_requests_query(numbers: Sequence[int]) -> str:
+    """Query fetching several PRs of one repository at once, aliased as pr0, pr1, ..."""
+    pull_requests = "\n".join(
+        f"pr{i}: pullRequest(number: {number}) {{ ...PullRequestFields }}"
+        for i, number in enumerate(numbers)
+    )
+    return (
+        f"""
+query($owner: String!, $name: String!) {{
+  repository(owner: $owner, name: $name) {{
+    {pull_requests}
+  }}
+}}
+"""
+        + PULL_REQUEST_FIELDS
+    )
+
+
+@dataclass
+class PullRequestInfo:
+    """
+    Metadata of a PR, as returned by the GraphQL API.
+
+    GraphQL exposes neither file patches nor the previous path of renamed
+    files, so changed files are always listed with the REST API.
+    """
+
+    number: int
+    url: str
+    base_sha: str
+    head_sha: str
+    closed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    author: Optional[str] = None
+
+
+def parse_pull_request(node: Dict[str, Any]) -> PullRequestInfo:
+    """Parse a node selected with PullRequestFields."""
+    return PullRequestInfo(
+        number=node["number"],
+        url=node["url"],
+        base_sha=node["baseRefOid"],
+        head_sha=node["headRefOid"],
+        closed_at=_parse_datetime(node.get("closedAt")),
+        updated_at=_parse_datetime(node.get("updatedAt")),
+        author=(node.get("author") or {}).get("login"),
+    )
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
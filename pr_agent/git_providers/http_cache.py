@@ -0,0 +1,109 @@
+import functools
+import json
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from github import Github
+
+from pr_agent.log import get_logger
+from pr_agent.utils.cache import DiskCache
+
+# Response headers kept with a cached response, everything else is dropped
+_CACHED_HEADERS = ("etag", "last-modified", "link", "content-type")
+
+
+class ConditionalRequestCache:
+    """
+    HTTP-level cache of GitHub REST responses, revalidated with conditional requests.
+
+    GET responses are stored on disk together with their ETag / Last-Modified
+    headers. Repeated requests for the same resource are sent with
+    If-None-Match / If-Modified-Since, and a 304 Not Modified answer is replayed
+    from the cache. GitHub does not count 304 responses against the primary
+    rate limit, so unchanged PR metadata, file lists and comparisons are
+    almost free on later runs.
+
+    Args:
+        directory: Directory where responses are persisted between runs
+        max_size_bytes: Upper bound for the total size of cached responses
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int):
+        self.store = DiskCache(directory, max_size_bytes)
+        self._lock = threading.Lock()
+        # HTTP status of the last response received by each thread
+        self._last_status = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def install(self, client: Github):
+        """Serve GET requests of `client` through the cache."""
+        requester = client.requester
+        request = requester.requestJsonAndCheck
+        request_json = requester.requestJson
+
+        @functools.wraps(request)
+        def cached_request(verb: str, url: str, *args, **kwargs):
+            return self.call(request, verb, url, *args, **kwargs)
+
+        # requestJsonAndCheck hides the status, and replies with an empty body
+        # are indistinguishable from a 304 after parsing
+        @functools.wraps(request_json)
+        def observed_request_json(*args, **kwargs):
+            status, response_headers, output = request_json(*args, **kwargs)
+            self._last_status.value = status
+            return status, response_headers, output
+
+        requester.requestJsonAndCheck = cached_request
+        requester.requestJson = observed_request_json
+
+    def call(
+        self,
+        request: Callable[..., Tuple[Dict[str, Any], Any]],
+        verb: str,
+        url: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        *args,
+        **kwargs,
+    ) -> Tuple[Dict[str, Any], Any]:
+        if verb != "GET":
+            return request(verb, url, parameters, headers, *args, **kwargs)
+
+        key = json.dumps(
+            [url, parameters or {}, (headers or {}).get("Accept")], sort_keys=True
+        )
+        cached = self.store.get(key)
+        entry = json.loads(cached) if cached is not None else None
+        headers = dict(headers or {})
+        if entry is not None:
+            if "etag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["etag"]
+            if "last-modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+
+        self._last_status.value = None
+        response_headers, data = request(verb, url, parameters, headers, *args, **kwargs)
+        response_headers = {key.lower(): value for key, value in response_headers.items()}
+
+        if entry is not None and self._last_status.value == 304:
+            with self._lock:
+                self.hits += 1
+            return {**response_headers, **entry["headers"]}, entry["data"]
+
+        with self._lock:
+            self.misses += 1
+        if "etag" in response_headers or "last-modified" in response_headers:
+            entry = {
+                "headers": {
+                    name: response_headers[name]
+                    for name in _CACHED_HEADERS
+                    if name in response_headers
+                },
+                "data": data,
+            }
+            try:
+                self.store.set(key, json.dumps(entry).encode())
+            except (TypeError, ValueError) as e:
+                get_logger().warning(f"Failed to cache response of {url}: {e}")
+        return response_headers, data
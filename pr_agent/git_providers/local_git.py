@@ -0,0 +1,299 @@
+import os
+import subprocess
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from pr_agent.git_providers.base import (
+    ChangedFile,
+    build_diff_files,
+    filter_diff_files,
+)
+from pr_agent.log import get_logger
+from pr_agent.types import FilePatchInfo
+
+GIT_TIMEOUT_SEC = 600
+
+_GIT_STATUSES = {
+    "A": "added",
+    "D": "removed",
+    "M": "modified",
+    "R": "renamed",
+    "C": "copied",
+    "T": "changed",
+}
+
+
+class LocalGitDiffBackend:
+    """
+    Computes the diff files of PRs from local bare mirrors instead of the REST API.
+
+    One bare partial (blob-less) mirror is kept per repository under `mirror_dir`.
+    Commits of each PR are fetched into it incrementally, and file lists, patches
+    and contents are produced with `git diff` and `git cat-file --batch`, giving
+    the same FilePatchInfo objects as `GithubProvider.get_diff_files`. Blobs are
+    fetched lazily by these commands from the mirror's remote, through the
+    authenticated clone URL of the run.
+
+    Args:
+        mirror_dir: Directory holding the bare mirrors
+        operation_timeout_in_seconds: Timeout of a single git command
+    """
+
+    def __init__(
+        self,
+        mirror_dir: Union[str, Path],
+        operation_timeout_in_seconds: int = GIT_TIMEOUT_SEC,
+    ):
+        self.mirror_dir = Path(mirror_dir).expanduser()
+        self.operation_timeout_in_seconds = operation_timeout_in_seconds
+        self._mirror_locks: Dict[Path, threading.Lock] = defaultdict(threading.Lock)
+        # Mirror path -> (URL stored as its remote, URL to reach the remote with)
+        self._remote_urls: Dict[Path, Tuple[str, str]] = {}
+
+    def _run_git(
+        self, args: Sequence[str], cwd: Optional[Path] = None, input: Optional[bytes] = None
+    ) -> bytes:
+        config = ["-c", "core.quotePath=false"]
+        if cwd in self._remote_urls:
+            # Lazy blob fetches from the stored credential-free remote are
+            # rewritten to the authenticated URL; -c settings reach the
+            # fetch subprocesses git spawns
+            plain_url, clone_url = self._remote_urls[cwd]
+            config += ["-c", f"url.{clone_url}.insteadOf={plain_url}"]
+        result = subprocess.run(
+            ["git", *config, *args],
+            cwd=cwd,
+            input=input,
+            check=True,  # check=True will raise an exception if the command fails
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=self.operation_timeout_in_seconds,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+        return result.stdout
+
+    def get_mirror_path(self, repo_name: str) -> Path:
+        return self.mirror_dir / f"{repo_name}.git"
+
+    def ensure_mirror(
+        self, clone_url: str, repo_name: str, plain_url: Optional[str] = None
+    ) -> Path:
+        """Create the bare partial mirror of a repository unless it already exists.
+
+        Later git commands in the mirror reach its remote through `clone_url`.
+
+        Args:
+            clone_url: URL to clone from, possibly embedding credentials
+            repo_name: Repository name, e.g. "owner/repo"
+            plain_url: URL stored as the mirror's remote, so that credentials
+                embedded in `clone_url` are not persisted on disk
+        """
+        mirror_path = self.get_mirror_path(repo_name)
+        with self._mirror_locks[mirror_path]:
+            if not mirror_path.exists():
+                get_logger().info(f"Creating mirror of {repo_name} at {mirror_path}")
+                mirror_path.parent.mkdir(parents=True, exist_ok=True)
+                self._run_git(
+                    [
+                        "clone",
+                        "--bare",
+                        "--filter=blob:none",
+                        clone_url,
+                        str(mirror_path),
+                    ]
+                )
+                self._run_git(
+                    ["remote", "set-url", "origin", plain_url or clone_url],
+                    cwd=mirror_path,
+                )
+            if plain_url and plain_url != clone_url:
+                # Updated on every run, as tokens in `clone_url` expire
+                self._remote_urls[mirror_path] = (plain_url, clone_url)
+            else:
+                self._remote_urls.pop(mirror_path, None)
+        return mirror_path
+
+    def _has_commit(self, mirror_path: Path, commit_sha: str) -> bool:
+        try:
+            self._run_git(["cat-file", "-e", f"{commit_sha}^{{commit}}"], cwd=mirror_path)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def fetch(
+        self,
+        mirror_path: Path,
+        clone_url: str,
+        commit_shas: Sequence[str],
+        pr_number: Optional[int] = None,
+    ):
+        """Fetch the given commits into the mirror unless they are already present."""
+        missing_shas = [
+            sha for sha in commit_shas if not self._has_commit(mirror_path, sha)
+        ]
+        if not missing_shas:
+            return
+        refspecs = [f"+refs/pull/{pr_number}/head:refs/pull/{pr_number}/head"] if pr_number else []
+        with self._mirror_locks[mirror_path]:
+            fetch_args = ["fetch", "--filter=blob:none", "--no-tags", clone_url]
+            try:
+                self._run_git([*fetch_args, *refspecs, *missing_shas], cwd=mirror_path)
+            except subprocess.CalledProcessError:
+                # Not every server allows fetching commits by SHA, fall back to refs
+                self._run_git(
+                    [*fetch_args, *refspecs, "+refs/heads/*:refs/heads/*"],
+                    cwd=mirror_path,
+                )
+
+    def get_merge_base(self, mirror_path: Path, base_sha: str, head_sha: str) -> str:
+        try:
+            return (
+                self._run_git(["merge-base", base_sha, head_sha], cwd=mirror_path)
+                .decode()
+                .strip()
+            )
+        except subprocess.CalledProcessError as e:
+            get_logger().error(f"Failed to get merge base commit: {e}")
+            return base_sha
+
+    def get_changed_files(
+        self, mirror_path: Path, base_sha: str, head_sha: str
+    ) -> List[ChangedFile]:
+        """List files changed between two commits, with their patches and line counts."""
+        name_status = self._run_git(
+            ["diff", "--name-status", "-z", "-M", base_sha, head_sha], cwd=mirror_path
+        ).decode(errors="replace")
+        numstat = self._run_git(
+            ["diff", "--numstat", "-z", "-M", base_sha, head_sha], cwd=mirror_path
+        ).decode(errors="replace")
+        patches = self._run_git(
+            ["diff", "--no-color", "--no-ext-diff", "-M", base_sha, head_sha],
+            cwd=mirror_path,
+        ).decode(errors="replace")
+
+        files = []
+        tokens = iter(name_status.split("\0"))
+        for status in tokens:
+            if not status:
+                continue
+            if status[0] in "RC":
+                previous_filename, filename = next(tokens), next(tokens)
+            else:
+                previous_filename, filename = None, next(tokens)
+            files.append(
+                ChangedFile(
+                    filename=filename,
+                    status=_GIT_STATUSES.get(status[0], status),
+                    previous_filename=previous_filename,
+                )
+            )
+
+        tokens = iter(numstat.split("\0"))
+        for file, stat in zip(files, tokens):
+            additions, deletions, path = stat.split("\t", 2)
+            if not path:
+                # Renames and copies list both paths as separate fields
+                next(tokens), next(tokens)
+            # Binary files are reported as "-"
+            file.additions = int(additions) if additions.isdigit() else 0
+            file.deletions = int(deletions) if deletions.isdigit() else 0
+
+        # Patches are printed in the same order as the file list
+        for file, patch in zip(files, _split_patches(patches)):
+            file.patch = patch
+        return files
+
+    def get_contents(
+        self, mirror_path: Path, requests: List[Tuple[str, str]]
+    ) -> List[str]:
+        """Read file contents for (filepath, commit_sha) pairs with a single `git cat-file --batch`."""
+        if not requests:
+            return []
+        batch_input = "".join(f"{sha}:{filepath}\n" for filepath, sha in requests)
+        output = self._run_git(
+            ["cat-file", "--batch"], cwd=mirror_path, input=batch_input.encode()
+        )
+
+        contents = []
+        position = 0
+        for filepath, _ in requests:
+            header_end = output.index(b"\n", position)
+            header = output[position:header_end].decode(errors="replace").split(" ")
+            position = header_end + 1
+            if header[-1] in ("missing", "ambiguous") or len(header) != 3:
+                # The file does not exist at that commit
+                contents.append("")
+                continue
+            size = int(header[2])
+            raw_content = output[position : position + size]
+            position += size + 1
+            try:
+                contents.append(raw_content.decode())
+            except UnicodeDecodeError:
+                get_logger().error(f"Failed to decode content for file: {filepath}")
+                contents.append("")
+        return contents
+
+    def get_diff_files(
+        self,
+        clone_url: str,
+        repo_name: str,
+        base_sha: str,
+        head_sha: str,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        pr_number: Optional[int] = None,
+        plain_url: Optional[str] = None,
+    ) -> list[FilePatchInfo]:
+        """
+        Compute the diff files of a PR from the local mirror of its repository.
+
+        Args:
+            clone_url: URL (or local path) of the repository to mirror
+            repo_name: Repository name, e.g. "owner/repo"
+            base_sha: Base commit of the PR
+            head_sha: Head commit of the PR
+            include: Regex patterns of file paths to keep
+            exclude: Regex patterns of file paths to skip
+            pr_number: PR number, used to fetch its head ref when commits are missing
+            plain_url: Credential-free URL stored as the mirror's remote
+
+        Returns:
+            FilePatchInfo objects computed against the merge base of the PR
+        """
+        mirror_path = self.ensure_mirror(clone_url, repo_name, plain_url)
+        self.fetch(mirror_path, clone_url, [base_sha, head_sha], pr_number)
+        merge_base_sha = self.get_merge_base(mirror_path, base_sha, head_sha)
+        if merge_base_sha != base_sha:
+            get_logger().info(
+                f"Using merge base commit {merge_base_sha} instead of base commit "
+            )
+        files = filter_diff_files(
+            self.get_changed_files(mirror_path, merge_base_sha, head_sha),
+            include or [],
+            exclude or [],
+        )
+        return build_diff_files(
+            files,
+            head_sha,
+            merge_base_sha,
+            lambda requests: self.get_contents(mirror_path, requests),
+        )
+
+
+def _split_patches(diff: str) -> List[Optional[str]]:
+    """Split `git diff` output into per-file hunks, formatted like GitHub's `File.patch`."""
+    patches: List[Optional[str]] = []
+    hunk_lines: Optional[List[str]] = None
+    for line in diff.split("\n"):
+        if line.startswith("diff --git "):
+            if hunk_lines is not None:
+                patches.append("\n".join(hunk_lines).rstrip("\n") or None)
+            hunk_lines = []
+        elif hunk_lines is not None and (hunk_lines or line.startswith("@@")):
+            hunk_lines.append(line)
+    if hunk_lines is not None:
+        patches.append("\n".join(hunk_lines).rstrip("\n") or None)
+    return patches
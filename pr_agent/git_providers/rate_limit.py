@@ -0,0 +1,176 @@
+import functools
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from github import Github, GithubException, RateLimitExceededException
+
+from pr_agent.log import get_logger
+
+# GitHub asks to wait at least a minute after a secondary rate limit without Retry-After
+SECONDARY_RATE_LIMIT_BACKOFF_SEC = 60
+
+
+@dataclass
+class RateLimitBudget:
+    """Last known rate limit state of one GitHub API resource (core, search, graphql)."""
+
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    reset_at: Optional[float] = None
+
+
+class RateLimitGovernor:
+    """
+    Central throttle shared by every request made through a PyGithub client.
+
+    The governor wraps the client's requester, so all API calls (including lazy
+    attribute loads and pagination) go through it. It tracks the
+    X-RateLimit-* headers of each resource, caps the number of requests in
+    flight, spreads the remaining budget evenly until the reset once it runs
+    low, and backs off on secondary rate limits, honoring Retry-After.
+
+    Args:
+        max_concurrency: Maximum number of requests in flight across all workers
+        reserve: Requests kept in reserve per resource. Workers pause until
+            the reset once the remaining budget drops to this level.
+        low_watermark: Fraction of the limit below which requests are paced
+            evenly until the reset
+        max_retries: Retries of a request rejected by a rate limit
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        reserve: int = 50,
+        low_watermark: float = 0.2,
+        max_retries: int = 3,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserve = reserve
+        self.low_watermark = low_watermark
+        self.max_retries = max_retries
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._budgets: Dict[str, RateLimitBudget] = {}
+        self._next_request_at: Dict[str, float] = {}
+        self._paused_until = 0.0
+
+        self.requests = 0
+        self.rate_limited_requests = 0
+        self.throttled_seconds = 0.0
+
+    def install(self, client: Github):
+        """Route every request of `client` through the governor."""
+        requester = client.requester
+        request = requester.requestJsonAndCheck
+
+        @functools.wraps(request)
+        def governed_request(verb: str, url: str, *args, **kwargs):
+            return self.call(request, verb, url, *args, **kwargs)
+
+        requester.requestJsonAndCheck = governed_request
+
+    def call(
+        self, request: Callable[..., Tuple[Dict[str, Any], Any]], verb: str, url: str, *args, **kwargs
+    ) -> Tuple[Dict[str, Any], Any]:
+        resource = _get_resource(url)
+        for attempt in range(self.max_retries + 1):
+            self._wait(resource)
+            with self._slots:
+                try:
+                    headers, data = request(verb, url, *args, **kwargs)
+                except GithubException as e:
+                    self._update(resource, e.headers)
+                    backoff = self._get_backoff(e, attempt)
+                    if backoff is None or attempt == self.max_retries:
+                        raise
+                    get_logger().warning(
+                        f"GitHub rate limit hit for {resource} requests, retrying in {backoff:.0f} seconds"
+                    )
+                    with self._lock:
+                        self.rate_limited_requests += 1
+                        self._paused_until = max(self._paused_until, time.time() + backoff)
+                    continue
+                finally:
+                    with self._lock:
+                        self.requests += 1
+            self._update(resource, headers)
+            return headers, data
+
+    def _wait(self, resource: str):
+        with self._lock:
+            now = time.time()
+            start_at = max(now, self._paused_until, self._next_request_at.get(resource, 0.0))
+            self._next_request_at[resource] = start_at + self._get_interval(resource, start_at)
+            delay = start_at - now
+            self.throttled_seconds += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def _get_interval(self, resource: str, now: float) -> float:
+        """Spacing between requests needed to make the remaining budget last until the reset."""
+        budget = self._budgets.get(resource)
+        if budget is None or None in (budget.limit, budget.remaining, budget.reset_at):
+            return 0.0
+        time_to_reset = max(budget.reset_at - now, 0.0)
+        if budget.remaining <= self.reserve:
+            # Budget exhausted, nothing may be sent before the reset
+            return time_to_reset
+        if budget.remaining > budget.limit * self.low_watermark:
+            return 0.0
+        # Count the request being scheduled against the budget
+        budget.remaining -= 1
+        return time_to_reset / (budget.remaining - self.reserve + 1)
+
+    def _update(self, resource: str, headers: Optional[Dict[str, Any]]):
+        if not headers:
+            return
+        headers = {key.lower(): value for key, value in headers.items()}
+        if "x-ratelimit-remaining" not in headers:
+            return
+        resource = headers.get("x-ratelimit-resource", resource)
+        with self._lock:
+            budget = self._budgets.setdefault(resource, RateLimitBudget())
+            budget.limit = int(headers.get("x-ratelimit-limit", budget.limit or 0))
+            budget.remaining = int(headers["x-ratelimit-remaining"])
+            if "x-ratelimit-reset" in headers:
+                budget.reset_at = float(headers["x-ratelimit-reset"])
+
+    def _get_backoff(self, exception: GithubException, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying a rejected request, or None if it should not be retried."""
+        headers = {key.lower(): value for key, value in (exception.headers or {}).items()}
+        is_rate_limited = isinstance(exception, RateLimitExceededException) or (
+            exception.status in (403, 429) and "rate limit" in str(exception.data).lower()
+        )
+        if not is_rate_limited:
+            return None
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+        if headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+            return max(float(headers["x-ratelimit-reset"]) - time.time(), 0.0) + 1
+        return SECONDARY_RATE_LIMIT_BACKOFF_SEC * 2**attempt
+
+    def get_budget(self) -> Dict[str, Dict[str, Any]]:
+        """Current rate limit budget per resource, plus governor counters."""
+        with self._lock:
+            budget: Dict[str, Dict[str, Any]] = {
+                resource: asdict(resource_budget)
+                for resource, resource_budget in self._budgets.items()
+            }
+            budget["governor"] = {
+                "requests": self.requests,
+                "rate_limited_requests": self.rate_limited_requests,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+            }
+        return budget
+
+
+def _get_resource(url: str) -> str:
+    if url.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in url:
+        return "search"
+    return "core"
@@ -0,0 +1,99 @@
+import functools
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from github import Github
+
+
+class ObjectRegistry:
+    """
+    Thread-safe, per-run memo of lazily loaded API objects.
+
+    Each key is loaded at most once, even when several workers ask for it at
+    the same time; later lookups return the stored object.
+    """
+
+    def __init__(self):
+        self._objects: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._objects:
+                return self._objects[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._objects:
+                    return self._objects[key]
+            value = load()
+            with self._lock:
+                self._objects[key] = value
+                self._key_locks.pop(key, None)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._objects[key] = value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._objects
+
+
+class RequestCounter:
+    """
+    Records the API requests sent while it is active.
+
+    Example:
+        with provider.count_requests() as counter:
+            provider.get_diff_files(pr_url)
+        assert counter.total == 5
+    """
+
+    def __init__(self):
+        self.requests: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def record(self, verb: str, url: str):
+        with self._lock:
+            self.requests.append((verb, url))
+
+    @property
+    def total(self) -> int:
+        return len(self.requests)
+
+    def by_url(self) -> Counter:
+        return Counter(url for _, url in self.requests)
+
+
+class RequestListeners:
+    """Notifies registered listeners of every request sent by a PyGithub client."""
+
+    def __init__(self):
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._lock = threading.Lock()
+
+    def install(self, client: Github):
+        requester = client.requester
+        request = requester.requestJsonAndCheck
+
+        @functools.wraps(request)
+        def observed_request(verb: str, url: str, *args, **kwargs):
+            with self._lock:
+                listeners = list(self._listeners)
+            for listener in listeners:
+                listener(verb, url)
+            return request(verb, url, *args, **kwargs)
+
+        requester.requestJsonAndCheck = observed_request
+
+    def add(self, listener: Callable[[str, str], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove(self, listener: Callable[[str, str], None]):
+        with self._lock:
+            self._listeners.remove(listener)
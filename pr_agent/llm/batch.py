@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+import litellm
+
+if TYPE_CHECKING:
+    from pr_agent.llm.litellm import LiteLLMModel
+
+logger = logging.getLogger(__name__)
+
+# Chat completions endpoint of the providers whose batch API takes OpenAI-format
+# request files. Vertex AI and Bedrock expect their own request formats.
+BATCH_PROVIDERS = {
+    "openai": "/v1/chat/completions",
+    "azure": "/chat/completions",
+}
+_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+_STATE_VERSION = 1
+# Completion arguments sent in the body of every batch request
+_BODY_PARAMS = (
+    "messages",
+    "tools",
+    "tool_choice",
+    "temperature",
+    "top_p",
+    "max_completion_tokens",
+    "max_tokens",
+    "response_format",
+    "seed",
+    "stop",
+)
+
+
+class BatchJob:
+    """
+    Reviews submitted through the provider's batch API instead of one request each.
+
+    Batch requests cost about half as much as regular requests and do not
+    count against the regular rate limits, but results arrive within the
+    completion window (up to 24 hours). Meant for offline backfills where
+    latency does not matter.
+
+    Every step (request file written, file uploaded, batch created, batch
+    finished, results downloaded) is recorded in a JSON state file, so a
+    process that dies resumes the same batch instead of paying for it again.
+    Requests answered by the response cache are not submitted.
+
+    Args:
+        llm: Model answering the requests
+        state_path: State file of the batch; the request file is written next to it
+        poll_interval: Seconds between two status checks of the batch
+        completion_window: Time frame within which the batch must finish
+    """
+
+    def __init__(
+        self,
+        llm: LiteLLMModel,
+        state_path: Union[str, Path],
+        poll_interval: float = 60.0,
+        completion_window: str = "24h",
+    ):
+        self.llm = llm
+        self.state_path = Path(state_path).expanduser()
+        self.requests_path = self.state_path.with_suffix(".jsonl")
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.model_name, self.provider, _, _ = litellm.get_llm_provider(
+            llm.model, api_base=llm.base_url
+        )
+        if self.provider not in BATCH_PROVIDERS:
+            raise ValueError(
+                f"Model {llm.model} of provider {self.provider} does not support the batch API"
+            )
+        self.endpoint = BATCH_PROVIDERS[self.provider]
+
+    def _provider_kwargs(self) -> Dict[str, Any]:
+        kwargs = {"custom_llm_provider": self.provider, "api_key": self.llm.api_key}
+        if self.llm.base_url is not None:
+            kwargs["api_base"] = self.llm.base_url
+        return kwargs
+
+    def _load_state(self) -> Optional[Dict[str, Any]]:
+        if not self.state_path.exists():
+            return None
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if state.get("version") != _STATE_VERSION:
+            raise ValueError(f"Unsupported batch state file {self.state_path}")
+        return state
+
+    def _save_state(self, state: Dict[str, Any]):
+        # Written to a temporary file first, a crash never leaves a truncated state
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _new_state(self, requests: Dict[str, List[Dict[str, str]]]) -> Dict[str, Any]:
+        state: Dict[str, Any] = {
+            "version": _STATE_VERSION,
+            "model": self.llm.model,
+            "keys": sorted(requests),
+            "custom_ids": {},
+            "input_file_id": None,
+            "batch_id": None,
+            "status": None,
+            "output_file_id": None,
+            "error_file_id": None,
+            "downloaded": False,
+            "results": {},
+            "errors": {},
+        }
+        lines = []
+        for key, messages in requests.items():
+            messages, completion_kwargs, _ = self.llm._setup_query(messages)
+            cache_key, response = self.llm._get_cached_response(completion_kwargs)
+            if response is not None:
+                state["results"][key] = self.llm._process_response(
+                    messages, response, record_stats=False
+                )
+                continue
+            body = {
+                name: completion_kwargs[name]
+                for name in _BODY_PARAMS
+                if completion_kwargs.get(name) is not None
+            }
+            # Bodies are sent as is, not through litellm.completion, which would
+            # drop the prompt cache markers for providers that do not take them
+            body["messages"] = messages
+            body["model"] = self.model_name
+            custom_id = f"request-{len(state['custom_ids'])}"
+            state["custom_ids"][custom_id] = {"key": key, "cache_key": cache_key}
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": self.endpoint,
+                        "body": body,
+                    }
+                )
+            )
+        self.requests_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.requests_path, "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+        return state
+
+    def _read_file(self, file_id: str) -> List[Dict[str, Any]]:
+        content = litellm.file_content(file_id=file_id, **self._provider_kwargs())
+        return [json.loads(line) for line in content.content.decode().splitlines() if line.strip()]
+
+    def _cost(self, response: litellm.types.utils.ModelResponse) -> float:
+        try:
+            prompt_cost, completion_cost = litellm.cost_calculator.batch_cost_calculator(
+                response.usage, self.llm.model
+            )
+        except Exception as e:
+            logger.debug(f"Failed to compute batch cost of response: {e}")
+            return 0.0
+        return prompt_cost + completion_cost
+
+    def _collect_results(self, state: Dict[str, Any]):
+        lines = []
+        for file_id in (state["output_file_id"], state["error_file_id"]):
+            if file_id:
+                lines.extend(self._read_file(file_id))
+        for line in lines:
+            request = state["custom_ids"].get(line.get("custom_id"))
+            if request is None:
+                continue
+            key = request["key"]
+            response = line.get("response") or {}
+            if line.get("error") or response.get("status_code") != 200:
+                error = line.get("error") or response.get("body", {}).get("error")
+                state["errors"][key] = str(error)
+                continue
+            output = litellm.types.utils.ModelResponse(**response["body"])
+            self.llm._cache_response(request["cache_key"], output)
+            self.llm.update_stats([], output, cost=self._cost(output))
+            state["results"][key] = self.llm._process_response([], output, record_stats=False)
+        for request in state["custom_ids"].values():
+            key = request["key"]
+            if key not in state["results"] and key not in state["errors"]:
+                state["errors"][key] = f"No result, batch {state['status']}"
+
+    def run(
+        self, requests: Dict[str, List[Dict[str, str]]], timeout: Optional[float] = None
+    ) -> Dict[str, str]:
+        """Answer the requests through one batch, resuming it from the state file if there is one.
+
+        Args:
+            requests: Messages of every request by a key identifying it (e.g. the PR URL)
+            timeout: Seconds to wait for the batch to finish, or None to wait
+                for the whole completion window
+
+        Returns:
+            Answers by request key; failed requests are logged and left out
+
+        Raises:
+            ValueError: If the state file belongs to a batch of other requests
+            TimeoutError: If the batch did not finish within `timeout`; run
+                again later to resume waiting
+        """
+        state = self._load_state()
+        if state is None:
+            state = self._new_state(requests)
+            self._save_state(state)
+        elif state["keys"] != sorted(requests):
+            raise ValueError(
+                f"Batch state file {self.state_path} belongs to other requests, remove it to start over"
+            )
+        else:
+            logger.info(f"Resuming batch {state['batch_id'] or 'submission'} from {self.state_path}")
+
+        if state["custom_ids"] and not state["downloaded"]:
+            self._submit(state)
+            self._wait(state, timeout)
+            self._collect_results(state)
+            state["downloaded"] = True
+            self._save_state(state)
+
+        for key, error in state["errors"].items():
+            logger.warning(f"Batch request {key} failed: {error}")
+        return state["results"]
+
+    def _submit(self, state: Dict[str, Any]):
+        if state["input_file_id"] is None:
+            with open(self.requests_path, "rb") as f:
+                file = litellm.create_file(file=f, purpose="batch", **self._provider_kwargs())
+            state["input_file_id"] = file.id
+            self._save_state(state)
+        if state["batch_id"] is None:
+            batch = litellm.create_batch(
+                completion_window=self.completion_window,
+                endpoint=self.endpoint,
+                input_file_id=state["input_file_id"],
+                **self._provider_kwargs(),
+            )
+            state["batch_id"], state["status"] = batch.id, batch.status
+            self._save_state(state)
+            logger.info(f"Submitted batch {batch.id} of {len(state['custom_ids'])} requests")
+
+    def _wait(self, state: Dict[str, Any], timeout: Optional[float]):
+        started_at = time.monotonic()
+        while True:
+            batch = litellm.retrieve_batch(batch_id=state["batch_id"], **self._provider_kwargs())
+            if batch.status != state["status"]:
+                logger.info(f"Batch {batch.id} is {batch.status}")
+            state["status"] = batch.status
+            state["output_file_id"] = batch.output_file_id
+            state["error_file_id"] = batch.error_file_id
+            self._save_state(state)
+            if batch.status in _TERMINAL_STATUSES:
+                return
+            if timeout is not None and time.monotonic() - started_at + self.poll_interval > timeout:
+                raise TimeoutError(f"Batch {batch.id} did not finish within {timeout} seconds")
+            time.sleep(self.poll_interval)
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Completion arguments that change the response. Credentials, metadata and
+# other transport options are left out of the cache key.
+_KEY_PARAMS = (
+    "model",
+    "base_url",
+    "tools",
+    "tool_choice",
+    "temperature",
+    "top_p",
+    "max_completion_tokens",
+    "max_tokens",
+    "response_format",
+    "seed",
+    "stop",
+    "n",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+    "reasoning_effort",
+)
+
+
+def normalize_messages(messages: list[dict]) -> list[dict]:
+    """Drop empty fields and surrounding whitespace that do not change what the model sees."""
+    normalized = []
+    for message in messages:
+        message = {k: v for k, v in message.items() if v is not None}
+        if isinstance(message.get("content"), str):
+            message["content"] = message["content"].strip()
+        normalized.append(message)
+    return normalized
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses: an in-memory LRU in front of SQLite on local disk.
+
+    Responses are keyed by a hash of the model, the normalized messages, the
+    tools and the sampling parameters, so re-running a review over the same
+    diff does not pay again for an identical prompt. Only deterministic
+    requests are cached: those with temperature explicitly set to 0 or with a
+    seed. Without a temperature the provider's default applies, which
+    usually samples.
+
+    Args:
+        path: SQLite database file
+        max_size_mb: Upper bound for the total size of stored responses; least
+            recently used responses are evicted first
+        ttl_seconds: Age after which a response expires, or None to keep it
+            until it is evicted
+        memory_entries: Number of responses kept in memory
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size_mb: int = 256,
+        ttl_seconds: Optional[float] = None,
+        memory_entries: int = 128,
+    ):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_cacheable(completion_kwargs: Dict[str, Any]) -> bool:
+        if completion_kwargs.get("stream"):
+            return False
+        return (
+            completion_kwargs.get("temperature") == 0
+            or completion_kwargs.get("seed") is not None
+        )
+
+    @staticmethod
+    def make_key(completion_kwargs: Dict[str, Any]) -> str:
+        request = {
+            name: completion_kwargs[name]
+            for name in _KEY_PARAMS
+            if completion_kwargs.get(name) is not None
+        }
+        request["messages"] = normalize_messages(completion_kwargs["messages"])
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """Serialized response stored under `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._is_expired(entry[0], now):
+                del self._memory[key]
+                entry = None
+            if entry is None:
+                row = self._connection.execute(
+                    "SELECT created_at, response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._is_expired(row[0], now):
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._memory.move_to_end(key)
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode())
+        if size > self.max_size_bytes:
+            return
+        with self._lock:
+            self._remember(key, (now, response))
+            try:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now, now),
+                )
+                self._evict(now)
+                self._connection.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to store LLM response in cache: {e}")
+
+    def _remember(self, key: str, entry: tuple[float, str]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        if self.ttl_seconds is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        (total_size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total_size <= self.max_size_bytes:
+            return
+        evicted = []
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        for (key,) in evicted:
+            self._memory.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,2 +1,6 @@
 class ContextWindowExceededError(Exception):
-    """Exception raised when the context window is exceeded."""
\ No newline at end of file
+    """Exception raised when the context window is exceeded."""
+
+
+class CircuitOpenError(Exception):
+    """Exception raised when requests to a provider are suspended after repeated failures."""
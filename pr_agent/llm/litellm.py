@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import contextlib
 import copy
 import json
 import logging
 import os
-import pprint
 import re
+import time
 import uuid
 from datetime import datetime
-from typing import Any, Dict, Iterable, List, Optional, Tuple, TypeVar, Union, overload
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    overload,
+)
 
 import instructor
 import litellm
@@ -16,21 +29,25 @@ import litellm.exceptions
 import litellm.types.utils
 from instructor.dsl.partial import Partial
 from pydantic import BaseModel, Field
-from tenacity import (
-    retry,
-    retry_if_not_exception_type,
-    stop_after_attempt,
-    wait_random_exponential,
-)
 
+from pr_agent.llm.batch import BatchJob
+from pr_agent.llm.cache import ResponseCache
 from pr_agent.llm.exception import ContextWindowExceededError
+from pr_agent.llm.retry import CircuitBreaker, RetryPolicy, get_circuit_breaker
+from pr_agent.llm.routing import RouteTarget, Router
+from pr_agent.llm.scheduler import RequestScheduler
+from pr_agent.llm.stats import APIStats
+from pr_agent.llm.tokens import get_token_counter
 
 T = TypeVar("T", bound=Union[BaseModel, "Iterable[Any]", "Partial[Any]"])
 
 logger = logging.getLogger(__name__)
-_MAX_RETRUES = 0
 _MAX_INPUT_TOKENS_DEFAULT = 8000
 _MAX_OUTPUT_TOKENS_DEFAULT = 4000
+# Providers that only cache prompt prefixes marked with cache_control
+_EXPLICIT_PROMPT_CACHE_PROVIDERS = {"anthropic", "bedrock", "vertex_ai", "openrouter"}
+# Cache breakpoints allowed per request by these providers (Anthropic models)
+_MAX_PROMPT_CACHE_MARKERS = 4
 
 # Disable litellm's verbose logging
 os.environ["LITELLM_LOG"] = os.getenv("LITELLM_LOG", "WARNING")
@@ -44,50 +61,110 @@ if LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY:
     litellm.failure_callback = ["langfuse"]
 
 
-def _get_non_retryable_exceptions() -> tuple:
-    """Get the tuple of exceptions that should not be retried.
+_FILE_HEADER_PATTERN = re.compile(r"^## File: (.+)$", re.MULTILINE)
 
-    Returns:
-        tuple: A tuple of exception classes that should not trigger a retry.
-    """
-    base_exceptions = [
-        RuntimeError,
-        litellm.exceptions.NotFoundError,
-        litellm.exceptions.PermissionDeniedError,
-        litellm.exceptions.ContextWindowExceededError,
-        litellm.exceptions.APIError,
-    ]
 
-    # Conditionally add UnsupportedParamsError if available
-    if hasattr(litellm.exceptions, "UnsupportedParamsError"):
-        base_exceptions.append(litellm.exceptions.UnsupportedParamsError)
+class ClipResult(BaseModel):
+    text: str
+    total_tokens: int
+    kept_tokens: int
+    # Files whose section was dropped entirely, and the file cut in the middle
+    dropped_files: List[str] = Field(default_factory=list)
+    truncated_file: Optional[str] = None
 
-    return tuple(base_exceptions)
+    @property
+    def dropped_tokens(self) -> int:
+        return self.total_tokens - self.kept_tokens
 
+    @property
+    def clipped(self) -> bool:
+        return self.kept_tokens < self.total_tokens
 
-def clip_text(
+
+def clip_text_with_result(
     text: str,
     model: str = "openai/gpt-4o",
     max_tokens: Optional[int] = None,
     trim_ratio: float = 0.75,
-) -> str:
+    snap_to: Optional[str] = None,
+) -> ClipResult:
+    """Clip `text` to `trim_ratio * max_tokens` tokens of `model`.
+
+    The text is encoded once and cut at the exact token boundary. With
+    `snap_to="line"` the cut moves back to the last complete line, with
+    `snap_to="file"` to the start of the last `## File:` section that does
+    not fit (or the last complete line if the first section does not fit).
+
+    Args:
+        max_tokens: Token budget, defaults to the model's max input tokens
+        trim_ratio: Fraction of the budget the text may use
+        snap_to: None, "line" or "file"
+    """
+    if snap_to not in (None, "line", "file"):
+        raise ValueError(f"Unknown clip boundary: {snap_to}")
     if max_tokens is None:
-        if model in litellm.model_cost:
-            max_tokens_for_model = litellm.model_cost[model].get(
-                "max_input_tokens", litellm.model_cost[model]["max_tokens"]
-            )
-            max_tokens = int(max_tokens_for_model * trim_ratio)
-        else:
+        if model not in litellm.model_cost:
             # if user did not specify max (input) tokens
             # or passed an llm litellm does not know
             # do nothing, just return text
-            return text
-    max_tokens = int(trim_ratio * max_tokens)
-    tokens = litellm.utils.token_counter(model=model, text=text)
-    if tokens <= max_tokens:
-        return text
-    else:
-        return text[:max_tokens]
+            return ClipResult(text=text, total_tokens=0, kept_tokens=0)
+        max_tokens = litellm.model_cost[model].get(
+            "max_input_tokens", litellm.model_cost[model]["max_tokens"]
+        )
+    max_tokens = max(int(trim_ratio * max_tokens), 0)
+    counter = get_token_counter(model)
+    tokens = counter.encode(text)
+    if len(tokens) <= max_tokens:
+        return ClipResult(text=text, total_tokens=len(tokens), kept_tokens=len(tokens))
+
+    kept_tokens = max_tokens
+    clipped = counter.decode(tokens[:kept_tokens])
+    # A multi-byte character split between tokens decodes to a replacement character
+    while clipped.endswith("\ufffd") and kept_tokens > 0:
+        kept_tokens -= 1
+        clipped = counter.decode(tokens[:kept_tokens])
+
+    if snap_to is not None:
+        boundary = -1
+        if snap_to == "file":
+            headers = [m.start() for m in _FILE_HEADER_PATTERN.finditer(clipped)]
+            if headers and headers[-1] > 0:
+                boundary = headers[-1]
+        if boundary < 0:
+            boundary = clipped.rfind("\n") + 1
+        if 0 < boundary < len(clipped):
+            clipped = clipped[:boundary]
+            kept_tokens = len(counter.encode(clipped))
+
+    kept_files = _FILE_HEADER_PATTERN.findall(clipped)
+    all_files = _FILE_HEADER_PATTERN.findall(text)
+    dropped_files = all_files[len(kept_files) :]
+    truncated_file = None
+    if kept_files:
+        next_header = _FILE_HEADER_PATTERN.search(text, len(clipped))
+        if text[len(clipped) : next_header.start() if next_header else None].strip():
+            truncated_file = kept_files[-1]
+    logger.info(
+        f"Clipped text from {len(tokens)} to {kept_tokens} tokens, "
+        f"dropped {len(dropped_files)} files"
+    )
+    return ClipResult(
+        text=clipped,
+        total_tokens=len(tokens),
+        kept_tokens=kept_tokens,
+        dropped_files=dropped_files,
+        truncated_file=truncated_file,
+    )
+
+
+def clip_text(
+    text: str,
+    model: str = "openai/gpt-4o",
+    max_tokens: Optional[int] = None,
+    trim_ratio: float = 0.75,
+    snap_to: Optional[str] = None,
+) -> str:
+    return clip_text_with_result(text, model, max_tokens, trim_ratio, snap_to).text
 
 
 def trim_messages(
@@ -123,74 +200,77 @@ def trim_messages(
         else:
             break
     messages = messages[len(first_user_messages) :]
+    counter = get_token_counter(model)
     start_messages = system_messages + first_user_messages
-    start_tokens = litellm.utils.token_counter(model=model, messages=start_messages)
+    start_tokens = counter.count_messages(start_messages)
     if start_tokens > max_tokens:
         logger.warning(
             f"System and user messages tokens {start_tokens} are greater than max tokens {max_tokens}"
         )
         start_messages = system_messages
-        start_tokens = litellm.utils.token_counter(model=model, messages=start_messages)
+        start_tokens = counter.count_messages(start_messages)
         if start_tokens > max_tokens:
             logger.warning(
                 f"System messages tokens {start_tokens} are greater than max tokens {max_tokens}"
             )
             return messages
-    last_tool_call: dict[str, Any] = {}
-    current_tokens = start_tokens + litellm.utils.token_counter(
-        model=model, messages=messages
-    )
-    while current_tokens > max_tokens:
-        removing_messages = []
-        removing_messages.append(messages.pop(0))
-        if removing_messages[0]["role"] != "tool":
-            removing_messages.append(last_tool_call)
-            last_tool_call = {}
-        if removing_messages[0].get("tool_calls"):
-            removing_messages.pop(0)
-            last_tool_call = removing_messages[0]
-        else:
-            current_tokens -= litellm.utils.token_counter(
-                model=model, messages=removing_messages
-            )
-    if messages and messages[0]["role"] == "tool":
-        messages = start_messages + messages + [last_tool_call]
-    else:
-        messages = start_messages + messages
+    # Drop the oldest messages until the rest fits. Tool results are dropped
+    # together with the call they answer, so none is left without its call.
+    prefix_sums = counter.prefix_sums(messages)
+    total_tokens = prefix_sums[-1]
+    cut = 0
+    while cut < len(messages) and start_tokens + total_tokens - prefix_sums[cut] > max_tokens:
+        cut += 1
+        while cut < len(messages) and messages[cut]["role"] == "tool":
+            cut += 1
+    current_tokens = start_tokens + total_tokens - prefix_sums[cut]
+    messages = start_messages + messages[cut:]
     logger.info(f"Current tokens {current_tokens}")
     return messages
 
 
-class APIStats(BaseModel):
-    model: str
-    base_url: str | None = None
-    total_cost: float = 0.0
-    input_tokens: int = 0
-    output_tokens: int = 0
-    api_calls: int = 0
-    history: list = Field(default_factory=list)
+def add_prompt_cache_markers(messages: list[dict]) -> list[dict]:
+    """Mark the leading system messages as a cacheable prompt prefix.
 
-    def __add__(self, other: APIStats) -> APIStats:
-        if not isinstance(other, APIStats):
-            raise TypeError(
-                f"Can only add APIStats with APIStats, got type {type(other)}"
-            )
-        return APIStats(
-            **{
-                field_name: getattr(self, field_name) + getattr(other, field_name)
-                for field_name in self.model_fields.keys()
+    The breakpoint goes on the last system message, so providers that need
+    explicit markers cache everything up to and including it. Messages that
+    already carry as many markers as providers accept are left unmarked, as
+    one more would get the request rejected.
+    """
+    if _count_prompt_cache_markers(messages) >= _MAX_PROMPT_CACHE_MARKERS:
+        return messages
+    last_system = -1
+    for i, message in enumerate(messages):
+        if message["role"] != "system":
+            break
+        last_system = i
+    if last_system < 0 or not isinstance(messages[last_system].get("content"), str):
+        return messages
+    messages = list(messages)
+    messages[last_system] = {
+        **messages[last_system],
+        "content": [
+            {
+                "type": "text",
+                "text": messages[last_system]["content"],
+                "cache_control": {"type": "ephemeral"},
             }
-        )
+        ],
+    }
+    return messages
 
-    def __str__(self):
-        return (
-            f"Model: {self.model}\n"
-            f"Base URL: {self.base_url}\n"
-            f"Total cost: {self.total_cost:.2f}\n"
-            f"Input tokens: {self.input_tokens:,}\n"
-            f"Output tokens: {self.output_tokens:,}\n"
-            f"API calls: {self.api_calls:,}\n"
-        )
+
+def _count_prompt_cache_markers(messages: list[dict]) -> int:
+    count = 0
+    for message in messages:
+        count += "cache_control" in message
+        if isinstance(message.get("content"), list):
+            count += sum(
+                1
+                for block in message["content"]
+                if isinstance(block, dict) and "cache_control" in block
+            )
+    return count
 
 
 class LiteLLMModel:
@@ -204,6 +284,13 @@ class LiteLLMModel:
         top_p: float | None = None,
         register_model: Optional[Dict[str, Any]] = None,
         session_id: str | None = None,
+        cache: Optional[Dict[str, Any]] = None,
+        rate_limit: Optional[Dict[str, Any]] = None,
+        retry: Optional[Dict[str, Any]] = None,
+        prompt_caching: bool = True,
+        stats: Optional[Dict[str, Any]] = None,
+        fallbacks: Optional[List[Dict[str, Any]]] = None,
+        hedge: Optional[Dict[str, Any]] = None,
         **kwargs,
     ):
         self.model = model
@@ -222,7 +309,22 @@ class LiteLLMModel:
         else:
             raise Exception("OpenAI API env variable OPENAI_API_KEY not set")
 
-        self.stats = APIStats(model=self.model, base_url=self.base_url)
+        self.stats = APIStats(model=self.model, base_url=self.base_url, **(stats or {}))
+        self.token_counter = get_token_counter(self.model)
+        self.cache = ResponseCache(**cache) if cache else None
+        self.scheduler = RequestScheduler(**rate_limit) if rate_limit else None
+        self.retry_policy = RetryPolicy(**(retry or {}))
+        # Other providers supporting prompt caching (e.g. OpenAI) cache
+        # identical prompt prefixes automatically, without markers
+        try:
+            _, llm_provider, _, _ = litellm.get_llm_provider(self.model)
+            self.prompt_caching = (
+                prompt_caching
+                and llm_provider in _EXPLICIT_PROMPT_CACHE_PROVIDERS
+                and litellm.utils.supports_prompt_caching(self.model)
+            )
+        except Exception:
+            self.prompt_caching = False
 
         self.model_max_input_tokens = litellm.model_cost.get(self.model, {}).get(
             "max_input_tokens", _MAX_INPUT_TOKENS_DEFAULT
@@ -236,6 +338,32 @@ class LiteLLMModel:
                 f"Using a custom API base: {self.base_url}. "
                 "Cost managment and context length error checking will not work"
             )
+        self.circuit_breaker = self._get_circuit_breaker(self.model, self.base_url)
+        # The model first, then fallbacks in order of preference
+        targets = [
+            RouteTarget(
+                self.model,
+                self.base_url,
+                self.api_key,
+                self.model_max_input_tokens,
+                self.circuit_breaker,
+            )
+        ]
+        for fallback in fallbacks or []:
+            model_info = litellm.model_cost.get(fallback["model"], {})
+            targets.append(
+                RouteTarget(
+                    fallback["model"],
+                    fallback.get("base_url"),
+                    fallback.get("api_key"),
+                    fallback.get(
+                        "max_input_tokens",
+                        model_info.get("max_input_tokens", _MAX_INPUT_TOKENS_DEFAULT),
+                    ),
+                    self._get_circuit_breaker(fallback["model"], fallback.get("base_url")),
+                )
+            )
+        self.router = Router(targets, **(hedge or {}))
         if session_id is None:
             session_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4()}"
 
@@ -258,19 +386,31 @@ class LiteLLMModel:
             if litellm.supports_function_calling(self.model)
             else instructor.Mode.MD_JSON
         )
+        # Instructor calls go through the same path as queries
         self.instructor_client = instructor.from_litellm(
-            litellm.completion, mode=instructor_mode
+            self._instructor_completion, mode=instructor_mode
+        )
+        self.async_instructor_client = instructor.from_litellm(
+            self._ainstructor_completion, mode=instructor_mode
         )
 
     def __repr__(self):
         return f"LiteLLMModel(model={self.model}, base_url={self.base_url})"
 
+    def _get_circuit_breaker(self, model: str, base_url: Optional[str]) -> CircuitBreaker:
+        provider = litellm.model_cost.get(model, {}).get("litellm_provider")
+        return get_circuit_breaker(
+            provider or base_url or model.split("/")[0],
+            self.retry_policy.failure_threshold,
+            self.retry_policy.reset_timeout,
+        )
+
     def count_tokens(
         self, messages: List | None = None, text: str | List[str] | None = None
     ) -> int:
-        return litellm.utils.token_counter(
-            model=self.model, messages=messages, text=text
-        )
+        if messages is not None:
+            return self.token_counter.count_messages(messages)
+        return self.token_counter.count_text(text or "")
 
     @overload
     def create(
@@ -308,14 +448,140 @@ class LiteLLMModel:
     ) -> T | Any:
         """
         Calls the instructor client's create method with pre-configured arguments.
+
+        Every request instructor sends, validation retries included, is
+        trimmed, cached, scheduled, retried and routed like `query`, so
+        `max_retries` only bounds the retries on invalid answers.
         """
+        messages, merged_kwargs = self._get_instructor_kwargs(messages, **kwargs)
+        return self.instructor_client.create(
+            response_model=response_model,
+            messages=messages,
+            max_retries=max_retries,
+            validation_context=validation_context,
+            context=context,
+            strict=strict,
+            **merged_kwargs,
+        )
+
+    def _get_instructor_kwargs(
+        self, messages: List[Dict[str, str]] | str, **kwargs: Any
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
         if isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
         merged_kwargs = {
             **{k: v for k, v in self.completion_kwargs.items() if v is not None},
             **kwargs,
         }
-        model, raw_response = self.instructor_client.create_with_completion(
+        return messages, merged_kwargs
+
+    def _setup_instructor_query(
+        self, messages: List[Dict[str, str]], **kwargs: Any
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any], int]:
+        tools = kwargs.pop("tools", None)
+        tool_choice = kwargs.pop("tool_choice", None)
+        return self._setup_query(messages, tools, tool_choice, **kwargs)
+
+    def _instructor_completion(
+        self, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any
+    ) -> Union[litellm.types.utils.ModelResponse, litellm.CustomStreamWrapper]:
+        """Completion function of the instructor client."""
+        messages, completion_kwargs, input_tokens = self._setup_instructor_query(
+            messages, **kwargs
+        )
+        if stream:
+            # Usage of instructor streams is estimated by the caller
+            stream_kwargs = {**completion_kwargs, "stream": True}
+            with self._scheduled(input_tokens):
+                response, _, _ = self.router.call(
+                    lambda target, is_last: self._open_stream(stream_kwargs, target, is_last),
+                    input_tokens,
+                )
+            return response
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            return response
+        response, latency, target = self._complete(completion_kwargs, input_tokens)
+        self._cache_response(cache_key, response, target)
+        # Answers failing validation are paid for all the same, every call is recorded
+        self.update_stats(
+            messages,
+            response,
+            completion_kwargs.get("tools"),
+            latency=latency,
+            model=target.model,
+        )
+        return response
+
+    async def _ainstructor_completion(
+        self, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any
+    ) -> Union[litellm.types.utils.ModelResponse, litellm.CustomStreamWrapper]:
+        """Completion function of the asynchronous instructor client."""
+        messages, completion_kwargs, input_tokens = self._setup_instructor_query(
+            messages, **kwargs
+        )
+        if stream:
+            stream_kwargs = {**completion_kwargs, "stream": True}
+            async with self._ascheduled(input_tokens):
+                response, _, _ = await self.router.acall(
+                    lambda target, is_last: self._aopen_stream(stream_kwargs, target, is_last),
+                    input_tokens,
+                    self._close_stream,
+                )
+            return response
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            return response
+        response, latency, target = await self._acomplete(completion_kwargs, input_tokens)
+        self._cache_response(cache_key, response, target)
+        self.update_stats(
+            messages,
+            response,
+            completion_kwargs.get("tools"),
+            latency=latency,
+            model=target.model,
+        )
+        return response
+
+    @overload
+    async def acreate(
+        self,
+        response_model: type[T],
+        messages: List[Dict[str, str]] | str,
+        max_retries: int = 3,
+        validation_context: dict[str, Any] | None = None,
+        context: dict[str, Any] | None = None,
+        strict: bool = True,
+        **kwargs: Any,
+    ) -> T: ...
+
+    @overload
+    async def acreate(
+        self,
+        response_model: None,
+        messages: List[Dict[str, str]] | str,
+        max_retries: int = 3,
+        validation_context: dict[str, Any] | None = None,
+        context: dict[str, Any] | None = None,
+        strict: bool = True,
+        **kwargs: Any,
+    ) -> Any: ...
+
+    async def acreate(
+        self,
+        response_model: type[T] | None,
+        messages: List[Dict[str, str]] | str,
+        max_retries: int = 3,
+        validation_context: dict[str, Any] | None = None,
+        context: dict[str, Any] | None = None,
+        strict: bool = True,
+        **kwargs: Any,
+    ) -> T | Any:
+        """
+        Asynchronous version of `create`.
+        """
+        messages, merged_kwargs = self._get_instructor_kwargs(messages, **kwargs)
+        return await self.async_instructor_client.create(
             response_model=response_model,
             messages=messages,
             max_retries=max_retries,
@@ -324,68 +590,137 @@ class LiteLLMModel:
             strict=strict,
             **merged_kwargs,
         )
-        # May be incorrect in counting input tokens
-        # self.update_stats(messages, raw_response)
-        return model
+
+    async def acreate_partial(
+        self,
+        response_model: type[T],
+        messages: List[Dict[str, str]] | str,
+        max_retries: int = 3,
+        context: dict[str, Any] | None = None,
+        strict: bool = True,
+        **kwargs: Any,
+    ) -> AsyncIterator[T]:
+        """Stream `response_model` as it is generated, yielding ever more complete partial objects."""
+        messages, merged_kwargs = self._get_instructor_kwargs(messages, **kwargs)
+        started_at = time.monotonic()
+        last = None
+        async for last in self.async_instructor_client.create_partial(
+            response_model=response_model,
+            messages=messages,
+            max_retries=max_retries,
+            context=context,
+            strict=strict,
+            **merged_kwargs,
+        ):
+            yield last
+        if last is not None:
+            self._record_streamed_usage(
+                messages, last.model_dump_json(), time.monotonic() - started_at
+            )
+
+    async def acreate_iterable(
+        self,
+        response_model: type[T],
+        messages: List[Dict[str, str]] | str,
+        max_retries: int = 3,
+        context: dict[str, Any] | None = None,
+        strict: bool = True,
+        **kwargs: Any,
+    ) -> AsyncIterator[T]:
+        """Stream a list of `response_model` objects, yielding every object once it is complete."""
+        messages, merged_kwargs = self._get_instructor_kwargs(messages, **kwargs)
+        started_at = time.monotonic()
+        items = []
+        async for item in self.async_instructor_client.create_iterable(
+            response_model=response_model,
+            messages=messages,
+            max_retries=max_retries,
+            context=context,
+            strict=strict,
+            **merged_kwargs,
+        ):
+            items.append(item.model_dump_json())
+            yield item
+        self._record_streamed_usage(
+            messages, "\n".join(items), time.monotonic() - started_at
+        )
+
+    def _record_streamed_usage(
+        self, messages: List[Dict[str, str]], output: str, latency: float
+    ):
+        # Instructor consumes the stream, usage is estimated from the parsed output
+        input_tokens = self.token_counter.count_messages(messages)
+        output_tokens = self.token_counter.count_text(output)
+        try:
+            prompt_cost, completion_cost = litellm.cost_per_token(
+                model=self.model,
+                prompt_tokens=input_tokens,
+                completion_tokens=output_tokens,
+            )
+        except Exception as e:
+            logger.debug(f"Failed to compute cost of streamed response: {e}")
+            prompt_cost, completion_cost = 0.0, 0.0
+        self.stats.record_call(
+            model=self.model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost=prompt_cost + completion_cost,
+            latency=latency,
+            input=messages,
+            output=output,
+        )
 
     def update_stats(
         self,
         input: List[Dict[str, str]],
         output: litellm.types.utils.ModelResponse,
         tools: Optional[List] = None,
+        latency: Optional[float] = None,
+        cost: Optional[float] = None,
+        model: Optional[str] = None,
     ) -> float:
-        cost = litellm.cost_calculator.completion_cost(
-            model=self.model, completion_response=output
-        )
-        self.stats.total_cost += cost
-        if output.usage is not None:  # type: ignore
-            try:
-                self.stats.input_tokens += getattr(output.usage, "prompt_tokens", 0)
-                self.stats.output_tokens += getattr(
-                    output.usage, "completion_tokens", 0
-                )
-            except (AttributeError, TypeError):
-                # Fallback to token counting if usage object doesn't have expected attributes
-                self.stats.input_tokens += litellm.utils.token_counter(
-                    model=self.model, messages=input, tools=tools
-                )
-                assert isinstance(output.choices[0], litellm.types.utils.Choices), (
-                    f"LiteLLMModel not support {type(output.choices[0])}."
-                )
-                self.stats.output_tokens += litellm.utils.token_counter(
-                    model=self.model, text=output.choices[0].message.content
-                )
-        else:
-            self.stats.input_tokens += litellm.utils.token_counter(
-                model=self.model, messages=input, tools=tools
-            )
-            assert isinstance(output.choices[0], litellm.types.utils.Choices), (
-                f"LiteLLMModel not support {type(output.choices[0])}."
-            )
-            self.stats.output_tokens += litellm.utils.token_counter(
-                model=self.model, text=output.choices[0].message.content
-            )
-        self.stats.api_calls += 1
+        """Record a completed API call in `stats`.
 
-        try:
-            input_tokens = getattr(output.usage, "prompt_tokens", 0)
-            output_tokens = getattr(output.usage, "completion_tokens", 0)
-        except (AttributeError, TypeError):
-            input_tokens = litellm.utils.token_counter(
-                model=self.model, messages=input, tools=tools
-            )
-            output_tokens = litellm.utils.token_counter(
-                model=self.model, text=output.choices[0].message.content
-            )
+        Args:
+            input: Messages of the call
+            output: Response of the call
+            tools: Tools of the call
+            latency: Seconds the call took, or None if unknown
+            cost: Cost of the call, computed from the response if None
+            model: Model that answered, if not the model itself
 
-        self.stats.history.append(
-            {
-                "cost": cost,
-                "input": input,
-                "output": pprint.pformat(output.model_dump_json(), indent=4),
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-            }
+        Returns:
+            Cost of the call
+        """
+        model = model or self.model
+        if cost is None:
+            try:
+                cost = litellm.cost_calculator.completion_cost(
+                    model=model, completion_response=output
+                )
+            except Exception as e:
+                logger.debug(f"Failed to compute cost of response: {e}")
+                cost = 0.0
+        usage = getattr(output, "usage", None)
+        # Fallback to token counting if the response has no usage
+        input_tokens = getattr(usage, "prompt_tokens", None)
+        if not isinstance(input_tokens, int):
+            input_tokens = self.token_counter.count_messages(input)
+        output_tokens = getattr(usage, "completion_tokens", None)
+        content = output.choices[0].message.content if output.choices else None
+        if not isinstance(output_tokens, int):
+            output_tokens = self.token_counter.count_text(content or "")
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.stats.record_call(
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost=cost,
+            latency=latency,
+            cached_input_tokens=getattr(details, "cached_tokens", None) or 0,
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+            input=input,
+            output=content,
         )
         return cost
 
@@ -455,7 +790,7 @@ class LiteLLMModel:
         tool_choice: Optional[str] = None,
         trim: bool = True,
         **kwargs,
-    ) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any], int]:
         if trim:
             # Find the first tool messages and trim them
             messages = trim_messages(
@@ -475,17 +810,17 @@ class LiteLLMModel:
                 f"DEBUG: Trimming messages for model {self.model}, tool_message: {tool_message}"
             )
 
-        input_tokens: int = litellm.utils.token_counter(
-            model=self.model, messages=messages
-        )
+        input_tokens: int = self.token_counter.count_messages(messages)
         print(
             f"DEBUG: Input tokens: {input_tokens}, trim_threshold: {self.model_max_input_tokens * 0.75}"
         )
-        if self.model_max_input_tokens is None:
+        # Fallback models may have a larger context window than the model
+        max_input_tokens = self.router.max_input_tokens
+        if max_input_tokens is None:
             logger.warning(f"No max input tokens found for model {self.model}")
-        elif input_tokens > self.model_max_input_tokens:
+        elif input_tokens > max_input_tokens:
             raise ContextWindowExceededError(
-                f"Input tokens {input_tokens} exceed max tokens {self.model_max_input_tokens}"
+                f"Input tokens {input_tokens} exceed max tokens {max_input_tokens}"
             )
 
         completion_kwargs = {
@@ -502,17 +837,169 @@ class LiteLLMModel:
             )
             completion_kwargs.update({"tools": None, "tool_choice": None})
 
-        return messages, completion_kwargs
+        if self.prompt_caching:
+            completion_kwargs["messages"] = add_prompt_cache_markers(messages)
+
+        return messages, completion_kwargs, input_tokens
+
+    def _scheduled(self, input_tokens: int):
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.slot(input_tokens)
+
+    def _ascheduled(self, input_tokens: int):
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.aslot(input_tokens)
+
+    @staticmethod
+    def _get_request_kwargs(
+        completion_kwargs: Dict[str, Any], timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        request_kwargs = {k: v for k, v in completion_kwargs.items() if v is not None}
+        if timeout is not None:
+            request_kwargs["timeout"] = min(request_kwargs.get("timeout", timeout), timeout)
+        return request_kwargs
+
+    @staticmethod
+    def _get_target_kwargs(
+        completion_kwargs: Dict[str, Any], target: RouteTarget
+    ) -> Dict[str, Any]:
+        target_kwargs = {**completion_kwargs, "model": target.model, "base_url": target.base_url}
+        if target.api_key is not None:
+            target_kwargs["api_key"] = target.api_key
+        return target_kwargs
+
+    def _complete(
+        self, completion_kwargs: Dict[str, Any], input_tokens: int
+    ) -> Tuple[litellm.types.utils.ModelResponse, float, RouteTarget]:
+        """Send a completion request, routed and retried according to the routing and retry policies.
+
+        Returns:
+            The response, the seconds its successful attempt took and the target that answered
+        """
+
+        def call(
+            target: RouteTarget, is_last: bool
+        ) -> Tuple[litellm.types.utils.ModelResponse, float, RouteTarget]:
+            target_kwargs = self._get_target_kwargs(completion_kwargs, target)
+            latency = 0.0
+
+            def attempt(timeout: Optional[float]) -> litellm.types.utils.ModelResponse:
+                nonlocal latency
+                with self._scheduled(input_tokens):
+                    started_at = time.monotonic()
+                    response = litellm.completion(
+                        **self._get_request_kwargs(target_kwargs, timeout)
+                    )
+                    latency = time.monotonic() - started_at
+                    return response
+
+            # Rate limits are not waited out while a fallback is left
+            response = self.retry_policy.call(
+                attempt, target.circuit_breaker, retry_rate_limits=is_last
+            )
+            target.record_latency(latency)
+            return response, latency, target
+
+        return self.router.call(call, input_tokens)
+
+    async def _acomplete(
+        self, completion_kwargs: Dict[str, Any], input_tokens: int
+    ) -> Tuple[litellm.types.utils.ModelResponse, float, RouteTarget]:
+        async def call(
+            target: RouteTarget, is_last: bool
+        ) -> Tuple[litellm.types.utils.ModelResponse, float, RouteTarget]:
+            target_kwargs = self._get_target_kwargs(completion_kwargs, target)
+            latency = 0.0
+
+            async def attempt(timeout: Optional[float]) -> litellm.types.utils.ModelResponse:
+                nonlocal latency
+                async with self._ascheduled(input_tokens):
+                    started_at = time.monotonic()
+                    response = await litellm.acompletion(
+                        **self._get_request_kwargs(target_kwargs, timeout)
+                    )
+                    latency = time.monotonic() - started_at
+                    return response
+
+            response = await self.retry_policy.acall(
+                attempt, target.circuit_breaker, retry_rate_limits=is_last
+            )
+            target.record_latency(latency)
+            return response, latency, target
+
+        async def discard(
+            result: Tuple[litellm.types.utils.ModelResponse, float, RouteTarget],
+        ):
+            # Hedges finishing after the winner are paid for all the same
+            response, latency, target = result
+            self.update_stats(
+                completion_kwargs["messages"],
+                response,
+                completion_kwargs.get("tools"),
+                latency=latency,
+                model=target.model,
+            )
+
+        return await self.router.acall(call, input_tokens, discard)
+
+    def _get_cached_response(
+        self, completion_kwargs: Dict[str, Any]
+    ) -> Tuple[Optional[str], Optional[litellm.types.utils.ModelResponse]]:
+        """Look up a request in the response cache.
+
+        Returns:
+            The cache key, or None if the request must not be cached, and the
+            cached response, or None on a miss
+        """
+        if self.cache is None or not self.cache.is_cacheable(completion_kwargs):
+            return None, None
+        key = self.cache.make_key(completion_kwargs)
+        cached = self.cache.get(key)
+        if cached is None:
+            self.stats.update(cache_misses=1)
+            return key, None
+        response = litellm.types.utils.ModelResponse(**json.loads(cached))
+        self.stats.update(cache_hits=1)
+        try:
+            self.stats.update(
+                cost_saved=litellm.cost_calculator.completion_cost(
+                    model=self.model, completion_response=response
+                )
+            )
+        except Exception as e:
+            logger.debug(f"Failed to compute cost of cached response: {e}")
+        return key, response
+
+    def _cache_response(
+        self,
+        key: Optional[str],
+        response: litellm.types.utils.ModelResponse,
+        target: Optional[RouteTarget] = None,
+    ):
+        # Answers of fallback models are not replayed as answers of the model
+        if target is not None and target is not self.router.primary:
+            return
+        if key is not None and self.cache is not None:
+            self.cache.set(key, response.model_dump_json())
 
     def _process_response(
         self,
         input: List[Dict[str, str]],
         output: litellm.types.utils.ModelResponse,
         tools: Optional[List] = None,
+        latency: Optional[float] = None,
+        record_stats: bool = True,
+        model: Optional[str] = None,
     ) -> Union[
         str, Tuple[str, List[litellm.types.utils.ChatCompletionMessageToolCall]]
     ]:
-        # self.update_stats(input=input, output=output, tools=tools)
+        # Off for responses replayed from the cache and for those counted by the caller
+        if record_stats:
+            self.update_stats(
+                input=input, output=output, tools=tools, latency=latency, model=model
+            )
 
         choices = output.choices
         assert isinstance(choices[0], litellm.types.utils.Choices), (
@@ -567,12 +1054,6 @@ class LiteLLMModel:
         **kwargs,
     ) -> Tuple[str, List[litellm.types.utils.ChatCompletionMessageToolCall]]: ...
 
-    @retry(
-        wait=wait_random_exponential(min=60, max=180),
-        reraise=True,
-        stop=stop_after_attempt(_MAX_RETRUES),
-        retry=retry_if_not_exception_type(_get_non_retryable_exceptions()),
-    )
     def query(
         self,
         messages: Union[List[Dict[str, str]], str],
@@ -598,20 +1079,236 @@ class LiteLLMModel:
         if isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
 
-        messages, completion_kwargs = self._setup_query(
+        messages, completion_kwargs, input_tokens = self._setup_query(
             messages, tools, tool_choice, trim, **kwargs
         )
-        try:
-            response = litellm.completion(
-                **{k: v for k, v in completion_kwargs.items() if v is not None}
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            return self._process_response(
+                messages, response, completion_kwargs.get("tools"), record_stats=False
             )
+        try:
+            response, latency, target = self._complete(completion_kwargs, input_tokens)
         except Exception as e:
             logger.exception(f"Error during LLM query: {e}")
             raise e
+        self._cache_response(cache_key, response, target)
 
         return self._process_response(
-            messages, response, completion_kwargs.get("tools")
+            messages,
+            response,
+            completion_kwargs.get("tools"),
+            latency=latency,
+            model=target.model,
+        )
+
+    @staticmethod
+    def _stream_kwargs(completion_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        # Usage is sent in the last chunk only when asked for
+        return {**completion_kwargs, "stream": True, "stream_options": {"include_usage": True}}
+
+    @staticmethod
+    def _stream_delta(chunk: litellm.types.utils.ModelResponseStream) -> str:
+        if not chunk.choices:
+            return ""
+        return chunk.choices[0].delta.content or ""
+
+    def _finish_stream(
+        self,
+        messages: List[Dict[str, str]],
+        chunks: List[litellm.types.utils.ModelResponseStream],
+        cache_key: Optional[str],
+        latency: float,
+        target: RouteTarget,
+        completed: bool,
+    ):
+        """Record a stream in the stats, and cache it and its latency if it completed.
+
+        Streams stopped early are charged for the chunks received, with
+        usage counted from their text as the usage chunk never arrived.
+        """
+        try:
+            response = litellm.stream_chunk_builder(chunks, messages=messages)
+        except Exception as e:
+            logger.warning(f"Failed to rebuild streamed response: {e}")
+            return
+        if response is None:
+            return
+        self.update_stats(messages, response, latency=latency, model=target.model)
+        if completed:
+            target.record_latency(latency)
+            self._cache_response(cache_key, response, target)
+
+    def _open_stream(
+        self, stream_kwargs: Dict[str, Any], target: RouteTarget, is_last: bool
+    ) -> Tuple[litellm.CustomStreamWrapper, float, RouteTarget]:
+        target_kwargs = self._get_target_kwargs(stream_kwargs, target)
+        started_at = 0.0
+
+        def attempt(timeout: Optional[float]) -> litellm.CustomStreamWrapper:
+            nonlocal started_at
+            started_at = time.monotonic()
+            return litellm.completion(**self._get_request_kwargs(target_kwargs, timeout))
+
+        stream = self.retry_policy.call(
+            attempt, target.circuit_breaker, retry_rate_limits=is_last
+        )
+        return stream, started_at, target
+
+    async def _aopen_stream(
+        self, stream_kwargs: Dict[str, Any], target: RouteTarget, is_last: bool
+    ) -> Tuple[litellm.CustomStreamWrapper, float, RouteTarget]:
+        target_kwargs = self._get_target_kwargs(stream_kwargs, target)
+        started_at = 0.0
+
+        async def attempt(timeout: Optional[float]) -> litellm.CustomStreamWrapper:
+            nonlocal started_at
+            started_at = time.monotonic()
+            return await litellm.acompletion(**self._get_request_kwargs(target_kwargs, timeout))
+
+        stream = await self.retry_policy.acall(
+            attempt, target.circuit_breaker, retry_rate_limits=is_last
         )
+        return stream, started_at, target
+
+    @staticmethod
+    async def _close_stream(
+        result: Tuple[litellm.CustomStreamWrapper, float, RouteTarget],
+    ):
+        """Close the stream of a request that lost the hedge."""
+        stream, _, _ = result
+        await stream.aclose()
+
+    def query_stream(
+        self,
+        messages: Union[List[Dict[str, str]], str],
+        trim: bool = True,
+        **kwargs,
+    ) -> Iterator[str]:
+        """Streaming version of `query`, yielding the response text as it is generated.
+
+        Opening the stream is routed and retried like `query`, the stream
+        itself is not. The request holds its scheduler slot until the stream
+        is consumed or closed. Closing the generator early closes the
+        connection, so no more output tokens are paid for; the tokens
+        received are still recorded in the stats. Only complete responses are
+        cached; cached responses are yielded at once.
+
+        Args:
+            messages: Either a list of message dictionaries or a single query string
+            trim: Whether to trim the messages to the model's max input tokens
+            **kwargs: Additional arguments passed to the completion call
+
+        Yields:
+            Pieces of the response text
+        """
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+
+        messages, completion_kwargs, input_tokens = self._setup_query(
+            messages, trim=trim, **kwargs
+        )
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            yield self._process_response(messages, response, record_stats=False)
+            return
+
+        stream_kwargs = self._stream_kwargs(completion_kwargs)
+        with self._scheduled(input_tokens):
+            stream, started_at, target = self.router.call(
+                lambda target, is_last: self._open_stream(stream_kwargs, target, is_last),
+                input_tokens,
+            )
+            chunks = []
+            completed = False
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    if delta := self._stream_delta(chunk):
+                        yield delta
+                completed = True
+            finally:
+                # Also reached on GeneratorExit when the caller stops early
+                if not completed:
+                    close = getattr(stream.completion_stream, "close", None)
+                    if close is not None:
+                        close()
+                self._finish_stream(
+                    messages,
+                    chunks,
+                    cache_key,
+                    time.monotonic() - started_at,
+                    target,
+                    completed,
+                )
+
+    async def aquery_stream(
+        self,
+        messages: Union[List[Dict[str, str]], str],
+        trim: bool = True,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """Asynchronous version of `query_stream`, whose opening is also hedged like `aquery`."""
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+
+        messages, completion_kwargs, input_tokens = self._setup_query(
+            messages, trim=trim, **kwargs
+        )
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            yield self._process_response(messages, response, record_stats=False)
+            return
+
+        stream_kwargs = self._stream_kwargs(completion_kwargs)
+        async with self._ascheduled(input_tokens):
+            stream, started_at, target = await self.router.acall(
+                lambda target, is_last: self._aopen_stream(stream_kwargs, target, is_last),
+                input_tokens,
+                self._close_stream,
+            )
+            chunks = []
+            completed = False
+            try:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    if delta := self._stream_delta(chunk):
+                        yield delta
+                completed = True
+            finally:
+                if not completed:
+                    await stream.aclose()
+                self._finish_stream(
+                    messages,
+                    chunks,
+                    cache_key,
+                    time.monotonic() - started_at,
+                    target,
+                    completed,
+                )
+
+    def query_batch(
+        self,
+        requests: Dict[str, List[Dict[str, str]]],
+        state_path: str,
+        poll_interval: float = 60.0,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, str]:
+        """Answer many requests at once through the provider's batch API.
+
+        Cheaper than `query` but results may take up to 24 hours; the batch is
+        resumed from `state_path` if the process is restarted. See `BatchJob`.
+
+        Args:
+            requests: Messages of every request by a key identifying it
+            state_path: State file of the batch
+            poll_interval: Seconds between two status checks of the batch
+            timeout: Seconds to wait for the batch to finish, or None
+
+        Returns:
+            Answers by request key; failed requests are left out
+        """
+        return BatchJob(self, state_path, poll_interval).run(requests, timeout)
 
     @overload
     async def aquery(
@@ -653,12 +1350,6 @@ class LiteLLMModel:
         **kwargs,
     ) -> Tuple[str, List[litellm.types.utils.ChatCompletionMessageToolCall]]: ...
 
-    @retry(
-        wait=wait_random_exponential(min=60, max=180),
-        reraise=True,
-        stop=stop_after_attempt(_MAX_RETRUES),
-        retry=retry_if_not_exception_type(_get_non_retryable_exceptions()),
-    )
     async def aquery(
         self,
         messages: Union[List[Dict[str, str]], str],
@@ -683,17 +1374,25 @@ class LiteLLMModel:
         if isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
 
-        messages, completion_kwargs = self._setup_query(
+        messages, completion_kwargs, input_tokens = self._setup_query(
             messages, tools, tool_choice, trim, **kwargs
         )
-        try:
-            response = await litellm.acompletion(
-                **{k: v for k, v in completion_kwargs.items() if v is not None}
+        cache_key, response = self._get_cached_response(completion_kwargs)
+        if response is not None:
+            return self._process_response(
+                messages, response, completion_kwargs.get("tools"), record_stats=False
             )
+        try:
+            response, latency, target = await self._acomplete(completion_kwargs, input_tokens)
         except Exception as e:
             logger.exception(f"Error during LLM query: {e}")
             raise e
+        self._cache_response(cache_key, response, target)
 
         return self._process_response(
-            messages, response, completion_kwargs.get("tools")
+            messages,
+            response,
+            completion_kwargs.get("tools"),
+            latency=latency,
+            model=target.model,
         )
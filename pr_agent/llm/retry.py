@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import litellm.exceptions
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    Retrying,
+    retry_if_exception,
+)
+
+from pr_agent.llm.exception import CircuitOpenError, ContextWindowExceededError
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+_TRANSIENT_EXCEPTIONS = (
+    litellm.exceptions.Timeout,
+    litellm.exceptions.APIConnectionError,
+    litellm.exceptions.InternalServerError,
+    litellm.exceptions.ServiceUnavailableError,
+    TimeoutError,
+    ConnectionError,
+)
+# 502 Bad Gateway has no exception class in every supported litellm version
+_TRANSIENT_STATUS_CODES = {408, 409, 425, 500, 502, 503, 504, 529}
+
+
+def classify_error(error: BaseException) -> str:
+    """Whether an LLM call failed on a rate limit, a transient or a permanent error."""
+    if isinstance(error, (CircuitOpenError, ContextWindowExceededError)):
+        return PERMANENT
+    status_code = getattr(error, "status_code", None)
+    if isinstance(error, litellm.exceptions.RateLimitError) or status_code == 429:
+        return RATE_LIMITED
+    if isinstance(error, litellm.exceptions.ContextWindowExceededError):
+        return PERMANENT
+    if isinstance(error, _TRANSIENT_EXCEPTIONS) or status_code in _TRANSIENT_STATUS_CODES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait requested by a Retry-After header of the failed response, if any."""
+    headers: Dict[str, Any] = {}
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "headers", None) is not None:
+        headers.update(response.headers)
+    headers.update(getattr(error, "litellm_response_headers", None) or {})
+    headers = {str(name).lower(): value for name, value in headers.items()}
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class CircuitBreaker:
+    """
+    Suspends requests to a provider after consecutive failures.
+
+    After `failure_threshold` consecutive rate limit or transient failures
+    the circuit opens and requests fail fast with CircuitOpenError. Once
+    `reset_timeout` seconds have passed, one trial request is let through:
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError(
+                    f"Requests to {self.name} are suspended after {self._failures} consecutive failures"
+                )
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self._trial_in_flight = False
+            if classify_error(error) == PERMANENT:
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Suspending requests to {self.name} after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    """Circuit breaker shared by all models of the provider `name`."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return _breakers[name]
+
+
+class RetryPolicy:
+    """
+    Retry policy of LLM calls.
+
+    Rate limited calls wait as long as the provider's Retry-After asks (up
+    to `max_rate_limit_wait`), transient failures (timeouts, connection
+    errors, 5xx) are retried with a short exponential backoff with full
+    jitter, and permanent errors are raised immediately. No call takes
+    longer than `deadline` seconds including retries.
+
+    Args:
+        max_attempts: Maximum number of attempts per call
+        initial_backoff: Backoff before the first retry, doubled on every retry
+        max_backoff: Upper bound of the backoff of transient failures
+        max_rate_limit_wait: Upper bound of the wait after a rate limit
+        deadline: Seconds a call may take including retries, or None for no limit
+        failure_threshold: Consecutive failures opening a provider's circuit
+        reset_timeout: Seconds an open circuit waits before a trial request
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        max_rate_limit_wait: float = 120.0,
+        deadline: Optional[float] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def _is_retryable(self, error: BaseException, retry_rate_limits: bool = True) -> bool:
+        error_class = classify_error(error)
+        if error_class == RATE_LIMITED:
+            return retry_rate_limits
+        return error_class != PERMANENT
+
+    def _wait(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception()
+        exponential = self.initial_backoff * 2 ** (retry_state.attempt_number - 1)
+        if classify_error(error) == RATE_LIMITED:
+            retry_after = get_retry_after(error)
+            wait = (
+                retry_after
+                if retry_after is not None
+                else random.uniform(self.initial_backoff, max(exponential, self.initial_backoff))
+            )
+            return min(wait, self.max_rate_limit_wait)
+        return random.uniform(0, min(exponential, self.max_backoff))
+
+    def _stop(self, retry_state: RetryCallState) -> bool:
+        if retry_state.attempt_number >= self.max_attempts:
+            return True
+        # The wait before the next attempt is known by now; give up if the
+        # attempt could not start before the deadline
+        return (
+            self.deadline is not None
+            and retry_state.seconds_since_start + retry_state.upcoming_sleep >= self.deadline
+        )
+
+    def _log_retry(self, retry_state: RetryCallState):
+        error = retry_state.outcome.exception()
+        logger.warning(
+            f"LLM call failed ({classify_error(error)}: {type(error).__name__}), "
+            f"retrying in {retry_state.next_action.sleep:.1f} seconds"
+        )
+
+    def _retrying_kwargs(self, retry_rate_limits: bool) -> Dict[str, Any]:
+        return {
+            "stop": self._stop,
+            "wait": self._wait,
+            "retry": retry_if_exception(
+                lambda error: self._is_retryable(error, retry_rate_limits)
+            ),
+            "before_sleep": self._log_retry,
+            "reraise": True,
+        }
+
+    def _remaining(self, started_at: float) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - (time.monotonic() - started_at), 0.0)
+
+    def call(
+        self,
+        func: Callable[[Optional[float]], R],
+        breaker: CircuitBreaker,
+        retry_rate_limits: bool = True,
+    ) -> R:
+        """Call `func` with the seconds left until the deadline (None without one) until it succeeds.
+
+        With `retry_rate_limits` off, rate limits are raised at once, e.g. to
+        fall back to another model instead of waiting.
+        """
+        started_at = time.monotonic()
+        for attempt in Retrying(**self._retrying_kwargs(retry_rate_limits)):
+            with attempt:
+                breaker.before_call()
+                try:
+                    result = func(self._remaining(started_at))
+                except BaseException as e:
+                    breaker.record_failure(e)
+                    raise
+                breaker.record_success()
+        return result
+
+    async def acall(
+        self,
+        func: Callable[[Optional[float]], Awaitable[R]],
+        breaker: CircuitBreaker,
+        retry_rate_limits: bool = True,
+    ) -> R:
+        """Asynchronous version of `call`."""
+        started_at = time.monotonic()
+        async for attempt in AsyncRetrying(**self._retrying_kwargs(retry_rate_limits)):
+            with attempt:
+                breaker.before_call()
+                try:
+                    result = await func(self._remaining(started_at))
+                except BaseException as e:
+                    breaker.record_failure(e)
+                    raise
+                breaker.record_success()
+        return result
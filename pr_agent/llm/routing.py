@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import litellm.exceptions
+
+from pr_agent.llm.exception import CircuitOpenError, ContextWindowExceededError
+from pr_agent.llm.retry import RATE_LIMITED, CircuitBreaker, classify_error
+from pr_agent.llm.stats import Histogram
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+def is_fallback_error(error: BaseException) -> bool:
+    """Whether a failed call may succeed on another target."""
+    return isinstance(
+        error,
+        (
+            ContextWindowExceededError,
+            litellm.exceptions.ContextWindowExceededError,
+            CircuitOpenError,
+        ),
+    ) or classify_error(error) == RATE_LIMITED
+
+
+class RouteTarget:
+    """
+    A model requests can be routed to, with the latency histogram of its calls.
+
+    Args:
+        model: litellm model name
+        base_url: API base, or None for the provider's default
+        api_key: API key, or None to use the key of the primary model
+        max_input_tokens: Context window of the model
+        circuit_breaker: Circuit breaker of the model's provider
+    """
+
+    def __init__(
+        self,
+        model: str,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        max_input_tokens: Optional[int] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_input_tokens = max_input_tokens
+        self.circuit_breaker = circuit_breaker
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RouteTarget(model={self.model}, base_url={self.base_url})"
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.latency.record(seconds)
+
+    def fits(self, input_tokens: int) -> bool:
+        return self.max_input_tokens is None or input_tokens <= self.max_input_tokens
+
+    def latency_percentile(self, percentile: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if self.latency.count < min_samples:
+                return None
+            return self.latency.percentile(percentile)
+
+
+class Router:
+    """
+    Routes LLM calls over a list of targets: the primary model first, then fallbacks.
+
+    A call falls back to the next target that fits the input when the
+    current one exceeds its context window, is rate limited or has its
+    circuit open; other errors are raised. Asynchronous calls are also
+    hedged: when a call takes longer than the `hedge_percentile` latency of
+    its target, a duplicate request is sent, the first response wins and the
+    other requests are cancelled. Hedges that still finish, e.g. in the same
+    wait as the winner, are handed to the caller's `discard` callback so
+    their cost is recorded and their streams closed. Hedging starts once a target has
+    `hedge_min_samples` latencies recorded, before that `hedge_initial_delay`
+    is used if set.
+
+    Args:
+        targets: Targets in order of preference
+        hedge_percentile: Latency percentile after which a call is hedged,
+            or None to disable hedging
+        hedge_min_samples: Latencies of a target needed before hedging on its percentile
+        hedge_initial_delay: Hedge delay of targets with fewer samples, or None
+            to not hedge them
+        max_hedges: Maximum number of duplicate requests per call
+    """
+
+    def __init__(
+        self,
+        targets: List[RouteTarget],
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        hedge_initial_delay: Optional[float] = None,
+        max_hedges: int = 1,
+    ):
+        if not targets:
+            raise ValueError("Router needs at least one target")
+        self.targets = targets
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_initial_delay = hedge_initial_delay
+        self.max_hedges = max_hedges
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    @property
+    def primary(self) -> RouteTarget:
+        return self.targets[0]
+
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        """Largest context window of any target, or None if one is unbounded."""
+        if any(target.max_input_tokens is None for target in self.targets):
+            return None
+        return max(target.max_input_tokens for target in self.targets)
+
+    def hedge_delay(self, target: RouteTarget) -> Optional[float]:
+        if self.hedge_percentile is None or self.max_hedges < 1:
+            return None
+        delay = target.latency_percentile(self.hedge_percentile, self.hedge_min_samples)
+        return delay if delay is not None else self.hedge_initial_delay
+
+    def _candidates(self, input_tokens: int) -> List[RouteTarget]:
+        candidates = [target for target in self.targets if target.fits(input_tokens)]
+        if not candidates:
+            raise ContextWindowExceededError(
+                f"Input tokens {input_tokens} exceed the context window of every model"
+            )
+        return candidates
+
+    def _fall_back(self, target: RouteTarget, error: Exception, is_last: bool):
+        if is_last or not is_fallback_error(error):
+            raise error
+        self.fallbacks += 1
+        logger.warning(f"Falling back from {target.model} after {type(error).__name__}")
+
+    def call(self, func: Callable[[RouteTarget, bool], R], input_tokens: int) -> R:
+        """Call `func(target, is_last)` on the targets fitting the input until one succeeds.
+
+        `is_last` tells whether no target is left to fall back to.
+        """
+        candidates = self._candidates(input_tokens)
+        for target in candidates[:-1]:
+            try:
+                return func(target, False)
+            except Exception as e:
+                self._fall_back(target, e, is_last=False)
+        return func(candidates[-1], True)
+
+    async def acall(
+        self,
+        func: Callable[[RouteTarget, bool], Awaitable[R]],
+        input_tokens: int,
+        discard: Optional[Callable[[R], Awaitable[Any]]] = None,
+    ) -> R:
+        """Asynchronous, hedged version of `call`.
+
+        `discard` is awaited with the result of every request that finished
+        but lost the hedge.
+        """
+        candidates = self._candidates(input_tokens)
+        for target in candidates[:-1]:
+            try:
+                return await self._hedged(func, target, False, discard)
+            except Exception as e:
+                self._fall_back(target, e, is_last=False)
+        return await self._hedged(func, candidates[-1], True, discard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "latency_seconds": {
+                target.model: target.latency.summary() for target in self.targets
+            },
+        }
+
+    async def _hedged(
+        self,
+        func: Callable[[RouteTarget, bool], Awaitable[R]],
+        target: RouteTarget,
+        is_last: bool,
+        discard: Optional[Callable[[R], Awaitable[Any]]] = None,
+    ) -> R:
+        first = asyncio.ensure_future(func(target, is_last))
+        tasks = [first]
+        hedges = 0
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                delay = self.hedge_delay(target) if hedges < self.max_hedges else None
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                # In order of sending, so the earliest request wins a tie
+                succeeded = []
+                for task in [task for task in tasks if task in done]:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        succeeded.append(task)
+                    else:
+                        error = task.exception()
+                if succeeded:
+                    for task in succeeded[1:]:
+                        await self._discard(discard, task.result())
+                    if succeeded[0] is not first:
+                        self.hedge_wins += 1
+                    return succeeded[0].result()
+                if not done:
+                    hedges += 1
+                    self.hedges += 1
+                    logger.info(f"Hedging a call to {target.model} after {delay:.1f} seconds")
+                    tasks.append(asyncio.ensure_future(func(target, is_last)))
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            # Requests that completed before their cancellation took effect
+            for task in tasks:
+                if not task.cancelled() and task.exception() is None:
+                    await self._discard(discard, task.result())
+
+    @staticmethod
+    async def _discard(discard: Optional[Callable[[R], Awaitable[Any]]], result: R):
+        if discard is None:
+            return
+        try:
+            await discard(result)
+        except Exception as e:
+            logger.warning(f"Failed to discard a hedged response: {e}")
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+# Provider budgets are expressed per minute
+WINDOW_SEC = 60.0
+
+
+class RequestScheduler:
+    """
+    Paces LLM requests to stay within requests-per-minute and tokens-per-minute budgets.
+
+    Every request reserves a start time in a sliding one-minute window, in
+    the order requests arrive, and waits until then. Reservations are never
+    reordered, so callers are served first come, first served, and a large
+    request is not starved by small ones. Both synchronous and asynchronous
+    callers share the same budgets.
+
+    Args:
+        requests_per_minute: Request budget, or None for no limit
+        tokens_per_minute: Input token budget, or None for no limit
+        max_concurrency: Maximum number of requests in flight per caller
+            kind (threads or event loop), or None for no limit
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        # (start time, tokens) of reservations, ordered by start time
+        self._reservations: Deque[Tuple[float, int]] = deque()
+        self._thread_slots = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+        # asyncio semaphores are bound to the loop they are first used in
+        self._loop_slots: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+        self.queue_depth = 0
+        self.requests = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve a start time for a request of `tokens` tokens and return the delay until then."""
+        with self._lock:
+            now = time.monotonic()
+            while self._reservations and self._reservations[0][0] <= now - WINDOW_SEC:
+                self._reservations.popleft()
+            if self.tokens_per_minute:
+                # A request larger than the whole budget can only wait for an empty window
+                tokens = min(tokens, self.tokens_per_minute)
+            start = max(now, self._reservations[-1][0] if self._reservations else now)
+
+            reservations = list(self._reservations)
+            if self.requests_per_minute and len(reservations) >= self.requests_per_minute:
+                start = max(start, reservations[-self.requests_per_minute][0] + WINDOW_SEC)
+            if self.tokens_per_minute:
+                window_tokens = sum(t for _, t in reservations)
+                for reserved_at, reserved_tokens in reservations:
+                    if window_tokens + tokens <= self.tokens_per_minute:
+                        break
+                    window_tokens -= reserved_tokens
+                    start = max(start, reserved_at + WINDOW_SEC)
+
+            self._reservations.append((start, tokens))
+            delay = start - now
+            self.requests += 1
+            self.total_wait_seconds += delay
+            self.max_wait_seconds = max(self.max_wait_seconds, delay)
+            return delay
+
+    def _set_queued(self, queued: bool):
+        with self._lock:
+            self.queue_depth += 1 if queued else -1
+
+    @contextlib.contextmanager
+    def slot(self, tokens: int) -> Iterator[None]:
+        """Wait until a request of `tokens` input tokens may be sent."""
+        self._set_queued(True)
+        try:
+            if self._thread_slots is not None:
+                self._thread_slots.acquire()
+        except BaseException:
+            self._set_queued(False)
+            raise
+        try:
+            try:
+                delay = self._reserve(tokens)
+                if delay > 0:
+                    time.sleep(delay)
+            finally:
+                self._set_queued(False)
+            yield
+        finally:
+            if self._thread_slots is not None:
+                self._thread_slots.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, tokens: int) -> AsyncIterator[None]:
+        """Asynchronous version of `slot`."""
+        semaphore = None
+        if self.max_concurrency:
+            loop = asyncio.get_running_loop()
+            with self._lock:
+                semaphore = self._loop_slots.setdefault(
+                    loop, asyncio.Semaphore(self.max_concurrency)
+                )
+        self._set_queued(True)
+        try:
+            if semaphore is not None:
+                await semaphore.acquire()
+        except BaseException:
+            self._set_queued(False)
+            raise
+        try:
+            try:
+                delay = self._reserve(tokens)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            finally:
+                self._set_queued(False)
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "requests": self.requests,
+                "total_wait_seconds": round(self.total_wait_seconds, 2),
+                "max_wait_seconds": round(self.max_wait_seconds, 2),
+            }
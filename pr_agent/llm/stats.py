@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+# Bucket bounds grow by 5%, so percentiles are accurate within 5%
+_GROWTH = 1.05
+_MIN_VALUE = 1e-6
+
+
+class Histogram(BaseModel):
+    """Histogram of positive values in logarithmic buckets, mergeable and of bounded size."""
+
+    count: int = 0
+    total: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+    buckets: Dict[int, int] = Field(default_factory=dict)
+
+    def record(self, value: float):
+        value = max(value, _MIN_VALUE)
+        bucket = math.floor(math.log(value, _GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Value below which `q` percent of the recorded values fall."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # Geometric middle of the bucket
+                value = _GROWTH ** (bucket + 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def __add__(self, other: Histogram) -> Histogram:
+        buckets = dict(self.buckets)
+        for bucket, count in other.buckets.items():
+            buckets[bucket] = buckets.get(bucket, 0) + count
+        bounds_min = [v for v in (self.min, other.min) if v is not None]
+        bounds_max = [v for v in (self.max, other.max) if v is not None]
+        return Histogram(
+            count=self.count + other.count,
+            total=self.total + other.total,
+            min=min(bounds_min) if bounds_min else None,
+            max=max(bounds_max) if bounds_max else None,
+            buckets=buckets,
+        )
+
+
+class ModelUsage(BaseModel):
+    """Calls, tokens and cost of one model."""
+
+    api_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+
+    def __add__(self, other: ModelUsage) -> ModelUsage:
+        return ModelUsage(
+            **{
+                name: getattr(self, name) + getattr(other, name)
+                for name in ModelUsage.model_fields
+            }
+        )
+
+
+# Fields summed by APIStats.__add__ and update
+_COUNTERS = (
+    "total_cost",
+    "input_tokens",
+    "output_tokens",
+    "api_calls",
+    "cache_hits",
+    "cache_misses",
+    "cost_saved",
+    "cached_input_tokens",
+    "cache_creation_input_tokens",
+)
+
+
+class APIStats(BaseModel):
+    """
+    Usage of an LLM: running totals, latency and throughput histograms, cost by model.
+
+    Only the last `history_size` calls are kept in memory, without their
+    messages. With `history_path` set, every call is also appended to that
+    JSONL file with its messages and response. Updates are thread-safe, and
+    stats of several models are merged with `+`.
+
+    Args:
+        history_size: Calls kept in memory
+        history_path: JSONL file receiving every call, or None
+    """
+
+    model: str
+    base_url: str | None = None
+    total_cost: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    api_calls: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cost_saved: float = 0.0
+    cached_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    latency: Histogram = Field(default_factory=Histogram)
+    # Output tokens per second of every call
+    throughput: Histogram = Field(default_factory=Histogram)
+    by_model: Dict[str, ModelUsage] = Field(default_factory=dict)
+    history_size: int = 100
+    history_path: Optional[str] = None
+
+    _history: Deque[Dict[str, Any]] = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any):
+        self._history = deque(maxlen=max(self.history_size, 0))
+        if self.history_path is not None:
+            self.history_path = os.path.expanduser(self.history_path)
+            os.makedirs(os.path.dirname(self.history_path) or ".", exist_ok=True)
+
+    @property
+    def history(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._history)
+
+    def update(self, **counters: float):
+        """Add to the counters, e.g. `stats.update(cache_hits=1)`."""
+        with self._lock:
+            for name, value in counters.items():
+                if name not in _COUNTERS:
+                    raise ValueError(f"Unknown APIStats counter {name}")
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_call(
+        self,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        cost: float,
+        latency: Optional[float] = None,
+        cached_input_tokens: int = 0,
+        cache_creation_input_tokens: int = 0,
+        input: Optional[List[Dict[str, Any]]] = None,
+        output: Optional[str] = None,
+    ):
+        """Record a completed API call.
+
+        Args:
+            latency: Seconds the call took, or None if unknown
+            input: Messages of the call, only written to `history_path`
+            output: Response of the call, only written to `history_path`
+        """
+        record = {
+            "timestamp": time.time(),
+            "model": model,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": cost,
+            "latency": latency,
+        }
+        with self._lock:
+            self.api_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.total_cost += cost
+            self.cached_input_tokens += cached_input_tokens
+            self.cache_creation_input_tokens += cache_creation_input_tokens
+            usage = self.by_model.setdefault(model, ModelUsage())
+            usage.api_calls += 1
+            usage.input_tokens += input_tokens
+            usage.output_tokens += output_tokens
+            usage.cost += cost
+            if latency is not None:
+                self.latency.record(latency)
+                if latency > 0 and output_tokens:
+                    self.throughput.record(output_tokens / latency)
+            self._history.append(record)
+            if self.history_path is not None:
+                with open(self.history_path, "a") as f:
+                    f.write(json.dumps({**record, "input": input, "output": output}) + "\n")
+
+    def export(self) -> Dict[str, Any]:
+        """Aggregated metrics, without the history."""
+        with self._lock:
+            return {
+                "model": self.model,
+                "base_url": self.base_url,
+                **{name: getattr(self, name) for name in _COUNTERS},
+                "latency_seconds": self.latency.summary(),
+                "output_tokens_per_second": self.throughput.summary(),
+                "by_model": {
+                    model: usage.model_dump() for model, usage in self.by_model.items()
+                },
+            }
+
+    def __add__(self, other: APIStats) -> APIStats:
+        if not isinstance(other, APIStats):
+            raise TypeError(
+                f"Can only add APIStats with APIStats, got type {type(other)}"
+            )
+        by_model = dict(self.by_model)
+        for model, usage in other.by_model.items():
+            by_model[model] = by_model[model] + usage if model in by_model else usage
+        stats = APIStats(
+            model=self.model if self.model == other.model else f"{self.model}, {other.model}",
+            base_url=self.base_url if self.base_url == other.base_url else None,
+            **{name: getattr(self, name) + getattr(other, name) for name in _COUNTERS},
+            latency=self.latency + other.latency,
+            throughput=self.throughput + other.throughput,
+            by_model=by_model,
+            history_size=self.history_size,
+        )
+        history = sorted(self.history + other.history, key=lambda record: record["timestamp"])
+        stats._history.extend(history)
+        return stats
+
+    def __str__(self):
+        latency = self.latency.summary()
+        latency_line = (
+            f"Latency: p50 {latency['p50']:.2f}s, p90 {latency['p90']:.2f}s, "
+            f"p99 {latency['p99']:.2f}s\n"
+            if latency["count"]
+            else ""
+        )
+        throughput = self.throughput.mean
+        return (
+            f"Model: {self.model}\n"
+            f"Base URL: {self.base_url}\n"
+            f"Total cost: {self.total_cost:.2f}\n"
+            f"Input tokens: {self.input_tokens:,}\n"
+            f"Output tokens: {self.output_tokens:,}\n"
+            f"API calls: {self.api_calls:,}\n"
+            f"{latency_line}"
+            + (f"Output tokens per second: {throughput:.1f}\n" if throughput else "")
+            + f"Cache hits: {self.cache_hits:,}, misses: {self.cache_misses:,}\n"
+            f"Cost saved by cache: {self.cost_saved:.2f}\n"
+            f"Prompt cache: {self.cached_input_tokens:,} input tokens read, "
+            f"{self.cache_creation_input_tokens:,} written\n"
+        )
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence
+
+import litellm
+
+# Message used to measure the constant overhead of a message list
+_PROBE_MESSAGE = {"role": "user", "content": "probe"}
+
+
+class TokenCounter:
+    """
+    Token counting for one model, with the tokenizer loaded once and counts memoized.
+
+    Counts of texts and messages are memoized by content hash, so a message
+    that appears in several requests (e.g. the system prompt) is tokenized
+    once. A message list costs a constant overhead (reply priming) plus the
+    sum of its messages, which makes counts additive and lets callers trim
+    message lists with prefix sums instead of recounting.
+
+    Use `get_token_counter` to share counters between callers.
+
+    Args:
+        model: Model name known to litellm
+        cache_size: Number of memoized counts
+    """
+
+    def __init__(self, model: str, cache_size: int = 4096):
+        self.model = model
+        self.cache_size = cache_size
+        self.tokenizer = litellm.utils._select_tokenizer(model)
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        single = self._count_uncached_messages([_PROBE_MESSAGE])
+        double = self._count_uncached_messages([_PROBE_MESSAGE, _PROBE_MESSAGE])
+        self.messages_overhead = 2 * single - double
+
+    def encode(self, text: str) -> List[int]:
+        if self.tokenizer["type"] == "huggingface_tokenizer":
+            return self.tokenizer["tokenizer"].encode(text).ids
+        return self.tokenizer["tokenizer"].encode(text, disallowed_special=())
+
+    def decode(self, tokens: Sequence[int]) -> str:
+        return self.tokenizer["tokenizer"].decode(list(tokens))
+
+    def _count_uncached_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return litellm.utils.token_counter(
+            model=self.model, custom_tokenizer=self.tokenizer, messages=messages
+        )
+
+    def _memoized(self, kind: str, payload: str, count) -> int:
+        key = kind + hashlib.sha1(payload.encode()).hexdigest()
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        tokens = count()
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def count_text(self, text: str | List[str]) -> int:
+        if isinstance(text, list):
+            return sum(self.count_text(part) for part in text)
+        return self._memoized("text:", text, lambda: len(self.encode(text)))
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        """Tokens added by one message to a message list."""
+        payload = json.dumps(message, sort_keys=True, default=str)
+        return self._memoized(
+            "message:",
+            payload,
+            lambda: self._count_uncached_messages([message]) - self.messages_overhead,
+        )
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return self.messages_overhead + sum(self.count_message(m) for m in messages)
+
+    def prefix_sums(self, messages: List[Dict[str, Any]]) -> List[int]:
+        """Cumulative counts; `sums[j] - sums[i]` is the count of `messages[i:j]`."""
+        sums = [0]
+        for message in messages:
+            sums.append(sums[-1] + self.count_message(message))
+        return sums
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model: str) -> TokenCounter:
+    """Shared TokenCounter of `model`."""
+    return TokenCounter(model)
@@ -0,0 +1,198 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Optional
+
+from pr_agent.git_providers.base import GitProvider
+from pr_agent.log import get_logger
+from pr_agent.task import PRTask
+from pr_agent.task_inference.base import TaskInference
+
+# Marks the end of a stage's input queue
+_DONE = object()
+
+
+class ReviewPipeline:
+    """
+    Asynchronous PR review pipeline.
+
+    PRs flow through four stages connected by bounded queues:
+    PR listing -> diff fetching -> preprocessing -> inference.
+    Every stage runs its own pool of workers, so network I/O for one PR overlaps
+    with the LLM call of another and throughput is bounded by the slowest stage
+    rather than by the sum of latencies. Failures are logged per PR and do not
+    stop the pipeline.
+
+    Args:
+        git_provider: Provider used to list PRs and fetch their diff files
+        preprocessors: Tasks applied in order to every PR before inference
+        inference: Task producing the review of a PR
+        queue_size: Capacity of each queue between stages
+        fetch_concurrency: Number of PRs whose diff files are fetched at once
+        preprocess_concurrency: Number of PRs preprocessed at once
+        inference_concurrency: Number of PRs reviewed by the LLM at once
+    """
+
+    def __init__(
+        self,
+        git_provider: GitProvider,
+        preprocessors: List[TaskInference],
+        inference: TaskInference,
+        queue_size: int = 16,
+        fetch_concurrency: int = 4,
+        preprocess_concurrency: int = 1,
+        inference_concurrency: int = 4,
+    ):
+        self.git_provider = git_provider
+        self.preprocessors = preprocessors
+        self.inference = inference
+        self.queue_size = queue_size
+        self.fetch_concurrency = fetch_concurrency
+        self.preprocess_concurrency = preprocess_concurrency
+        self.inference_concurrency = inference_concurrency
+
+    async def run(
+        self,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[PRTask]:
+        """Review all closed PRs matching the filters.
+
+        Returns:
+            Reviewed tasks, in order of completion
+        """
+        fetch_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        preprocess_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        inference_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        results: List[PRTask] = []
+
+        async def collect(task: PRTask) -> None:
+            results.append(task)
+
+        await asyncio.gather(
+            self._list_prs(fetch_queue, author, since, until),
+            self._run_stage(
+                "fetch", self._fetch, fetch_queue, preprocess_queue, self.fetch_concurrency
+            ),
+            self._run_stage(
+                "preprocess",
+                self._preprocess,
+                preprocess_queue,
+                inference_queue,
+                self.preprocess_concurrency,
+            ),
+            self._run_stage(
+                "inference",
+                self._infer,
+                inference_queue,
+                None,
+                self.inference_concurrency,
+                on_result=collect,
+            ),
+        )
+        return results
+
+    async def run_batch(
+        self,
+        state_path: str,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        poll_interval: float = 60.0,
+        timeout: Optional[float] = None,
+    ) -> List[PRTask]:
+        """Review all closed PRs matching the filters through the LLM provider's batch API.
+
+        PRs are listed, fetched and preprocessed as in `run`, then reviewed by
+        a single batch whose progress is kept in `state_path`, so an
+        interrupted run resumes the same batch.
+
+        Returns:
+            Reviewed tasks
+        """
+        fetch_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        preprocess_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        tasks: List[PRTask] = []
+
+        async def collect(task: PRTask) -> None:
+            tasks.append(task)
+
+        await asyncio.gather(
+            self._list_prs(fetch_queue, author, since, until),
+            self._run_stage(
+                "fetch", self._fetch, fetch_queue, preprocess_queue, self.fetch_concurrency
+            ),
+            self._run_stage(
+                "preprocess",
+                self._preprocess,
+                preprocess_queue,
+                None,
+                self.preprocess_concurrency,
+                on_result=collect,
+            ),
+        )
+        return await asyncio.to_thread(
+            self.inference.transform_batch, tasks, state_path, poll_interval, timeout
+        )
+
+    async def _list_prs(
+        self,
+        out_queue: asyncio.Queue,
+        author: Optional[str],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ):
+        try:
+            pr_urls = self.git_provider.get_closed_prs(author, since, until)
+            while (pr_url := await asyncio.to_thread(next, pr_urls, None)) is not None:
+                await out_queue.put(PRTask(pr_url, author))
+        except Exception as e:
+            get_logger().exception(f"Failed to list PRs: {e}")
+        finally:
+            await out_queue.put(_DONE)
+
+    async def _fetch(self, task: PRTask) -> PRTask:
+        task.diff_files = await asyncio.to_thread(
+            self.git_provider.get_diff_files, task.pr_url
+        )
+        return task
+
+    async def _preprocess(self, task: PRTask) -> PRTask:
+        for preprocessor in self.preprocessors:
+            task = await preprocessor.atransform(task)
+        return task
+
+    async def _infer(self, task: PRTask) -> PRTask:
+        return await self.inference.atransform(task)
+
+    async def _run_stage(
+        self,
+        name: str,
+        func: Callable[[PRTask], Awaitable[PRTask]],
+        in_queue: asyncio.Queue,
+        out_queue: Optional[asyncio.Queue],
+        concurrency: int,
+        on_result: Optional[Callable[[PRTask], Awaitable[Any]]] = None,
+    ):
+        async def worker():
+            while True:
+                task = await in_queue.get()
+                if task is _DONE:
+                    # Let sibling workers see the end of the queue as well
+                    await in_queue.put(_DONE)
+                    return
+                try:
+                    task = await func(task)
+                except Exception as e:
+                    get_logger().exception(
+                        f"Stage {name} failed for PR {task.pr_url}: {e}"
+                    )
+                    continue
+                if out_queue is not None:
+                    await out_queue.put(task)
+                if on_result is not None:
+                    await on_result(task)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        if out_queue is not None:
+            await out_queue.put(_DONE)
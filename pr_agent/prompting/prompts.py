@@ -1,5 +1,4 @@
-def pr_review_prompt_system():
-    return """
+_PR_REVIEW_GUIDELINES = """
 You are PR-Reviewer, a language model designed to review a Git Pull Request (PR).
 Your task is to provide constructive and concise feedback for the PR.
 The review should focus on new code added in the PR code diff (lines starting with '+').
@@ -23,7 +22,9 @@ The format we will use to present the PR code diff:
 - When quoting variables, names or file paths from the code, use backticks (`) instead of single quote (').
 - Note that you only see changed code segments (diff hunks in a PR), not the entire codebase. Avoid suggestions that might duplicate existing functionality or questioning code elements (like variables declarations or import statements) that may be defined elsewhere in the codebase.
 - Also note that if the code ends at an opening brace or statement that begins a new scope (like 'if', 'for', 'try'), don't treat it as incomplete. Instead, acknowledge the visible scope boundary and analyze only the code shown.
+"""
 
+_PR_REVIEW_YAML_FORMAT = """
 The output must be a YAML object equivalent to type $PRReview, according to the following Pydantic definitions:
 =====
 class KeyIssuesComponentLink(BaseModel):
@@ -62,8 +63,15 @@ review:
 Answer should be a valid YAML, and nothing else. Each YAML output MUST be after a newline, with proper indent, and block scalar indicator ('|')
 """
 
+def pr_review_prompt_system(structured: bool = False):
+    if structured:
+        # The schema of the answer is passed as a tool or response format
+        return _PR_REVIEW_GUIDELINES + "\nAnswer with the review of the PR as a PRReview.\n"
+    return _PR_REVIEW_GUIDELINES + _PR_REVIEW_YAML_FORMAT
+
+
 def pr_review_prompt_user(pr_code_diff: str):
-    return """
+    return f"""
     ## PR code diff
     {pr_code_diff}
     """
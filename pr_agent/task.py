@@ -9,7 +9,16 @@ class PRTask:
         self._metadata: Dict[str, Any] = {
             "closed_at": None,
             "diff_files": None,
-        }  
+            "review": None,
+        }
+
+    @property
+    def pr_url(self) -> str:
+        return self._pr_url
+
+    @property
+    def author(self) -> Optional[str]:
+        return self._author
     
     @property
     def closed_at(self) -> Optional[datetime]:
@@ -28,3 +37,11 @@ class PRTask:
         self._metadata["diff_files"] = value
         
         
+
+    @property
+    def review(self) -> Optional[str]:
+        return self._metadata["review"]
+
+    @review.setter
+    def review(self, value: str):
+        self._metadata["review"] = value
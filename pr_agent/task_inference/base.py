@@ -1,10 +1,25 @@
+import asyncio
 from abc import ABC, abstractmethod
 from pr_agent.task import PRTask
-from typing import Optional, List
+from typing import Any, Callable, Dict, Optional, List
 from pr_agent.prompting.prompt_generator import PromptGenerator
-from pr_agent.llm.litellm import LiteLLMModel, clip_text
+from pr_agent.llm.litellm import LiteLLMModel
+from pr_agent.log import get_logger
 from pr_agent.prompting.prompts import pr_review_prompt_system, pr_review_prompt_user
-from pr_agent.types import FilePatchInfo
+from pr_agent.task_inference.chunking import (
+    dump_review,
+    merge_reviews,
+    parse_review,
+    split_diff_files,
+)
+from pr_agent.task_inference.packing import pack_diff_files
+from pr_agent.task_inference.streaming import KEY_ISSUES_KEY, ReviewStreamParser
+from pr_agent.task_inference.structured import ReviewRepairer
+from pr_agent.types import FilePatchInfo, PRReview
+
+# Share of the context window left after the prompts that the diff may use,
+# the rest is kept for the response
+DIFF_BUDGET_RATIO = 0.75
 
 class TaskInference(ABC):
     def initialize_task(self, task):
@@ -15,32 +30,250 @@ class TaskInference(ABC):
     def transform(self, task: PRTask) -> PRTask:
         pass
 
+    async def atransform(self, task: PRTask) -> PRTask:
+        return self.transform(task)
+
+    def transform_batch(
+        self,
+        tasks: List[PRTask],
+        state_path: str,
+        poll_interval: float = 60.0,
+        timeout: Optional[float] = None,
+    ) -> List[PRTask]:
+        raise NotImplementedError(f"{type(self).__name__} does not support batch mode")
+
 class PRReviewTaskInference(TaskInference):
-    def __init__(self, llm: LiteLLMModel):
+    """
+    Reviews a PR with the LLM.
+
+    With `chunked` enabled, a PR whose diff does not fit into one context
+    window is split into balanced chunks of files, the chunks are reviewed
+    concurrently and their reviews are merged, so review latency grows with
+    the largest chunk rather than with the PR size.
+
+    With `stream` enabled, reviews are streamed and parsed as they are
+    generated: every key issue is passed to `on_issue` as soon as it is
+    complete, and generation stops once all review fields are parsed or
+    `max_output_tokens` is reached, so no tokens are paid for text after
+    the review.
+
+    With `structured` enabled, reviews are asked for as a `PRReview` through
+    the model's tool or JSON mode instead of free-text YAML. An answer that
+    fails validation is repaired by asking again for the invalid fields
+    only, up to `max_repairs` times. Structured reviews are not streamed.
+
+    Args:
+        llm: Model producing the reviews
+        chunked: Whether to review large PRs in chunks
+        max_chunks: Maximum number of chunks per PR
+        stream: Whether to stream reviews
+        max_output_tokens: Output tokens after which a streamed review is
+            stopped, or None for no limit
+        on_issue: Called with the task and every key issue of a streamed or
+            structured review
+        structured: Whether to ask for schema-constrained reviews
+        max_repairs: Maximum number of repair requests per structured review
+    """
+
+    def __init__(
+        self,
+        llm: LiteLLMModel,
+        chunked: bool = False,
+        max_chunks: int = 8,
+        stream: bool = False,
+        max_output_tokens: Optional[int] = None,
+        on_issue: Optional[Callable[[PRTask, Dict[str, Any]], Any]] = None,
+        structured: bool = False,
+        max_repairs: int = 2,
+    ):
         self.llm = llm
+        self.chunked = chunked
+        self.max_chunks = max(1, max_chunks)
+        self.stream = stream
+        self.max_output_tokens = max_output_tokens
+        self.on_issue = on_issue
+        self.structured = structured
+        self.repairer = ReviewRepairer(llm, max_repairs)
+        # The system prompts are the same for every PR, count them once. The
+        # YAML prompt is the longer one and is still used by batch reviews.
+        self.system_prompt = pr_review_prompt_system()
+        self.structured_system_prompt = pr_review_prompt_system(structured=True)
+        self.system_prompt_tokens = self.llm.count_tokens(text=self.system_prompt)
+        init_tokens = self.system_prompt_tokens + self.llm.count_tokens(
+            text=pr_review_prompt_user("")
+        )
+        self.diff_budget = int(
+            DIFF_BUDGET_RATIO * (self.llm.model_max_input_tokens - init_tokens)
+        )
 
-    def transform(self, task: PRTask) -> PRTask:
-        prompt = pr_review_prompt_system()
-        init_tokens = self.llm.count_tokens(prompt)
-        pr_diffs = "\n\n".join([
-            f"## File: {diff.filename}\n"
-            f"{diff.patch}"
-            for diff in task.diff_files
-            if diff
-        ])
-        pr_diffs = clip_text(pr_diffs, self.llm.model, self.llm.model_max_input_tokens - init_tokens)
+    def _build_messages(
+        self, pr_url: str, diff_files: List[FilePatchInfo], structured: bool = False
+    ) -> List[dict]:
+        packed = pack_diff_files(diff_files, self.llm.token_counter, self.diff_budget)
+        if packed.dropped_files or packed.summarized_files or packed.compressed_files:
+            get_logger().info(
+                f"Packed diff of {pr_url}: {len(packed.full_files)} full, "
+                f"{len(packed.compressed_files)} compressed, "
+                f"{len(packed.summarized_files)} summarized, "
+                f"{len(packed.dropped_files)} dropped files"
+            )
+        pr_diffs = packed.text
         text = pr_review_prompt_user(pr_diffs)
-        response = self.llm.query(
-            messages=[
-                {
-                    "role": "system",
-                    "content": pr_review_prompt_system()
-                },
-                {
-                    "role": "user",
-                    "content": text
-                }
-            ]
+        return [
+            {
+                "role": "system",
+                "content": self.structured_system_prompt if structured else self.system_prompt
+            },
+            {
+                "role": "user",
+                "content": text
+            }
+        ]
+
+    def _split(self, task: PRTask) -> List[List[FilePatchInfo]]:
+        diff_files = [diff for diff in task.diff_files if diff]
+        if not self.chunked:
+            return [diff_files]
+        chunks = split_diff_files(
+            diff_files, self.llm.token_counter, self.diff_budget, self.max_chunks
         )
-        
-        return response
+        if len(chunks) > 1:
+            get_logger().info(f"Reviewing {task.pr_url} in {len(chunks)} chunks")
+        return chunks or [diff_files]
+
+    def _merge(self, task: PRTask, chunks: List[List[FilePatchInfo]], answers: List[str]) -> str:
+        if len(answers) == 1:
+            return answers[0]
+        reviews = []
+        for chunk, answer in zip(chunks, answers):
+            review = parse_review(answer)
+            if review is None:
+                get_logger().warning(f"Discarding unparsable chunk review of {task.pr_url}")
+                continue
+            reviews.append((review, sum(max(diff.tokens, 1) for diff in chunk)))
+        if not reviews:
+            return "\n\n".join(answers)
+        return dump_review(merge_reviews(reviews))
+
+    def _feed_stream(
+        self, task: PRTask, parser: ReviewStreamParser, delta: str, output_tokens: int
+    ) -> bool:
+        """Parse a piece of a streamed review and tell whether to stop generating."""
+        for issue in parser.feed(delta):
+            if self.on_issue is not None:
+                self.on_issue(task, issue)
+        if parser.is_complete():
+            return True
+        if self.max_output_tokens is not None and output_tokens >= self.max_output_tokens:
+            get_logger().warning(
+                f"Review of {task.pr_url} stopped after {output_tokens} output tokens"
+            )
+            return True
+        return False
+
+    def _finish_stream(self, task: PRTask, parser: ReviewStreamParser, stopped: bool) -> str:
+        for issue in parser.close():
+            if self.on_issue is not None:
+                self.on_issue(task, issue)
+        if stopped and parser.review:
+            # The answer was cut, keep the part parsed so far as valid YAML
+            return dump_review(parser.result())
+        return parser.text
+
+    def _query_stream(self, task: PRTask, messages: List[dict]) -> str:
+        parser = ReviewStreamParser()
+        output_tokens, stopped = 0, False
+        stream = self.llm.query_stream(messages=messages)
+        try:
+            for delta in stream:
+                output_tokens += self.llm.count_tokens(text=delta)
+                if stopped := self._feed_stream(task, parser, delta, output_tokens):
+                    break
+        finally:
+            stream.close()
+        return self._finish_stream(task, parser, stopped)
+
+    async def _aquery_stream(self, task: PRTask, messages: List[dict]) -> str:
+        parser = ReviewStreamParser()
+        output_tokens, stopped = 0, False
+        stream = self.llm.aquery_stream(messages=messages)
+        try:
+            async for delta in stream:
+                output_tokens += self.llm.count_tokens(text=delta)
+                if stopped := self._feed_stream(task, parser, delta, output_tokens):
+                    break
+        finally:
+            await stream.aclose()
+        return self._finish_stream(task, parser, stopped)
+
+    def _dump_structured(self, task: PRTask, review: PRReview) -> str:
+        data = review.model_dump(by_alias=True)
+        if self.on_issue is not None:
+            for issue in data["review"][KEY_ISSUES_KEY]:
+                self.on_issue(task, issue)
+        return dump_review(data)
+
+    def _review(self, task: PRTask, chunk: List[FilePatchInfo]) -> str:
+        if self.structured:
+            messages = self._build_messages(task.pr_url, chunk, structured=True)
+            return self._dump_structured(task, self.repairer.create(messages))
+        messages = self._build_messages(task.pr_url, chunk)
+        if self.stream:
+            return self._query_stream(task, messages)
+        return self.llm.query(messages=messages)
+
+    async def _areview(self, task: PRTask, chunk: List[FilePatchInfo]) -> str:
+        if self.structured:
+            messages = self._build_messages(task.pr_url, chunk, structured=True)
+            return self._dump_structured(task, await self.repairer.acreate(messages))
+        messages = self._build_messages(task.pr_url, chunk)
+        if self.stream:
+            return await self._aquery_stream(task, messages)
+        return await self.llm.aquery(messages=messages)
+
+    def transform(self, task: PRTask) -> PRTask:
+        chunks = self._split(task)
+        answers = [self._review(task, chunk) for chunk in chunks]
+        task.review = self._merge(task, chunks, answers)
+        return task
+
+    async def atransform(self, task: PRTask) -> PRTask:
+        chunks = self._split(task)
+        answers = await asyncio.gather(*(self._areview(task, chunk) for chunk in chunks))
+        task.review = self._merge(task, chunks, list(answers))
+        return task
+
+    def transform_batch(
+        self,
+        tasks: List[PRTask],
+        state_path: str,
+        poll_interval: float = 60.0,
+        timeout: Optional[float] = None,
+    ) -> List[PRTask]:
+        """Review PRs through one submission to the provider's batch API.
+
+        Every chunk of every PR is one request of the batch, keyed by PR URL
+        and chunk index. PRs with a failed chunk are left out.
+
+        Returns:
+            Reviewed tasks, in the order of `tasks`
+        """
+        chunks: Dict[str, List[List[FilePatchInfo]]] = {}
+        requests: Dict[str, List[dict]] = {}
+        for task in tasks:
+            chunks[task.pr_url] = self._split(task)
+            for i, chunk in enumerate(chunks[task.pr_url]):
+                requests[f"{task.pr_url}#{i}"] = self._build_messages(task.pr_url, chunk)
+
+        answers = self.llm.query_batch(requests, state_path, poll_interval, timeout)
+        reviewed = []
+        for task in tasks:
+            task_answers = [
+                answers.get(f"{task.pr_url}#{i}") for i in range(len(chunks[task.pr_url]))
+            ]
+            if None in task_answers:
+                get_logger().warning(f"Batch review of {task.pr_url} is incomplete, skipping it")
+                continue
+            task.review = self._merge(task, chunks[task.pr_url], task_answers)
+            reviewed.append(task)
+        return reviewed
@@ -0,0 +1,174 @@
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from pr_agent.llm.tokens import TokenCounter
+from pr_agent.log import get_logger
+from pr_agent.task_inference.packing import is_summary_only, summarize_file
+from pr_agent.types import FilePatchInfo
+
+EFFORT_KEY = "estimated_effort_to_review_[1-5]"
+
+_YAML_BLOCK_PATTERN = re.compile(r"```(?:yaml|yml)?\s*\n(.*?)```", re.DOTALL)
+_NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def _split_file_by_hunks(
+    file: FilePatchInfo, counter: TokenCounter, max_tokens: int
+) -> List[Tuple[FilePatchInfo, int]]:
+    """Split a file whose patch does not fit into `max_tokens` into pieces of whole hunks."""
+    header = f"## File: {file.filename}\n"
+    tokens = counter.count_text(header + file.patch)
+    if tokens <= max_tokens:
+        return [(file, tokens)]
+    hunks: List[str] = []
+    for line in file.patch.splitlines(keepends=True):
+        if line.startswith("@@") or not hunks:
+            hunks.append("")
+        hunks[-1] += line
+
+    pieces: List[Tuple[FilePatchInfo, int]] = []
+    patch, patch_tokens = "", counter.count_text(header)
+    for hunk in hunks:
+        hunk_tokens = counter.count_text(hunk)
+        if patch and patch_tokens + hunk_tokens > max_tokens:
+            pieces.append((file.model_copy(update={"patch": patch}), patch_tokens))
+            patch, patch_tokens = "", counter.count_text(header)
+        patch += hunk
+        patch_tokens += hunk_tokens
+    pieces.append((file.model_copy(update={"patch": patch}), patch_tokens))
+    return pieces
+
+
+def split_diff_files(
+    diff_files: List[FilePatchInfo],
+    counter: TokenCounter,
+    max_tokens: int,
+    max_chunks: int,
+) -> List[List[FilePatchInfo]]:
+    """Split the files of a PR into at most `max_chunks` groups of about `max_tokens` tokens.
+
+    Files larger than `max_tokens` are split into pieces of whole hunks.
+    Pieces are assigned largest first to the least loaded chunk, so chunks
+    end up balanced and the slowest chunk is as small as possible. Chunks
+    may exceed `max_tokens` when `max_chunks` is too low for the PR; the
+    packing stage then compresses them. Files keep their original order
+    within a chunk.
+
+    Files the packing stage only summarizes (deleted files, lockfiles,
+    generated code) count as their summary and are added to the least
+    loaded chunks last, so they never make up a chunk of their own.
+    """
+    # (index of the file, piece of the file, tokens)
+    pieces: List[Tuple[int, FilePatchInfo, int]] = []
+    summaries: List[Tuple[int, FilePatchInfo, int]] = []
+    for n, file in enumerate(diff_files):
+        if is_summary_only(file):
+            summaries.append((n, file, counter.count_text(summarize_file(file))))
+        else:
+            pieces.extend(
+                (n, piece, tokens) for piece, tokens in _split_file_by_hunks(file, counter, max_tokens)
+            )
+    total_tokens = sum(tokens for _, _, tokens in pieces + summaries)
+    num_chunks = max(
+        1, min(max_chunks, len(pieces), math.ceil(total_tokens / max(max_tokens, 1)))
+    )
+    chunks: List[List[int]] = [[] for _ in range(num_chunks)]
+    loads = [0] * num_chunks
+    entries = pieces + summaries
+    order = sorted(range(len(pieces)), key=lambda i: -pieces[i][2])
+    for i in order + list(range(len(pieces), len(entries))):
+        chunk = min(range(num_chunks), key=loads.__getitem__)
+        chunks[chunk].append(i)
+        loads[chunk] += entries[i][2]
+    return [
+        [entries[i][1] for i in sorted(chunk, key=lambda i: (entries[i][0], i))]
+        for chunk in chunks
+        if chunk
+    ]
+
+
+def parse_review(text: str) -> Optional[Dict[str, Any]]:
+    """Parse a YAML PRReview answer, or return None if it is not one."""
+    match = _YAML_BLOCK_PATTERN.search(text)
+    try:
+        data = yaml.safe_load(match.group(1) if match else text)
+    except yaml.YAMLError as e:
+        get_logger().warning(f"Failed to parse review YAML: {e}")
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("review"), dict):
+        return None
+    return data
+
+
+def _as_int(value: Any) -> Optional[int]:
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _NUMBER_PATTERN.search(str(value or ""))
+    return int(match.group()) if match else None
+
+
+def _issue_key(issue: Dict[str, Any]) -> Tuple[str, str]:
+    return (
+        str(issue.get("relevant_file", "")).strip(),
+        str(issue.get("issue_header", "")).strip().lower(),
+    )
+
+
+def _overlaps(issue: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    start, end = _as_int(issue.get("start_line")), _as_int(issue.get("end_line"))
+    other_start, other_end = _as_int(other.get("start_line")), _as_int(other.get("end_line"))
+    if None in (start, end, other_start, other_end):
+        return True
+    return start <= other_end and other_start <= end
+
+
+def merge_reviews(reviews: List[Tuple[Dict[str, Any], int]]) -> Dict[str, Any]:
+    """Merge PRReviews of the chunks of one PR into a single PRReview.
+
+    The effort is the highest effort of any chunk, the score is the mean of
+    the chunk scores weighted by chunk size in tokens, and key issues are
+    concatenated, dropping issues with the same file and header whose line
+    ranges overlap.
+
+    Args:
+        reviews: Parsed PRReview of every chunk with the chunk's token count
+    """
+    efforts = []
+    weighted_score, score_weight = 0, 0
+    key_issues: List[Dict[str, Any]] = []
+    for data, tokens in reviews:
+        review = data["review"]
+        if (effort := _as_int(review.get(EFFORT_KEY))) is not None:
+            efforts.append(effort)
+        if (score := _as_int(review.get("score"))) is not None:
+            weighted_score += score * tokens
+            score_weight += tokens
+        for issue in review.get("key_issues_to_review") or []:
+            if not isinstance(issue, dict):
+                continue
+            # Block scalars keep a trailing newline, which would dump as quoted strings
+            issue = {
+                name: value.strip() if isinstance(value, str) else value
+                for name, value in issue.items()
+            }
+            if any(
+                _issue_key(issue) == _issue_key(kept) and _overlaps(issue, kept)
+                for kept in key_issues
+            ):
+                continue
+            key_issues.append(issue)
+
+    merged: Dict[str, Any] = {}
+    if efforts:
+        merged[EFFORT_KEY] = max(efforts)
+    if score_weight:
+        merged["score"] = round(weighted_score / score_weight)
+    merged["key_issues_to_review"] = key_issues
+    return {"review": merged}
+
+
+def dump_review(data: Dict[str, Any]) -> str:
+    return yaml.safe_dump(data, sort_keys=False, allow_unicode=True)
@@ -0,0 +1,173 @@
+import fnmatch
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from pr_agent.llm.tokens import TokenCounter
+from pr_agent.types import EDIT_TYPE, FilePatchInfo
+
+# Files whose diffs carry little value for a review, summarized instead of shown
+LOW_VALUE_PATTERNS = [
+    "*.lock",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "pnpm-lock.yaml",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    "*.snap",
+    "*.svg",
+    "*_pb2.py",
+    "*_pb2_grpc.py",
+    "*.pb.go",
+    "*.generated.*",
+    "*/generated/*",
+    "*/vendor/*",
+    "*/node_modules/*",
+    "*/dist/*",
+]
+
+FILE_SEPARATOR = "\n\n"
+
+
+@dataclass
+class PackedDiff:
+    """Diff of a PR packed into a token budget, with the compression applied to each file."""
+
+    text: str
+    tokens: int
+    full_files: List[str] = field(default_factory=list)
+    compressed_files: List[str] = field(default_factory=list)
+    summarized_files: List[str] = field(default_factory=list)
+    dropped_files: List[str] = field(default_factory=list)
+
+
+def is_low_value_file(file: FilePatchInfo) -> bool:
+    if file.edit_type == EDIT_TYPE.DELETED:
+        return True
+    path = "/" + file.filename
+    name = os.path.basename(file.filename)
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern)
+        for pattern in LOW_VALUE_PATTERNS
+    )
+
+
+def is_summary_only(file: FilePatchInfo) -> bool:
+    """Whether the file is only ever packed as its one-line summary."""
+    return is_low_value_file(file) or not file.patch
+
+
+def _split_hunks(patch: str) -> List[List[str]]:
+    """Split a patch into hunks; lines before the first hunk header form their own group."""
+    hunks: List[List[str]] = [[]]
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            hunks.append([])
+        hunks[-1].append(line)
+    return [hunk for hunk in hunks if hunk]
+
+
+def _compress_patch(patch: str, drop_deletions: bool = False) -> str:
+    """Drop context lines of every hunk, and optionally replace runs of deleted lines with a marker."""
+    lines: List[str] = []
+    for hunk in _split_hunks(patch):
+        if not hunk[0].startswith("@@"):
+            lines.extend(hunk)
+            continue
+        lines.append(hunk[0])
+        deleted = 0
+        for line in hunk[1:]:
+            if line.startswith((" ", "\\")):
+                continue
+            if drop_deletions and line.startswith("-"):
+                deleted += 1
+                continue
+            if deleted:
+                lines.append(f"-... ({deleted} deleted lines omitted)")
+                deleted = 0
+            lines.append(line)
+        if deleted:
+            lines.append(f"-... ({deleted} deleted lines omitted)")
+    return "\n".join(lines)
+
+
+def summarize_file(file: FilePatchInfo) -> str:
+    return (
+        f"## File: {file.filename}\n"
+        f"(patch omitted: {file.edit_type.name.lower()} file, "
+        f"+{max(file.num_plus_lines, 0)} -{max(file.num_minus_lines, 0)} lines)"
+    )
+
+
+def _priority(file: FilePatchInfo):
+    # Files adding the most code come first, low-value files last
+    return (is_low_value_file(file), -max(file.num_plus_lines, 0))
+
+
+def pack_diff_files(
+    diff_files: List[FilePatchInfo], counter: TokenCounter, max_tokens: int
+) -> PackedDiff:
+    """Pack the diffs of a PR into `max_tokens` tokens, maximizing review coverage.
+
+    Every file first gets a one-line summary, in order of priority, so that as
+    many files as possible are at least mentioned. The budget left is then
+    spent in order of priority, showing each file in the least compressed
+    form that fits: the full patch, the patch without context lines, or the
+    patch without context and deleted lines. Low-value files (deleted files,
+    lockfiles, generated code) are only summarized. Files keep their original
+    order in the packed text.
+
+    `FilePatchInfo.tokens` is set to the token count of the full patch.
+    """
+    separator_tokens = counter.count_text(FILE_SEPARATOR)
+    renderings: Dict[int, List[str]] = {}
+    for i, file in enumerate(diff_files):
+        header = f"## File: {file.filename}\n"
+        full = header + file.patch
+        file.tokens = counter.count_text(full)
+        if is_summary_only(file):
+            renderings[i] = []
+            continue
+        candidates = [
+            full,
+            header + _compress_patch(file.patch),
+            header + _compress_patch(file.patch, drop_deletions=True),
+        ]
+        renderings[i] = list(dict.fromkeys(candidates))
+
+    order = sorted(range(len(diff_files)), key=lambda i: _priority(diff_files[i]))
+    budget = max_tokens
+    chosen: Dict[int, str] = {}
+    chosen_tokens: Dict[int, int] = {}
+    for i in order:
+        summary = summarize_file(diff_files[i])
+        tokens = counter.count_text(summary) + separator_tokens
+        if tokens <= budget:
+            chosen[i], chosen_tokens[i] = summary, tokens
+            budget -= tokens
+
+    packed = PackedDiff(text="", tokens=0)
+    for i in order:
+        if i not in chosen:
+            continue
+        for level, text in enumerate(renderings[i]):
+            tokens = counter.count_text(text) + separator_tokens
+            if tokens - chosen_tokens[i] <= budget:
+                budget -= tokens - chosen_tokens[i]
+                chosen[i], chosen_tokens[i] = text, tokens
+                if level == 0:
+                    packed.full_files.append(diff_files[i].filename)
+                else:
+                    packed.compressed_files.append(diff_files[i].filename)
+                break
+        else:
+            packed.summarized_files.append(diff_files[i].filename)
+
+    packed.dropped_files = [
+        file.filename for i, file in enumerate(diff_files) if i not in chosen
+    ]
+    packed.text = FILE_SEPARATOR.join(chosen[i] for i in sorted(chosen))
+    packed.tokens = max_tokens - budget
+    return packed
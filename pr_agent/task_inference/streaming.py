@@ -0,0 +1,169 @@
+import re
+import textwrap
+from typing import Any, Dict, List, Optional, Sequence
+
+import yaml
+
+from pr_agent.log import get_logger
+from pr_agent.task_inference.chunking import EFFORT_KEY
+
+KEY_ISSUES_KEY = "key_issues_to_review"
+REQUIRED_FIELDS = (EFFORT_KEY, "score", KEY_ISSUES_KEY)
+
+_FIELD_PATTERN = re.compile(r"^(\s*)([^\s#:\-][^:]*):(\s.*)?$")
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(" "))
+
+
+def _strip_strings(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        name: value.strip() if isinstance(value, str) else value
+        for name, value in data.items()
+    }
+
+
+class ReviewStreamParser:
+    """
+    Incremental parser of a PRReview YAML answer streamed by the model.
+
+    Fields of the review are parsed as soon as the next field starts, and
+    every entry of `key_issues_to_review` as soon as the next entry (or
+    field) starts, so issues can be processed while the model is still
+    generating the rest of the review. Text around the `review` mapping
+    (code fences, explanations) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.review: Dict[str, Any] = {}
+        self.key_issues: List[Dict[str, Any]] = []
+        self._pending = ""
+        self._root_indent: Optional[int] = None
+        self._field_indent: Optional[int] = None
+        self._field: Optional[str] = None
+        self._field_lines: List[str] = []
+        self._item_indent: Optional[int] = None
+        self._item_lines: List[str] = []
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        """Whether the review mapping has ended."""
+        return self._done
+
+    def is_complete(self, required: Sequence[str] = REQUIRED_FIELDS) -> bool:
+        """Whether all `required` fields are parsed, so the rest of the answer may be skipped."""
+        return all(name in self.review for name in required)
+
+    def feed(self, delta: str) -> List[Dict[str, Any]]:
+        """Add a piece of the answer.
+
+        Returns:
+            Key issues completed by this piece
+        """
+        self.text += delta
+        lines = (self._pending + delta).split("\n")
+        self._pending = lines.pop()
+        issues: List[Dict[str, Any]] = []
+        for line in lines:
+            issues.extend(self._feed_line(line.rstrip("\r")))
+        return issues
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Flush the end of the answer.
+
+        Returns:
+            Key issues completed by the end of the answer
+        """
+        issues = self._feed_line(self._pending) if self._pending else []
+        self._pending = ""
+        return issues + self._close_field()
+
+    def result(self) -> Dict[str, Any]:
+        """The PRReview parsed so far."""
+        review = dict(self.review)
+        review[KEY_ISSUES_KEY] = list(self.key_issues)
+        return {"review": review}
+
+    def _feed_line(self, line: str) -> List[Dict[str, Any]]:
+        if self._done:
+            return []
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            # The closing fence ends the review
+            return self._close_field(done=True) if self._field_indent is not None else []
+        if not stripped:
+            if self._field is not None:
+                self._field_lines.append(line)
+                if self._item_lines:
+                    self._item_lines.append(line)
+            return []
+        indent = _indent(line)
+        if self._root_indent is None:
+            if stripped == "review:":
+                self._root_indent = indent
+            return []
+
+        if self._field == KEY_ISSUES_KEY and stripped.startswith("-") and indent >= self._field_indent:
+            issues: List[Dict[str, Any]] = []
+            if self._item_indent is None:
+                self._item_indent = indent
+            if indent == self._item_indent:
+                issues = self._close_item()
+            self._item_lines.append(line)
+            return issues
+
+        match = _FIELD_PATTERN.match(line)
+        if self._field_indent is None:
+            if match is None or indent <= self._root_indent:
+                return []
+            self._field_indent = indent
+        if indent < self._field_indent:
+            return self._close_field(done=True)
+        if indent == self._field_indent and match is not None:
+            issues = self._close_field()
+            self._field = match.group(2).strip()
+            self._field_lines = [line]
+            return issues
+        if self._field is not None:
+            self._field_lines.append(line)
+            if self._item_lines:
+                self._item_lines.append(line)
+        return []
+
+    def _load(self, lines: List[str]) -> Any:
+        try:
+            return yaml.safe_load(textwrap.dedent("\n".join(lines)))
+        except yaml.YAMLError as e:
+            get_logger().debug(f"Failed to parse streamed review YAML: {e}")
+            return None
+
+    def _close_item(self) -> List[Dict[str, Any]]:
+        lines, self._item_lines = self._item_lines, []
+        if not lines:
+            return []
+        items = self._load(lines)
+        if not isinstance(items, list) or not items or not isinstance(items[0], dict):
+            return []
+        issue = _strip_strings(items[0])
+        self.key_issues.append(issue)
+        return [issue]
+
+    def _close_field(self, done: bool = False) -> List[Dict[str, Any]]:
+        self._done = self._done or done
+        field, lines = self._field, self._field_lines
+        self._field, self._field_lines = None, []
+        if field is None:
+            return []
+        if field == KEY_ISSUES_KEY:
+            issues = self._close_item()
+            self._item_indent = None
+            self.review[KEY_ISSUES_KEY] = list(self.key_issues)
+            return issues
+        data = self._load(lines)
+        if isinstance(data, dict) and field in data:
+            value = data[field]
+            self.review[field] = value.strip() if isinstance(value, str) else value
+        return []
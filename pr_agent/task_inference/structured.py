@@ -0,0 +1,156 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+try:
+    from instructor.core import InstructorRetryException
+except ImportError:
+    from instructor.exceptions import InstructorRetryException
+
+from pr_agent.llm.litellm import LiteLLMModel
+from pr_agent.log import get_logger
+from pr_agent.task_inference.streaming import KEY_ISSUES_KEY
+from pr_agent.types import KeyIssuesComponentLink, PRReview, Review
+from pr_agent.utils.json_parsing import parse_json
+
+_KEY_ISSUE_PREFIX = "key_issue_"
+
+
+def raw_review_data(completion: Any) -> Optional[Dict[str, Any]]:
+    """JSON object of a completion that failed validation, from its tool call or its text."""
+    try:
+        message = completion.choices[0].message
+    except (AttributeError, IndexError, TypeError):
+        return None
+    tool_calls = getattr(message, "tool_calls", None)
+    text = tool_calls[0].function.arguments if tool_calls else message.content or ""
+    data = parse_json(text)
+    return data if isinstance(data, dict) else None
+
+
+def _review_field(name: Any) -> Optional[str]:
+    """Name of the Review field with the name or alias `name`."""
+    for field_name, field in Review.model_fields.items():
+        if name in (field_name, field.alias):
+            return field_name
+    return None
+
+
+def build_repair_model(error: ValidationError) -> Type[BaseModel]:
+    """Response model asking for the invalid fields of a PRReview only.
+
+    An invalid key issue is asked for as a whole, other invalid fields
+    one by one. If the review itself is missing or malformed, the whole
+    review is asked for again.
+    """
+    fields: Dict[str, Any] = {}
+    for e in error.errors():
+        loc = e["loc"]
+        field_name = _review_field(loc[1]) if len(loc) >= 2 and loc[0] == "review" else None
+        if field_name is None:
+            return create_model("PRReviewRepair", review=(Review, ...))
+        if field_name == KEY_ISSUES_KEY and len(loc) >= 3 and isinstance(loc[2], int):
+            fields[f"{_KEY_ISSUE_PREFIX}{loc[2] + 1}"] = (
+                KeyIssuesComponentLink,
+                Field(description=f"Corrected entry {loc[2] + 1} of {KEY_ISSUES_KEY}"),
+            )
+        else:
+            field = Review.model_fields[field_name]
+            fields[field_name] = (field.annotation, field)
+    return create_model("PRReviewRepair", **fields)
+
+
+def repair_messages(
+    messages: List[Dict[str, str]], data: Dict[str, Any], error: ValidationError
+) -> List[Dict[str, str]]:
+    problems = "\n".join(
+        f"- {'.'.join(str(part) for part in e['loc']) or 'answer'}: {e['msg']}"
+        for e in error.errors()
+    )
+    return [
+        *messages,
+        {"role": "assistant", "content": json.dumps(data)},
+        {
+            "role": "user",
+            "content": f"These fields of your answer are invalid:\n{problems}\n"
+            "Answer with corrected values of these fields only.",
+        },
+    ]
+
+
+def apply_repair(data: Dict[str, Any], repaired: BaseModel):
+    """Replace the invalid fields of a PRReview answer by their repaired values."""
+    if not isinstance(data.get("review"), dict):
+        data["review"] = {}
+    review = data["review"]
+    for name in type(repaired).model_fields:
+        value = getattr(repaired, name)
+        if name == "review":
+            data["review"] = value.model_dump(by_alias=True)
+        elif name.startswith(_KEY_ISSUE_PREFIX):
+            review[KEY_ISSUES_KEY][int(name[len(_KEY_ISSUE_PREFIX):]) - 1] = value.model_dump()
+        elif name == KEY_ISSUES_KEY:
+            review[name] = [issue.model_dump() for issue in value]
+        else:
+            review[Review.model_fields[name].alias or name] = value
+
+
+class ReviewRepairer:
+    """
+    Gets a valid PRReview from the model, re-asking only for invalid fields.
+
+    The review is asked for through the model's tool or JSON mode, with no
+    validation retry: failed requests (rate limits, server errors) are
+    retried and routed by the model like any query. If the answer fails
+    validation, the fields that failed are asked for again, with the errors,
+    and merged into the answer, up to `max_repairs` times, instead of paying
+    for the whole review again.
+
+    Args:
+        llm: Model producing the reviews
+        max_repairs: Maximum number of repair requests per review
+    """
+
+    def __init__(self, llm: LiteLLMModel, max_repairs: int = 2):
+        self.llm = llm
+        self.max_repairs = max_repairs
+
+    def _repair_request(
+        self, messages: List[Dict[str, str]], data: Dict[str, Any], error: ValidationError
+    ) -> Tuple[Type[BaseModel], List[Dict[str, str]]]:
+        repair_model = build_repair_model(error)
+        get_logger().info(f"Repairing invalid review fields: {', '.join(repair_model.model_fields)}")
+        return repair_model, repair_messages(messages, data, error)
+
+    def create(self, messages: List[Dict[str, str]]) -> PRReview:
+        try:
+            return self.llm.create(PRReview, messages, max_retries=0)
+        except InstructorRetryException as e:
+            data = raw_review_data(e.last_completion)
+            if data is None:
+                raise
+        for attempt in range(self.max_repairs + 1):
+            try:
+                return PRReview.model_validate(data)
+            except ValidationError as error:
+                if attempt == self.max_repairs:
+                    raise
+                repair_model, repair = self._repair_request(messages, data, error)
+            apply_repair(data, self.llm.create(repair_model, repair, max_retries=1))
+
+    async def acreate(self, messages: List[Dict[str, str]]) -> PRReview:
+        try:
+            return await self.llm.acreate(PRReview, messages, max_retries=0)
+        except InstructorRetryException as e:
+            data = raw_review_data(e.last_completion)
+            if data is None:
+                raise
+        for attempt in range(self.max_repairs + 1):
+            try:
+                return PRReview.model_validate(data)
+            except ValidationError as error:
+                if attempt == self.max_repairs:
+                    raise
+                repair_model, repair = self._repair_request(messages, data, error)
+            apply_repair(data, await self.llm.acreate(repair_model, repair, max_retries=1))
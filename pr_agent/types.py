@@ -1,7 +1,7 @@
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class EDIT_TYPE(Enum):
@@ -24,3 +24,40 @@ class FilePatchInfo(BaseModel):
     num_minus_lines: int = -1
     language: Optional[str] = None
     ai_file_summary: str = None
+
+
+class KeyIssuesComponentLink(BaseModel):
+    relevant_file: str = Field(description="The full file path of the relevant file")
+    issue_header: str = Field(description="One or two word title for the issue. For example: 'Possible Bug', etc.")
+    issue_content: str = Field(description="A short and concise summary of what should be further inspected and validated during the PR review process for this issue. Do not mention line numbers in this field.")
+    start_line: int = Field(description="The start line that corresponds to this issue in the relevant file")
+    end_line: int = Field(description="The end line that corresponds to this issue in the relevant file")
+
+    @model_validator(mode="after")
+    def check_line_range(self):
+        if self.end_line < self.start_line:
+            raise ValueError("end_line must not be before start_line")
+        return self
+
+
+class Review(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    estimated_effort_to_review: int = Field(
+        alias="estimated_effort_to_review_[1-5]",
+        ge=1,
+        le=5,
+        description="Estimate, on a scale of 1-5 (inclusive), the time and effort required to review this PR by an experienced and knowledgeable developer. 1 means short and easy review , 5 means long and hard review. Take into account the size, complexity, quality, and the needed changes of the PR code diff.",
+    )
+    score: int = Field(
+        ge=0,
+        le=100,
+        description="Rate this PR on a scale of 0-100 (inclusive), where 0 means the worst possible PR code, and 100 means PR code of the highest quality, without any bugs or performance issues, that is ready to be merged immediately and run in production at scale.",
+    )
+    key_issues_to_review: List[KeyIssuesComponentLink] = Field(
+        description="A short and diverse list (0-3 issues) of high-priority bugs, problems or performance concerns introduced in the PR code, which the PR reviewer should further focus on and validate during the review process.",
+    )
+
+
+class PRReview(BaseModel):
+    review: Review
@@ -1,3 +1,4 @@
+from pr_agent.utils.cache import DiskCache
 from pr_agent.utils.configs import load_config, unpack_omega_config
 
-__all__ = ["load_config", "unpack_omega_config"]
+__all__ = ["DiskCache", "load_config", "unpack_omega_config"]
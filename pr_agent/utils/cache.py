@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from pr_agent.log import get_logger
+
+
+class DiskCache:
+    """
+    Size-bounded key-value cache of immutable values stored on local disk.
+
+    Keys are hashed into a content-addressed directory layout, so any string
+    (e.g. "repo:commit_sha:path") can be used as a key. Once the total size of
+    the cache exceeds `max_size_bytes`, the least recently used entries are
+    evicted. Entries are never invalidated, so only immutable values
+    (e.g. contents addressed by a git SHA) should be stored.
+
+    Args:
+        directory: Directory where cache entries are stored
+        max_size_bytes: Upper bound for the total size of cached entries
+    """
+
+    def __init__(self, directory: Union[str, Path], max_size_bytes: int):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        # Entry path -> size in bytes, ordered from least to most recently used
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        self._size = 0
+        self._load_entries()
+
+    def _load_entries(self):
+        entries = []
+        for path in self.directory.glob("*/*"):
+            if path.is_file() and not path.name.startswith("."):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._entries[path] = size
+            self._size += size
+        self._evict()
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / digest[2:]
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if path not in self._entries:
+                # Written by another process sharing the cache directory
+                self._size += len(value)
+            self._entries[path] = len(value)
+            self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_size_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write atomically so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            get_logger().warning(f"Failed to write cache entry {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._size += len(value) - self._entries.pop(path, 0)
+            self._entries[path] = len(value)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_size_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
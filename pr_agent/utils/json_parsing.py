@@ -0,0 +1,250 @@
+import difflib
+import json
+import logging
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pr_agent.exceptions import OutputParserException
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_CODE_FENCE = "```"
+_CODE_FENCE_HEADER_PATTERN = re.compile(r"```(?:json)?\s*")
+# A whole JSON string, an unterminated one, or a brace
+_STRUCTURE_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|"|[{}]', re.DOTALL)
+_DECODER = json.JSONDecoder()
+# Cutoff of difflib.get_close_matches
+_MATCH_CUTOFF = 0.6
+_VALUE_MATCHERS_CACHE_SIZE = 64
+
+
+def loads(data: str) -> Any:
+    """json.loads, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def find_json_object(text: str, start: int = 0) -> Optional[Tuple[int, int]]:
+    """Bounds of the first balanced `{...}` in `text` from `start`, or None.
+
+    Runs in linear time: strings are skipped as a whole by one regular
+    expression, so braces inside them are ignored.
+    """
+    begin = text.find("{", start)
+    if begin < 0:
+        return None
+    depth = 0
+    for match in _STRUCTURE_PATTERN.finditer(text, begin):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return begin, match.end()
+        elif token == '"':
+            # Unterminated string, the object is truncated
+            return None
+    return None
+
+
+def _find_code_block(text: str) -> Optional[Tuple[int, str]]:
+    """Start and content of the first code block in `text`, or None."""
+    start = text.find(_CODE_FENCE)
+    if start < 0:
+        return None
+    content_start = _CODE_FENCE_HEADER_PATTERN.match(text, start).end()
+    end = text.find(_CODE_FENCE, content_start)
+    if end < 0:
+        return None
+    return start, text[content_start:end]
+
+
+def _try_loads(data: str) -> Optional[Any]:
+    try:
+        return loads(data)
+    except ValueError as e:
+        logger.debug(f"JSON decoding error: {e}")
+        return None
+
+
+def _repair(data: str) -> Any:
+    try:
+        import json_repair
+    except ImportError:
+        return None
+    return json_repair.repair_json(data, ensure_ascii=False, return_objects=True) or None
+
+
+def parse_json(raw_reply: str, repair: bool = False) -> Optional[Any]:
+    """Parse the JSON of an LLM reply: the whole reply, a code block or the first object in it.
+
+    A reply that is plain JSON is parsed directly, and the first object of
+    a reply with text around it is decoded in place rather than cut out
+    with a regular expression first.
+
+    Args:
+        raw_reply: Reply of the LLM
+        repair: Whether to repair invalid JSON with json_repair, if installed,
+            when nothing parses as is
+
+    Returns:
+        The parsed JSON, or None if none was found
+    """
+    raw_reply = raw_reply.strip()
+    if raw_reply.startswith("{") and raw_reply.endswith("}"):
+        if (reply := _try_loads(raw_reply)) is not None:
+            return reply
+    candidates = []
+    brace = raw_reply.find("{")
+    code_block = _find_code_block(raw_reply)
+    # Whether the reply has an object that is not in a code block before it
+    in_text = brace >= 0 and (code_block is None or brace < code_block[0])
+    if code_block is not None and not in_text:
+        if code_block[1]:
+            candidates.append(code_block[1].strip())
+    elif in_text:
+        try:
+            return _DECODER.raw_decode(raw_reply, brace)[0]
+        except ValueError as e:
+            logger.debug(f"JSON decoding error: {e}")
+        # Up to the last brace, like the greedy pattern this replaces
+        last_brace = raw_reply.rfind("}")
+        if last_brace > brace:
+            candidates.append(raw_reply[brace : last_brace + 1])
+    candidates.append(raw_reply)
+    for candidate in candidates:
+        if (reply := _try_loads(candidate)) is not None:
+            return reply
+    if repair:
+        if in_text:
+            bounds = find_json_object(raw_reply, brace)
+            # An unbalanced object is most likely cut, repair it up to the end
+            candidates.insert(0, raw_reply[brace : bounds[1]] if bounds else raw_reply[brace:])
+        for candidate in candidates:
+            if (reply := _repair(candidate)) is not None:
+                return reply
+    logger.error("JSON decoding error: no valid JSON found in the reply")
+    return None
+
+
+def _trigrams(value: str) -> Set[str]:
+    # Padded so that values shorter than three characters have trigrams too
+    padded = f"  {value.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ValueMatcher:
+    """
+    Finds the valid value closest to a value parsed by the LLM.
+
+    An exact match is looked up in a dict. Otherwise the valid values
+    sharing a trigram with the parsed value are compared with difflib first,
+    with the cutoff of `difflib.get_close_matches`, and all valid values only
+    if none of them is close enough. The result differs from
+    `difflib.get_close_matches` only when a value sharing no trigram is
+    closer than the closest value sharing one.
+    """
+
+    def __init__(self, valid_values: Iterable[str]):
+        self.valid_values = list(dict.fromkeys(valid_values))
+        self._exact = {value: value for value in self.valid_values}
+        self._index: Dict[str, List[int]] = defaultdict(list)
+        for i, value in enumerate(self.valid_values):
+            for trigram in _trigrams(value):
+                self._index[trigram].append(i)
+
+    def match(self, value: str) -> Optional[str]:
+        if value in self._exact:
+            return self._exact[value]
+        candidates: Set[int] = set()
+        for trigram in _trigrams(value):
+            candidates.update(self._index.get(trigram, ()))
+        matches = difflib.get_close_matches(
+            value, [self.valid_values[i] for i in candidates], n=1, cutoff=_MATCH_CUTOFF
+        )
+        if not matches and len(candidates) < len(self.valid_values):
+            matches = difflib.get_close_matches(
+                value, self.valid_values, n=1, cutoff=_MATCH_CUTOFF
+            )
+        return matches[0] if matches else None
+
+
+@lru_cache(maxsize=_VALUE_MATCHERS_CACHE_SIZE)
+def _get_value_matcher(valid_values: Tuple[str, ...]) -> ValueMatcher:
+    return ValueMatcher(valid_values)
+
+
+def get_value_matcher(valid_values: Union[Iterable[str], ValueMatcher]) -> ValueMatcher:
+    """Matcher of `valid_values`, built once per set of values."""
+    if isinstance(valid_values, ValueMatcher):
+        return valid_values
+    return _get_value_matcher(tuple(valid_values))
+
+
+def check_json_values(
+    parsed_json: Dict,
+    valid_values: Optional[Union[Iterable[str], ValueMatcher]],
+    fallback_value: Optional[str],
+):
+    if valid_values is not None:
+        matcher = get_value_matcher(valid_values)
+        for key, parsed_value in parsed_json.items():
+            # Currently only support single parsed value
+            if isinstance(parsed_value, list) and len(parsed_value) == 1:
+                parsed_value = parsed_value[0]
+            if isinstance(parsed_value, str):
+                match = matcher.match(parsed_value)
+            else:
+                logger.warning(
+                    f"Unrecognized parsed value: {parsed_value} for key {key} parsed by the LLM. "
+                    f"It has type: {type(parsed_value)}."
+                )
+                match = None
+
+            if match is None:
+                if fallback_value:
+                    logger.warning(
+                        f"Unrecognized value: {parsed_value} for key {key} parsed by the LLM. "
+                        f"Will use default value: {fallback_value}."
+                    )
+                    parsed_json[key] = fallback_value
+                else:
+                    raise ValueError(
+                        f"Unrecognized value: {parsed_value} for key {key} parsed by the LLM."
+                    )
+            else:
+                parsed_json[key] = match
+    return parsed_json
+
+
+def parse_and_check_json(
+    raw_reply: str,
+    expected_keys: Iterable[str],
+    valid_values: Optional[Union[Iterable[str], ValueMatcher]] = None,
+    fallback_value: Optional[str] = None,
+    repair: bool = False,
+):
+    if json_obj := parse_json(raw_reply, repair=repair):
+        for key in expected_keys:
+            if key not in json_obj:
+                error = (
+                    f"Got invalid return object. Expected key `{key}` "
+                    f"to be present, but got {json_obj}"
+                )
+                logger.error(error)
+                raise OutputParserException(error)
+        try:
+            check_json_values(json_obj, valid_values, fallback_value)
+        except ValueError as e:
+            raise OutputParserException(e)
+        return json_obj
+    raise OutputParserException("JSON decoding error or JSON not found in output")
@@ -0,0 +1,4 @@
+import os
+
+# litellm fetches its model cost map over the network on import otherwise
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
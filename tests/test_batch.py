@@ -0,0 +1,266 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pr_agent.llm.batch import BatchJob
+from pr_agent.llm.litellm import LiteLLMModel
+
+
+class BatchServer(ThreadingHTTPServer):
+    """OpenAI files and batches endpoints, finishing a batch on its `polls_to_finish`-th status check."""
+
+    def __init__(self, polls_to_finish=3):
+        super().__init__(("127.0.0.1", 0), BatchHandler)
+        self.polls_to_finish = polls_to_finish
+        self.files = {}
+        self.batches = {}
+        self.uploads = 0
+        self.created_batches = []
+        self.polls = 0
+        self.fail_next_batch_creation = False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def batch_object(self, batch):
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": batch["status"],
+            "created_at": 1,
+            "output_file_id": batch.get("output_file_id"),
+            "error_file_id": batch.get("error_file_id"),
+        }
+
+    def finish(self, batch):
+        outputs, errors = [], []
+        for line in self.files[batch["input_file_id"]]:
+            request = json.loads(line)
+            content = request["body"]["messages"][-1]["content"]
+            if "invalid" in content:
+                errors.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 400, "body": {"error": {"message": "invalid request"}}},
+                        "error": None,
+                    }
+                )
+                continue
+            completion = {
+                "id": "chatcmpl",
+                "object": "chat.completion",
+                "created": 1,
+                "model": request["body"]["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": f"answer to {content}"},
+                    }
+                ],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+            }
+            outputs.append(
+                {
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": completion},
+                    "error": None,
+                }
+            )
+        self.files[f"{batch['id']}-output"] = [json.dumps(output) for output in outputs]
+        self.files[f"{batch['id']}-errors"] = [json.dumps(error) for error in errors]
+        batch.update(
+            status="completed",
+            output_file_id=f"{batch['id']}-output",
+            error_file_id=f"{batch['id']}-errors",
+        )
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+    def _send(self, body, status=200):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            # Multipart upload, the request lines are the JSON lines of the body
+            lines = [line for line in data.decode().splitlines() if line.startswith('{"custom_id"')]
+            file_id = f"file-{server.uploads}"
+            server.uploads += 1
+            server.files[file_id] = lines
+            self._send(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(data),
+                    "created_at": 1,
+                    "filename": "requests.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path == "/v1/batches":
+            if server.fail_next_batch_creation:
+                server.fail_next_batch_creation = False
+                self._send({"error": {"message": "invalid input file"}}, status=400)
+                return
+            request = json.loads(data)
+            batch_id = f"batch-{len(server.batches)}"
+            server.batches[batch_id] = {
+                "id": batch_id,
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "status": "validating",
+            }
+            server.created_batches.append(request)
+            self._send(server.batch_object(server.batches[batch_id]))
+        else:
+            self._send({"error": {"message": "not found"}}, status=404)
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith("/v1/batches/"):
+            batch = server.batches[self.path.rsplit("/", 1)[1]]
+            server.polls += 1
+            if server.polls >= server.polls_to_finish:
+                server.finish(batch)
+            else:
+                batch["status"] = "in_progress"
+            self._send(server.batch_object(batch))
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            file_id = self.path.split("/")[-2]
+            self._send("\n".join(server.files[file_id]).encode())
+        else:
+            self._send({"error": {"message": "not found"}}, status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = BatchServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def llm(server, tmp_path):
+    return LiteLLMModel(
+        model="openai/gpt-4o-mini",
+        base_url=server.url,
+        api_key="key",
+        temperature=0,
+        cache={"path": str(tmp_path / "responses.sqlite")},
+    )
+
+
+REQUESTS = {
+    "https://github.com/owner/repo/pull/1": [{"role": "user", "content": "one"}],
+    "https://github.com/owner/repo/pull/2": [{"role": "user", "content": "invalid two"}],
+    "https://github.com/owner/repo/pull/3": [{"role": "user", "content": "three"}],
+}
+
+
+def test_results_are_mapped_back_to_request_keys(server, llm, tmp_path):
+    job = BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01)
+    results = job.run(REQUESTS)
+    assert results == {
+        "https://github.com/owner/repo/pull/1": "answer to one",
+        "https://github.com/owner/repo/pull/3": "answer to three",
+    }
+    assert server.uploads == 1
+    assert [batch["endpoint"] for batch in server.created_batches] == ["/v1/chat/completions"]
+    # Polled until the batch reached a terminal status
+    assert server.polls == server.polls_to_finish
+    state = json.loads((tmp_path / "batch.json").read_text())
+    assert state["status"] == "completed"
+    assert state["downloaded"]
+    assert "invalid request" in state["errors"]["https://github.com/owner/repo/pull/2"]
+
+    # Running the finished batch again only reads the state file
+    assert BatchJob(llm, tmp_path / "batch.json").run(REQUESTS) == results
+    assert server.polls == server.polls_to_finish
+
+
+def test_request_file_is_in_openai_batch_format(server, llm, tmp_path):
+    BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01).run(REQUESTS)
+    lines = [json.loads(line) for line in server.files["file-0"]]
+    assert [line["custom_id"] for line in lines] == ["request-0", "request-1", "request-2"]
+    assert {line["url"] for line in lines} == {"/v1/chat/completions"}
+    assert lines[0]["body"] == {
+        "messages": [{"role": "user", "content": "one"}],
+        "temperature": 0,
+        "model": "gpt-4o-mini",
+    }
+
+
+def test_resumes_a_batch_from_a_state_file_written_mid_run(server, llm, tmp_path):
+    with pytest.raises(TimeoutError):
+        BatchJob(llm, tmp_path / "batch.json", poll_interval=0.05).run(REQUESTS, timeout=0.06)
+    state = json.loads((tmp_path / "batch.json").read_text())
+    assert (state["batch_id"], state["status"]) == ("batch-0", "in_progress")
+
+    # A new process picks up the same batch instead of submitting it again
+    results = BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01).run(REQUESTS)
+    assert set(results) == {"https://github.com/owner/repo/pull/1", "https://github.com/owner/repo/pull/3"}
+    assert server.uploads == 1
+    assert len(server.created_batches) == 1
+
+
+def test_resumes_after_a_failed_batch_creation_without_uploading_again(server, llm, tmp_path):
+    server.fail_next_batch_creation = True
+    with pytest.raises(Exception):
+        BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01).run(REQUESTS)
+    state = json.loads((tmp_path / "batch.json").read_text())
+    assert (state["input_file_id"], state["batch_id"]) == ("file-0", None)
+
+    results = BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01).run(REQUESTS)
+    assert len(results) == 2
+    assert server.uploads == 1
+    assert server.created_batches[0]["input_file_id"] == "file-0"
+
+
+def test_cached_responses_are_not_submitted(server, llm, tmp_path):
+    BatchJob(llm, tmp_path / "first.json", poll_interval=0.01).run(REQUESTS)
+    requests = {
+        "https://github.com/owner/repo/pull/1": REQUESTS["https://github.com/owner/repo/pull/1"],
+        "https://github.com/owner/repo/pull/4": [{"role": "user", "content": "four"}],
+    }
+    results = BatchJob(llm, tmp_path / "second.json", poll_interval=0.01).run(requests)
+    assert results == {
+        "https://github.com/owner/repo/pull/1": "answer to one",
+        "https://github.com/owner/repo/pull/4": "answer to four",
+    }
+    submitted = [json.loads(line)["body"]["messages"] for line in server.files["file-1"]]
+    assert submitted == [[{"role": "user", "content": "four"}]]
+
+
+def test_state_files_of_other_requests_are_rejected(server, llm, tmp_path):
+    BatchJob(llm, tmp_path / "batch.json", poll_interval=0.01).run(REQUESTS)
+    with pytest.raises(ValueError):
+        BatchJob(llm, tmp_path / "batch.json").run({"https://github.com/owner/repo/pull/9": []})
+
+
+@pytest.mark.parametrize(
+    "model", ["vertex_ai/gemini-1.5-pro", "bedrock/anthropic.claude-3-haiku-20240307-v1:0"]
+)
+def test_providers_without_openai_batch_format_are_rejected(model, tmp_path):
+    with pytest.raises(ValueError):
+        BatchJob(LiteLLMModel(model=model, api_key="key"), tmp_path / "batch.json")
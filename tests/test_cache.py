@@ -0,0 +1,64 @@
+import time
+
+from pr_agent.llm.cache import ResponseCache
+
+
+def _kwargs(**overrides):
+    return {"model": "gpt-4o", "messages": [{"role": "user", "content": "Review this"}], **overrides}
+
+
+def test_make_key_ignores_transport_options_and_whitespace():
+    key = ResponseCache.make_key(_kwargs())
+    assert ResponseCache.make_key(_kwargs(api_key="secret", timeout=10, metadata={"a": 1})) == key
+    assert (
+        ResponseCache.make_key(
+            _kwargs(messages=[{"role": "user", "content": " Review this\n", "name": None}])
+        )
+        == key
+    )
+    assert ResponseCache.make_key(_kwargs(model="gpt-4o-mini")) != key
+    assert ResponseCache.make_key(_kwargs(tools=[{"name": "t"}])) != key
+
+
+def test_is_cacheable():
+    assert ResponseCache.is_cacheable(_kwargs(temperature=0))
+    assert ResponseCache.is_cacheable(_kwargs(temperature=0.0))
+    assert ResponseCache.is_cacheable(_kwargs(temperature=0.7, seed=42))
+    assert ResponseCache.is_cacheable(_kwargs(seed=0))
+    # The provider's default temperature usually samples
+    assert not ResponseCache.is_cacheable(_kwargs())
+    assert not ResponseCache.is_cacheable(_kwargs(temperature=None))
+    assert not ResponseCache.is_cacheable(_kwargs(temperature=0.7))
+    assert not ResponseCache.is_cacheable(_kwargs(temperature=0, stream=True))
+
+
+def test_get_and_set(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.db")
+    assert cache.get("key") is None
+    cache.set("key", "response")
+    assert cache.get("key") == "response"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    # Responses outlive the process on disk
+    cache = ResponseCache(tmp_path / "cache.db")
+    assert cache.get("key") == "response"
+    assert len(cache) == 1
+
+
+def test_responses_expire(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.db", ttl_seconds=0.05)
+    cache.set("key", "response")
+    time.sleep(0.1)
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    response = "x" * 400_000
+    cache = ResponseCache(tmp_path / "cache.db", max_size_mb=1, memory_entries=1)
+    cache.set("first", response)
+    cache.set("second", response)
+    cache.get("first")
+    cache.set("third", response)
+    assert len(cache) == 2
+    assert cache.get("second") is None
+    assert cache.get("first") == cache.get("third") == response
@@ -0,0 +1,129 @@
+from pr_agent.task_inference.chunking import (
+    EFFORT_KEY,
+    dump_review,
+    merge_reviews,
+    parse_review,
+    split_diff_files,
+)
+from pr_agent.task_inference.packing import summarize_file
+from pr_agent.types import EDIT_TYPE, FilePatchInfo
+
+
+class WordCounter:
+    """Token counter counting whitespace-separated words, for predictable budgets."""
+
+    def count_text(self, text):
+        if isinstance(text, list):
+            return sum(self.count_text(t) for t in text)
+        return len(text.split())
+
+
+counter = WordCounter()
+
+
+def make_file(filename, added=0, context=0, deleted=0, edit_type=EDIT_TYPE.MODIFIED, hunks=1):
+    patch = ""
+    for hunk in range(hunks):
+        patch += f"@@ -{hunk * 100 + 1},{context + deleted} +{hunk * 100 + 1},{context + added} @@\n"
+        patch += "".join(f" context {i}\n" for i in range(context))
+        patch += "".join(f"-deleted {i}\n" for i in range(deleted))
+        patch += "".join(f"+added {i}\n" for i in range(added))
+    return FilePatchInfo(
+        base_file="",
+        head_file="",
+        patch=patch,
+        filename=filename,
+        edit_type=edit_type,
+        num_plus_lines=added * hunks,
+        num_minus_lines=deleted * hunks,
+    )
+
+
+def _tokens(file):
+    return counter.count_text(f"## File: {file.filename}\n{file.patch}")
+
+
+def test_small_diff_is_one_chunk():
+    files = [make_file("a.py", added=2), make_file("b.py", added=2)]
+    assert split_diff_files(files, counter, 1000, 4) == [files]
+
+
+def test_chunks_are_balanced():
+    files = [make_file(f"f{i}.py", added=added) for i, added in enumerate([40, 10, 10, 10, 10, 40])]
+    max_tokens = max(_tokens(f) for f in files) * 2
+    chunks = split_diff_files(files, counter, max_tokens, 4)
+    assert len(chunks) == 2
+    loads = [sum(_tokens(f) for f in chunk) for chunk in chunks]
+    assert max(loads) <= max_tokens
+    # Files keep their original order within a chunk
+    for chunk in chunks:
+        assert [files.index(f) for f in chunk] == sorted(files.index(f) for f in chunk)
+
+
+def test_number_of_chunks_is_capped():
+    files = [make_file(f"f{i}.py", added=20) for i in range(6)]
+    chunks = split_diff_files(files, counter, _tokens(files[0]), 3)
+    assert len(chunks) == 3
+    assert sorted(f.filename for chunk in chunks for f in chunk) == sorted(f.filename for f in files)
+
+
+def test_large_file_is_split_by_hunks():
+    file = make_file("big.py", added=10, hunks=4)
+    max_tokens = _tokens(file) // 2
+    chunks = split_diff_files([file], counter, max_tokens, 4)
+    pieces = [piece for chunk in chunks for piece in chunk]
+    assert len(pieces) > 1
+    assert all(piece.filename == "big.py" for piece in pieces)
+    assert all(_tokens(piece) <= max_tokens for piece in pieces)
+    pieces.sort(key=lambda piece: file.patch.index(piece.patch))
+    assert "".join(piece.patch for piece in pieces) == file.patch
+
+
+def test_summary_only_files_never_make_a_chunk_of_their_own():
+    files = [
+        make_file("a.py", added=5),
+        make_file("package-lock.json", added=500),
+        make_file("old.py", deleted=500, edit_type=EDIT_TYPE.DELETED),
+    ]
+    max_tokens = _tokens(files[0]) + sum(
+        counter.count_text(summarize_file(f)) for f in files[1:]
+    )
+    assert split_diff_files(files, counter, max_tokens, 4) == [files]
+
+
+def test_parse_review():
+    text = "Here it is:\n```yaml\nreview:\n  score: 80\n```\n"
+    assert parse_review(text) == {"review": {"score": 80}}
+    assert parse_review("review:\n  score: 80\n") == {"review": {"score": 80}}
+    assert parse_review("no review here") is None
+    assert parse_review("review: [unclosed") is None
+
+
+def test_merge_reviews():
+    issue = {"relevant_file": "a.py", "issue_header": "Bug", "start_line": 1, "end_line": 5}
+    reviews = [
+        ({"review": {EFFORT_KEY: "2", "score": 90, "key_issues_to_review": [issue]}}, 100),
+        (
+            {
+                "review": {
+                    EFFORT_KEY: 4,
+                    "score": "60",
+                    "key_issues_to_review": [
+                        {**issue, "issue_header": "bug", "start_line": 3, "end_line": 8},
+                        {**issue, "start_line": 10, "end_line": 12},
+                    ],
+                }
+            },
+            300,
+        ),
+    ]
+    merged = merge_reviews(reviews)["review"]
+    assert merged[EFFORT_KEY] == 4
+    assert merged["score"] == 68
+    # The overlapping duplicate is dropped, the issue further down is kept
+    assert [i["start_line"] for i in merged["key_issues_to_review"]] == [1, 10]
+
+
+def test_dump_review_round_trips():
+    data = {"review": {EFFORT_KEY: 3, "score": 75, "key_issues_to_review": []}}
+    assert parse_review(dump_review(data)) == data
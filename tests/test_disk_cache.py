@@ -0,0 +1,108 @@
+import os
+import threading
+
+import pytest
+
+from pr_agent.utils.cache import DiskCache
+
+
+def _entry_files(cache):
+    return sorted(path.name for path in cache.directory.glob("*/*"))
+
+
+def test_get_and_set(tmp_path):
+    cache = DiskCache(tmp_path, 1024)
+    assert cache.get("key") is None
+    cache.set("key", b"value")
+    assert cache.get("key") == b"value"
+    cache.set("key", b"new value")
+    assert cache.get("key") == b"new value"
+    assert (len(cache), cache.size) == (1, len(b"new value"))
+    # Entries are shared with later runs
+    assert DiskCache(tmp_path, 1024).get("key") == b"new value"
+
+
+def test_values_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = DiskCache(tmp_path, 4)
+    cache.set("key", b"too large")
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_failed_writes_leave_no_partial_entry(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path, 1024)
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    cache.set("key", b"value")
+    assert cache.get("key") is None
+    assert len(cache) == 0
+    # Neither the entry nor its temporary file is left behind
+    assert list(tmp_path.glob("*/*")) == []
+
+
+def test_concurrent_readers_never_see_partial_entries(tmp_path):
+    cache = DiskCache(tmp_path, 10 * 1024 * 1024)
+    values = [bytes([i]) * 1024 * 1024 for i in range(4)]
+    seen = set()
+
+    def write():
+        for value in values * 5:
+            cache.set("key", value)
+
+    def read():
+        for _ in range(200):
+            value = cache.get("key")
+            if value is not None:
+                seen.add(value)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen <= set(values)
+    assert not [path for path in tmp_path.glob("*/*") if path.name.startswith(".")]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache(tmp_path, 10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.set("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.size == 8
+    assert len(_entry_files(cache)) == 2
+
+
+def test_entries_are_evicted_by_mtime_on_load(tmp_path):
+    cache = DiskCache(tmp_path, 100)
+    for key in ("old", "recent", "newest"):
+        cache.set(key, b"12345")
+    # Access times of an earlier run are kept as modification times
+    for age, key in enumerate(("newest", "recent", "old")):
+        os.utime(cache._path(key), (1_000_000 - age, 1_000_000 - age))
+    cache = DiskCache(tmp_path, 10)
+    assert cache.get("old") is None
+    assert cache.get("recent") == cache.get("newest") == b"12345"
+
+
+def test_get_refreshes_mtime(tmp_path):
+    cache = DiskCache(tmp_path, 100)
+    cache.set("key", b"value")
+    os.utime(cache._path("key"), (0, 0))
+    cache.get("key")
+    assert os.path.getmtime(cache._path("key")) > 0
+
+
+@pytest.mark.parametrize("key", ["file:owner/repo:sha:src/app.py", "../../etc/passwd", ""])
+def test_keys_are_hashed_into_the_cache_directory(tmp_path, key):
+    cache = DiskCache(tmp_path, 100)
+    cache.set(key, b"value")
+    assert cache._path(key).parent.parent == tmp_path
+    assert cache.get(key) == b"value"
@@ -0,0 +1,383 @@
+import base64
+import copy
+import re
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from github import UnknownObjectException
+from github.Requester import Requester
+
+from pr_agent.git_providers.github import GithubProvider
+
+API = "https://api.github.com"
+REPO_PATH = "/repos/owner/repo"
+PR_URL = "https://github.com/owner/repo/pull/7"
+
+# Contents of the recorded PR: one file modified, added, removed and renamed
+BLOBS = {
+    "app-base": "def main():\n    pass\n",
+    "app-head": "def main():\n    run()\n",
+    "notes-head": "# Notes\n",
+    "old-base": "legacy = True\n",
+    "original-base": "x = 1\ny = 2\n",
+    "renamed-head": "x = 1\ny = 3\n",
+    "readme": "# Repo\n",
+}
+TREES = {
+    "head0": {
+        "app.py": "app-head",
+        "docs/notes.md": "notes-head",
+        "pkg/renamed.py": "renamed-head",
+        "README.md": "readme",
+    },
+    "mergebase0": {
+        "app.py": "app-base",
+        "old.py": "old-base",
+        "pkg/original.py": "original-base",
+        "README.md": "readme",
+    },
+}
+FILES = [
+    {
+        "filename": "app.py",
+        "status": "modified",
+        "additions": 1,
+        "deletions": 1,
+        "patch": "@@ -1,2 +1,2 @@\n def main():\n-    pass\n+    run()",
+        "sha": "app-head",
+    },
+    {
+        "filename": "docs/notes.md",
+        "status": "added",
+        "additions": 1,
+        "deletions": 0,
+        "patch": "@@ -0,0 +1 @@\n+# Notes",
+        "sha": "notes-head",
+    },
+    {
+        "filename": "old.py",
+        "status": "removed",
+        "additions": 0,
+        "deletions": 1,
+        "patch": "@@ -1 +0,0 @@\n-legacy = True",
+        "sha": "old-base",
+    },
+    {
+        "filename": "pkg/renamed.py",
+        "previous_filename": "pkg/original.py",
+        "status": "renamed",
+        "additions": 1,
+        "deletions": 1,
+        "patch": "@@ -1,2 +1,2 @@\n x = 1\n-y = 2\n+y = 3",
+        "sha": "renamed-head",
+    },
+]
+
+
+def _pull(number, updated_at, closed_at, login):
+    return {
+        "number": number,
+        "url": f"{API}{REPO_PATH}/pulls/{number}",
+        "html_url": f"https://github.com/owner/repo/pull/{number}",
+        "base": {"sha": "base0"},
+        "head": {"sha": "head0"},
+        "updated_at": updated_at,
+        "closed_at": closed_at,
+        "user": {"login": login},
+    }
+
+
+def recorded_routes():
+    """REST responses of the recorded repository, keyed by path."""
+    routes = {
+        REPO_PATH: {
+            "full_name": "owner/repo",
+            "url": f"{API}{REPO_PATH}",
+            "clone_url": "https://github.com/owner/repo.git",
+        },
+        f"{REPO_PATH}/pulls/7": _pull(7, "2024-05-02T00:00:00Z", "2024-05-02T00:00:00Z", "alice"),
+        f"{REPO_PATH}/pulls/7/files": FILES,
+        f"{REPO_PATH}/compare/base0...head0": {"merge_base_commit": {"sha": "mergebase0"}},
+    }
+    for commit_sha, tree in TREES.items():
+        routes[f"{REPO_PATH}/git/trees/{commit_sha}"] = {
+            "sha": commit_sha,
+            "truncated": False,
+            "tree": [
+                {"path": path, "type": "blob", "sha": blob_sha}
+                for path, blob_sha in tree.items()
+            ],
+        }
+    for blob_sha, content in BLOBS.items():
+        routes[f"{REPO_PATH}/git/blobs/{blob_sha}"] = {
+            "sha": blob_sha,
+            "encoding": "base64",
+            "content": base64.b64encode(content.encode()).decode(),
+        }
+    return routes
+
+
+class FakeGitHub:
+    """Answers the requests of PyGithub clients from recorded responses.
+
+    Routes map a path (with the query string of followed pagination links)
+    to a response body, a (headers, body) tuple, or a callable taking the
+    request parameters and input and returning either.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.delays = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def request(self, verb, url, parameters=None, headers=None, input=None, follow_302_redirect=False):
+        path = url[len(API):] if url.startswith(API) else url
+        with self._lock:
+            self.requests.append((verb, path))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delays.get(path, 0))
+            if path not in self.routes:
+                raise UnknownObjectException(404, {"message": "Not Found"}, {})
+            response = self.routes[path]
+            if callable(response):
+                response = response(parameters, input)
+            response_headers, data = response if isinstance(response, tuple) else ({}, response)
+            return response_headers, copy.deepcopy(data)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def count(self, prefix):
+        return sum(1 for _, path in self.requests if path.startswith(prefix))
+
+
+@pytest.fixture
+def github(monkeypatch):
+    fake = FakeGitHub(recorded_routes())
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    monkeypatch.setattr(
+        Requester,
+        "requestJsonAndCheck",
+        lambda requester, *args, **kwargs: fake.request(*args, **kwargs),
+    )
+    return fake
+
+
+def test_contents_are_fetched_concurrently_in_request_order(github):
+    provider = GithubProvider("https://github.com/owner/repo", max_workers=4)
+    # Earlier blobs answer last
+    for i, blob_sha in enumerate(BLOBS):
+        github.delays[f"{REPO_PATH}/git/blobs/{blob_sha}"] = 0.05 * (len(BLOBS) - i)
+    requests = [
+        (path, commit_sha) for commit_sha, tree in TREES.items() for path in tree
+    ]
+    contents = provider._get_files_contents_at_commits(requests)
+    assert contents == [BLOBS[TREES[commit_sha][path]] for path, commit_sha in requests]
+    assert github.max_in_flight > 1
+    assert provider._get_files_contents_at_commits([]) == []
+
+
+def test_get_diff_files(github):
+    provider = GithubProvider("https://github.com/owner/repo", max_workers=4)
+    diff_files = provider.get_diff_files(PR_URL)
+    assert [file.filename for file in diff_files] == [file["filename"] for file in FILES]
+    app, notes, old, renamed = diff_files
+    assert (app.base_file, app.head_file) == (BLOBS["app-base"], BLOBS["app-head"])
+    assert app.patch == FILES[0]["patch"]
+    assert (notes.base_file, notes.head_file) == ("", BLOBS["notes-head"])
+    assert (old.base_file, old.head_file) == (BLOBS["old-base"], "")
+    assert renamed.old_filename == "pkg/original.py"
+    assert (renamed.base_file, renamed.head_file) == (BLOBS["original-base"], BLOBS["renamed-head"])
+    assert (renamed.num_plus_lines, renamed.num_minus_lines) == (1, 1)
+
+
+def test_one_tree_listing_per_commit_and_one_download_per_blob(github):
+    provider = GithubProvider("https://github.com/owner/repo")
+    contents = provider._get_files_contents_at_commits(
+        [
+            ("README.md", "head0"),
+            ("README.md", "mergebase0"),
+            ("app.py", "head0"),
+            ("app.py", "mergebase0"),
+            ("missing.py", "head0"),
+        ]
+    )
+    assert contents == [
+        BLOBS["readme"],
+        BLOBS["readme"],
+        BLOBS["app-head"],
+        BLOBS["app-base"],
+        "",
+    ]
+    assert github.count(f"{REPO_PATH}/git/trees/") == 2
+    # README.md is the same blob at both commits
+    assert github.count(f"{REPO_PATH}/git/blobs/") == 3
+    assert github.count(f"{REPO_PATH}/contents/") == 0
+
+
+def test_truncated_trees_fall_back_to_per_file_requests(github):
+    github.routes[f"{REPO_PATH}/git/trees/head0"]["truncated"] = True
+    github.routes[f"{REPO_PATH}/contents/app.py"] = lambda parameters, input: {
+        "type": "file",
+        "path": "app.py",
+        "encoding": "base64",
+        "content": base64.b64encode(
+            BLOBS[TREES[parameters["ref"]]["app.py"]].encode()
+        ).decode(),
+    }
+    provider = GithubProvider("https://github.com/owner/repo")
+    contents = provider._get_files_contents_at_commits(
+        [("app.py", "head0"), ("app.py", "mergebase0")]
+    )
+    assert contents == [BLOBS["app-head"], BLOBS["app-base"]]
+    assert github.count(f"{REPO_PATH}/contents/") == 1
+    assert github.count(f"{REPO_PATH}/git/blobs/") == 1
+
+
+def test_contents_are_served_from_the_disk_cache_on_later_runs(github, tmp_path):
+    requests = [("app.py", "head0"), ("app.py", "mergebase0")]
+    first_run = GithubProvider("https://github.com/owner/repo", cache_dir=str(tmp_path))
+    contents = first_run._get_files_contents_at_commits(requests)
+    fetched = len(github.requests)
+    second_run = GithubProvider("https://github.com/owner/repo", cache_dir=str(tmp_path))
+    assert second_run._get_files_contents_at_commits(requests) == contents
+    # Only the repository itself is fetched again
+    assert github.requests[fetched:] == [("GET", REPO_PATH)]
+
+
+def _closed_pulls_routes():
+    """Closed PRs listed most recently updated first, over three pages."""
+    pages = [
+        [
+            _pull(11, "2024-07-02T00:00:00Z", "2024-07-01T00:00:00Z", "alice"),
+            _pull(10, "2024-06-10T00:00:00Z", "2024-06-10T00:00:00Z", "Alice"),
+            _pull(9, "2024-06-09T00:00:00Z", None, "alice"),
+        ],
+        [
+            _pull(8, "2024-06-08T00:00:00Z", "2024-05-20T00:00:00Z", "alice"),
+            _pull(6, "2024-06-05T00:00:00Z", "2024-06-05T00:00:00Z", "bob"),
+            _pull(5, "2024-05-01T00:00:00Z", "2024-05-01T00:00:00Z", "alice"),
+        ],
+        [_pull(4, "2024-04-01T00:00:00Z", "2024-04-01T00:00:00Z", "alice")],
+    ]
+    routes = {}
+    for i, page in enumerate(pages):
+        path = f"{REPO_PATH}/pulls" + (f"?page={i + 1}" if i else "")
+        headers = {}
+        if i + 1 < len(pages):
+            headers["link"] = f'<{API}{REPO_PATH}/pulls?page={i + 2}>; rel="next"'
+        routes[path] = (headers, page)
+    return routes
+
+
+def test_get_closed_prs_stops_at_since(github):
+    github.routes.update(_closed_pulls_routes())
+    provider = GithubProvider("https://github.com/owner/repo")
+    urls = list(
+        provider.get_closed_prs(
+            author="alice", since=datetime(2024, 6, 1), until=datetime(2024, 6, 30)
+        )
+    )
+    assert urls == ["https://github.com/owner/repo/pull/10"]
+    # The second page ends with a PR updated before `since`, the third is never listed
+    assert github.count(f"{REPO_PATH}/pulls") == 2
+
+
+def test_get_closed_prs_without_filters(github):
+    github.routes.update(_closed_pulls_routes())
+    provider = GithubProvider("https://github.com/owner/repo")
+    urls = list(provider.get_closed_prs())
+    assert [int(url.rsplit("/", 1)[1]) for url in urls] == [11, 10, 8, 6, 5, 4]
+    assert github.count(f"{REPO_PATH}/pulls") == 3
+
+
+def test_get_closed_prs_is_lazy(github):
+    github.routes.update(_closed_pulls_routes())
+    provider = GithubProvider("https://github.com/owner/repo")
+    assert next(provider.get_closed_prs()).endswith("/pull/11")
+    assert github.count(f"{REPO_PATH}/pulls") == 1
+
+
+def _graphql_pull(number, updated_at, closed_at, login):
+    pull = _pull(number, updated_at, closed_at, login)
+    return {
+        "number": number,
+        "url": pull["html_url"],
+        "closedAt": closed_at,
+        "updatedAt": updated_at,
+        "author": {"login": login},
+        "baseRefOid": pull["base"]["sha"],
+        "headRefOid": pull["head"]["sha"],
+    }
+
+
+def _graphql_pull_requests(parameters, input):
+    """Answers batched PR queries, the PR numbers are inlined in the query."""
+    numbers = re.findall(r"pullRequest\(number: (\d+)\)", input["query"])
+    return {
+        "data": {
+            "repository": {
+                f"pr{i}": _graphql_pull(
+                    int(number), "2024-05-02T00:00:00Z", "2024-05-02T00:00:00Z", "alice"
+                )
+                for i, number in enumerate(numbers)
+            }
+        }
+    }
+
+
+def test_graphql_and_rest_diff_files_match(github):
+    github.routes["/graphql"] = _graphql_pull_requests
+    rest_files = GithubProvider("https://github.com/owner/repo").get_diff_files(PR_URL)
+    graphql_provider = GithubProvider("https://github.com/owner/repo", fetch_mode="graphql")
+    github.requests.clear()
+    graphql_files = graphql_provider.get_diff_files(PR_URL)
+    assert graphql_files == rest_files
+    assert [file.patch for file in graphql_files] == [file["patch"] for file in FILES]
+    assert graphql_files[3].old_filename == "pkg/original.py"
+    # Metadata comes from GraphQL, the PR itself is never fetched over REST
+    assert github.count("/graphql") == 1
+    assert github.count(f"{REPO_PATH}/pulls/7/files") == 1
+    assert ("GET", f"{REPO_PATH}/pulls/7") not in github.requests
+
+
+def test_request_counts_of_one_run(github):
+    github.routes.update(_closed_pulls_routes())
+    github.routes[f"{REPO_PATH}/pulls/10/files"] = FILES
+    provider = GithubProvider("https://github.com/owner/repo")
+    with provider.count_requests() as counter:
+        pr_urls = list(provider.get_closed_prs(since=datetime(2024, 6, 6)))
+    assert pr_urls == [
+        "https://github.com/owner/repo/pull/11",
+        "https://github.com/owner/repo/pull/10",
+    ]
+    assert counter.by_url() == {f"{API}{REPO_PATH}/pulls": 1, f"{API}{REPO_PATH}/pulls?page=2": 1}
+
+    with provider.count_requests() as counter:
+        provider.get_diff_files(pr_urls[1])
+    # The listed PR is reused, and files absent at a commit need no download
+    assert counter.by_url() == {
+        f"{API}{REPO_PATH}/pulls/10/files": 1,
+        f"{API}{REPO_PATH}/compare/base0...head0": 1,
+        f"{API}{REPO_PATH}/git/trees/head0": 1,
+        f"{API}{REPO_PATH}/git/trees/mergebase0": 1,
+        **{
+            f"{API}{REPO_PATH}/git/blobs/{blob_sha}": 1
+            for blob_sha in ("app-head", "app-base", "notes-head", "old-base", "renamed-head", "original-base")
+        },
+    }
+    assert counter.total == 10
+
+    # Diffing the PR again reuses its file list and merge base, only contents
+    # are downloaded again without a disk cache
+    with provider.count_requests() as counter:
+        provider.get_diff_files(pr_urls[1])
+    assert all("/git/" in url for url in counter.by_url())
+    assert counter.total == 8
@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from github import Github, GithubException
+
+from pr_agent.git_providers.http_cache import ConditionalRequestCache
+
+
+class RepositoryServer(ThreadingHTTPServer):
+    """Serves one repository with an ETag, answering 304 when it is still current."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RepositoryHandler)
+        self.version = 1
+        self.received = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def etag(self):
+        return f'"v{self.version}"'
+
+
+class RepositoryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.received.append((self.path, dict(self.headers)))
+        if self.path == "/repos/owner/repo/status" and self.server.version > 1:
+            # Successful replies without a body parse to None, just like a 304
+            self.send_response(200)
+            self.send_header("ETag", self.server.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path not in ("/repos/owner/repo", "/repos/owner/repo/status"):
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+        body = json.dumps(
+            {
+                "full_name": "owner/repo",
+                "url": f"{self.server.url}/repos/owner/repo",
+                "description": f"version {self.server.version}",
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = RepositoryServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _cached_client(server, cache_dir):
+    """A client of a new run, sharing the responses persisted in `cache_dir`."""
+    client = Github(base_url=server.url, retry=None)
+    cache = ConditionalRequestCache(str(cache_dir), 1024 * 1024)
+    cache.install(client)
+    return client, cache
+
+
+def test_not_modified_responses_are_served_from_the_cache(server, tmp_path):
+    client, cache = _cached_client(server, tmp_path)
+    assert client.get_repo("owner/repo").description == "version 1"
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "If-None-Match" not in server.received[0][1]
+
+    client, cache = _cached_client(server, tmp_path)
+    repo = client.get_repo("owner/repo")
+    assert server.received[1][1]["If-None-Match"] == '"v1"'
+    assert repo.full_name == "owner/repo"
+    assert repo.description == "version 1"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_modified_responses_replace_the_cached_ones(server, tmp_path):
+    client, cache = _cached_client(server, tmp_path)
+    client.get_repo("owner/repo")
+    server.version = 2
+
+    client, cache = _cached_client(server, tmp_path)
+    assert client.get_repo("owner/repo").description == "version 2"
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    client, cache = _cached_client(server, tmp_path)
+    assert client.get_repo("owner/repo").description == "version 2"
+    assert server.received[-1][1]["If-None-Match"] == '"v2"'
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_empty_responses_are_not_mistaken_for_not_modified(server, tmp_path):
+    client, cache = _cached_client(server, tmp_path)
+    _, data = client.requester.requestJsonAndCheck("GET", "/repos/owner/repo/status")
+    assert data["description"] == "version 1"
+    server.version = 2
+    _, data = client.requester.requestJsonAndCheck("GET", "/repos/owner/repo/status")
+    assert server.received[-1][1]["If-None-Match"] == '"v1"'
+    assert data is None
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_other_verbs_are_not_cached(server, tmp_path):
+    client, cache = _cached_client(server, tmp_path)
+    with pytest.raises(GithubException):
+        client.requester.requestJsonAndCheck("POST", "/repos/owner/repo")
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,98 @@
+import difflib
+
+import pytest
+
+from pr_agent.exceptions import OutputParserException
+from pr_agent.utils.json_parsing import (
+    ValueMatcher,
+    check_json_values,
+    find_json_object,
+    get_value_matcher,
+    parse_and_check_json,
+    parse_json,
+)
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [
+        '{"answer": "yes"}',
+        '  {"answer": "yes"}\n',
+        'Sure! {"answer": "yes"} Hope this helps.',
+        'Here:\n```json\n{"answer": "yes"}\n```',
+        'Here:\n```\n{"answer": "yes"}\n```\nDone.',
+    ],
+)
+def test_parse_json(reply):
+    assert parse_json(reply) == {"answer": "yes"}
+
+
+def test_parse_json_takes_the_first_object():
+    assert parse_json('{"a": 1} and then {"b": 2}') == {"a": 1}
+
+
+def test_parse_json_braces_in_strings():
+    assert parse_json('Answer: {"code": "if (x) { y(); }"} end') == {"code": "if (x) { y(); }"}
+
+
+def test_parse_json_without_json():
+    assert parse_json("No JSON here") is None
+    assert parse_json('Truncated {"answer": "ye') is None
+
+
+def test_parse_json_repair():
+    pytest.importorskip("json_repair")
+    assert parse_json('Truncated {"answer": "yes", "score": 1', repair=True) == {
+        "answer": "yes",
+        "score": 1,
+    }
+
+
+def test_find_json_object():
+    text = 'x {"a": "}", "b": {"c": 1}} y'
+    start, end = find_json_object(text)
+    assert text[start:end] == '{"a": "}", "b": {"c": 1}}'
+    assert find_json_object(text, end) is None
+    assert find_json_object('{"a": {"b": 1}') is None
+    assert find_json_object('{"a": "unterminated}') is None
+
+
+def test_value_matcher_matches_like_difflib():
+    values = ["bug fix", "new feature", "documentation", "refactoring", "tests"]
+    matcher = ValueMatcher(values)
+    for value in ["bug fix", "Bug fix", "new feture", "docs", "refactor", "test", "zzz"]:
+        expected = difflib.get_close_matches(value, values, n=1)
+        assert matcher.match(value) == (expected[0] if expected else None)
+
+
+def test_value_matcher_falls_back_to_all_values():
+    # Close to the valid value in difflib terms, but sharing no trigram with it
+    value, valid = "xaybzc", "abc"
+    assert difflib.get_close_matches(value, [valid, "xylophone"], n=1) == [valid]
+    assert ValueMatcher([valid, "xylophone"]).match(value) == valid
+
+
+def test_get_value_matcher_is_cached():
+    assert get_value_matcher(["a", "b"]) is get_value_matcher(["a", "b"])
+    matcher = ValueMatcher(["a"])
+    assert get_value_matcher(matcher) is matcher
+
+
+def test_check_json_values():
+    valid = ["bug fix", "new feature"]
+    assert check_json_values({"type": ["bug fx"]}, valid, None) == {"type": "bug fix"}
+    assert check_json_values({"type": "nothing"}, valid, "new feature") == {"type": "new feature"}
+    with pytest.raises(ValueError):
+        check_json_values({"type": "nothing"}, valid, None)
+    assert check_json_values({"type": 1}, None, None) == {"type": 1}
+
+
+def test_parse_and_check_json():
+    reply = 'Result: {"type": "bug fx"}'
+    assert parse_and_check_json(reply, ["type"], ["bug fix", "new feature"]) == {"type": "bug fix"}
+    with pytest.raises(OutputParserException):
+        parse_and_check_json(reply, ["missing"])
+    with pytest.raises(OutputParserException):
+        parse_and_check_json(reply, ["type"], ["new feature"])
+    with pytest.raises(OutputParserException):
+        parse_and_check_json("no json", ["type"])
@@ -0,0 +1,380 @@
+import asyncio
+import json
+from typing import List
+
+import litellm
+import pytest
+from pydantic import BaseModel, field_validator
+
+from pr_agent.llm.litellm import (
+    LiteLLMModel,
+    add_prompt_cache_markers,
+    clip_text_with_result,
+)
+from pr_agent.llm.tokens import get_token_counter
+
+MODEL = "openai/gpt-4o"
+DIFF = (
+    "## File: a.py\n"
+    "def add(a, b):\n"
+    "    return a + b\n"
+    "## File: b.py\n"
+    "def sub(a, b):\n"
+    "    return a - b\n"
+    "## File: c.py\n"
+    "def mul(a, b):\n"
+    "    return a * b\n"
+)
+
+
+def _tokens(text):
+    return len(get_token_counter(MODEL).encode(text))
+
+
+def _clip(text, max_tokens, snap_to=None):
+    return clip_text_with_result(text, MODEL, max_tokens, trim_ratio=1.0, snap_to=snap_to)
+
+
+def test_text_within_the_budget_is_kept():
+    result = _clip(DIFF, _tokens(DIFF))
+    assert result.text == DIFF
+    assert result.total_tokens == result.kept_tokens == _tokens(DIFF)
+    assert not result.clipped
+    assert (result.dropped_files, result.truncated_file) == ([], None)
+
+
+def test_clips_at_the_exact_token_boundary():
+    counter = get_token_counter(MODEL)
+    budget = _tokens(DIFF) - 5
+    result = _clip(DIFF, budget)
+    assert result.text == counter.decode(counter.encode(DIFF)[:budget])
+    assert result.kept_tokens == budget == _tokens(result.text)
+    assert result.dropped_tokens == 5
+    assert result.dropped_files == []
+    assert result.truncated_file == "c.py"
+
+
+def test_budget_is_scaled_by_the_trim_ratio():
+    result = clip_text_with_result(DIFF, MODEL, 20, trim_ratio=0.5)
+    assert result.kept_tokens == 10
+
+
+def test_snaps_to_the_last_complete_line():
+    # Ends in the middle of the second line of b.py
+    budget = _tokens(DIFF.split("    return a - b")[0]) + 2
+    result = _clip(DIFF, budget, snap_to="line")
+    assert result.text == DIFF.split("    return a - b")[0]
+    assert result.kept_tokens == _tokens(result.text) <= budget
+    assert result.dropped_files == ["c.py"]
+    assert result.truncated_file == "b.py"
+
+
+def test_snaps_to_the_last_file_that_fits():
+    budget = _tokens(DIFF.split("    return a - b")[0]) + 2
+    result = _clip(DIFF, budget, snap_to="file")
+    assert result.text == DIFF.split("## File: b.py")[0]
+    assert result.kept_tokens == _tokens(result.text)
+    assert result.dropped_files == ["b.py", "c.py"]
+    assert result.truncated_file is None
+
+
+def test_snapping_to_files_falls_back_to_lines_within_the_first_file():
+    budget = _tokens("## File: a.py\ndef add(a, b):\n") + 2
+    result = _clip(DIFF, budget, snap_to="file")
+    assert result.text == "## File: a.py\ndef add(a, b):\n"
+    assert result.dropped_files == ["b.py", "c.py"]
+    assert result.truncated_file == "a.py"
+
+
+def test_multi_byte_characters_are_not_split():
+    text = "\U0001f99c" * 4
+    # Each parrot takes three tokens, the budget ends inside the second one
+    result = _clip(text, 4)
+    assert result.text == "\U0001f99c"
+    assert result.kept_tokens == 3
+
+
+def test_unknown_models_without_a_budget_are_not_clipped():
+    result = clip_text_with_result(DIFF, "unknown/model")
+    assert result.text == DIFF
+    with pytest.raises(ValueError):
+        clip_text_with_result(DIFF, MODEL, 10, snap_to="word")
+
+
+def _marked(messages):
+    return [
+        i
+        for i, message in enumerate(messages)
+        if isinstance(message["content"], list)
+        and any("cache_control" in block for block in message["content"])
+    ]
+
+
+def test_cache_marker_goes_on_the_last_leading_system_message():
+    messages = [
+        {"role": "system", "content": "You are a code reviewer."},
+        {"role": "system", "content": "Answer in YAML."},
+        {"role": "user", "content": "Review this diff"},
+        {"role": "system", "content": "Be brief."},
+    ]
+    marked = add_prompt_cache_markers(messages)
+    assert _marked(marked) == [1]
+    assert marked[1]["content"] == [
+        {"type": "text", "text": "Answer in YAML.", "cache_control": {"type": "ephemeral"}}
+    ]
+    assert marked[0] == messages[0] and marked[2:] == messages[2:]
+    # The messages of the caller are left as they are
+    assert messages[1]["content"] == "Answer in YAML."
+
+
+def test_no_cache_marker_without_a_leading_system_message():
+    messages = [
+        {"role": "user", "content": "Review this diff"},
+        {"role": "system", "content": "Be brief."},
+    ]
+    assert add_prompt_cache_markers(messages) == messages
+    blocks = [{"role": "system", "content": [{"type": "text", "text": "You are a code reviewer."}]}]
+    assert add_prompt_cache_markers(blocks) == blocks
+
+
+def test_messages_at_the_marker_limit_stay_unmarked():
+    marked_block = {"type": "text", "text": "context", "cache_control": {"type": "ephemeral"}}
+    messages = [{"role": "system", "content": "You are a code reviewer."}] + [
+        {"role": "user", "content": [marked_block]} for _ in range(3)
+    ]
+    assert _marked(add_prompt_cache_markers(messages)) == [0, 1, 2, 3]
+    messages.append({"role": "user", "content": [marked_block]})
+    assert add_prompt_cache_markers(messages) == messages
+
+
+@pytest.mark.parametrize(
+    "model, marked",
+    [("anthropic/claude-sonnet-4-20250514", [0]), ("openai/gpt-4o-mini", [])],
+)
+def test_cache_markers_are_only_sent_to_providers_needing_them(model, marked):
+    llm = LiteLLMModel(model=model, api_key="key")
+    _, completion_kwargs, _ = llm._setup_query(
+        [
+            {"role": "system", "content": "You are a code reviewer."},
+            {"role": "user", "content": "Review this diff"},
+        ]
+    )
+    assert _marked(completion_kwargs["messages"]) == marked
+
+
+def _response(content, prompt_tokens=10, completion_tokens=5):
+    return litellm.ModelResponse(
+        model="gpt-4o-mini",
+        choices=[{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    )
+
+
+class FakeStream:
+    def __init__(self, chunks=()):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture
+def hedged_llm():
+    return LiteLLMModel(
+        model="gpt-4o-mini",
+        api_key="key",
+        hedge={"hedge_percentile": 90, "hedge_initial_delay": 0.01},
+    )
+
+
+def _finishing_together(make_result):
+    """Fake `litellm.acompletion` whose first two calls return together, once the hedge is sent."""
+    release = asyncio.Event()
+    results = []
+
+    async def acompletion(**kwargs):
+        call = len(results) + 1
+        result = make_result(call)
+        results.append(result)
+        if call == 2:
+            asyncio.get_running_loop().call_later(0.01, release.set)
+        await release.wait()
+        return result
+
+    acompletion.results = results
+    return acompletion
+
+
+def test_hedges_finishing_together_are_both_recorded(hedged_llm, monkeypatch):
+    acompletion = _finishing_together(lambda call: _response(f"answer {call}", completion_tokens=call))
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    assert asyncio.run(hedged_llm.aquery("Review this")) == "answer 1"
+    assert len(acompletion.results) == 2
+    # Both requests are paid for
+    assert hedged_llm.stats.api_calls == 2
+    assert hedged_llm.stats.output_tokens == 1 + 2
+
+
+def test_streams_losing_the_hedge_are_closed(hedged_llm, monkeypatch):
+    acompletion = _finishing_together(lambda call: FakeStream())
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    async def consume():
+        return [delta async for delta in hedged_llm.aquery_stream("Review this")]
+
+    asyncio.run(consume())
+    winner, loser = acompletion.results
+    assert loser.closed
+    assert not winner.closed
+
+
+class Issue(BaseModel):
+    file: str
+    line: int
+
+    @field_validator("line")
+    @classmethod
+    def check_line(cls, value):
+        if value < 1:
+            raise ValueError("lines start at 1")
+        return value
+
+
+class Issues(BaseModel):
+    issues: List[Issue]
+
+
+def _tool_response(name, arguments):
+    return litellm.ModelResponse(
+        model="gpt-4o-mini",
+        choices=[
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": "call_0",
+                            "type": "function",
+                            "function": {"name": name, "arguments": json.dumps(arguments)},
+                        }
+                    ],
+                },
+            }
+        ],
+        usage={"prompt_tokens": 20, "completion_tokens": 10, "total_tokens": 30},
+    )
+
+
+def _tool_stream(name, arguments, piece_size=8):
+    """Chunks of a streamed tool call, its arguments cut in small pieces."""
+    arguments = json.dumps(arguments)
+    chunks = []
+    for i in range(0, len(arguments), piece_size):
+        chunks.append(
+            litellm.ModelResponseStream(
+                model="gpt-4o-mini",
+                choices=[
+                    {
+                        "index": 0,
+                        "delta": {
+                            "role": "assistant",
+                            "tool_calls": [
+                                {
+                                    "index": 0,
+                                    "id": "call_0",
+                                    "type": "function",
+                                    "function": {
+                                        "name": name,
+                                        "arguments": arguments[i : i + piece_size],
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                ],
+            )
+        )
+    return FakeStream(chunks)
+
+
+@pytest.fixture
+def llm():
+    return LiteLLMModel(model="gpt-4o-mini", api_key="key")
+
+
+def _recording(*responses):
+    calls = []
+    responses = iter(responses)
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return next(responses)
+
+    acompletion.calls = calls
+    return acompletion
+
+
+def test_acreate_retries_invalid_answers(llm, monkeypatch):
+    acompletion = _recording(
+        _tool_response("Issue", {"file": "a.py", "line": 0}),
+        _tool_response("Issue", {"file": "a.py", "line": 3}),
+    )
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    issue = asyncio.run(llm.acreate(Issue, "Find one issue", max_retries=2))
+    assert issue.model_dump() == {"file": "a.py", "line": 3}
+    assert len(acompletion.calls) == 2
+    # The retry tells the model what was wrong
+    assert "lines start at 1" in json.dumps(acompletion.calls[1]["messages"])
+    assert acompletion.calls[0]["tools"][0]["function"]["name"] == "Issue"
+    # Invalid answers are paid for all the same
+    assert llm.stats.api_calls == 2
+    assert llm.stats.input_tokens == 40
+
+
+def test_acreate_partial_yields_ever_more_complete_objects(llm, monkeypatch):
+    answer = {"issues": [{"file": "a.py", "line": 3}, {"file": "b.py", "line": 7}]}
+    acompletion = _recording(_tool_stream("Issues", answer))
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    async def collect():
+        return [partial async for partial in llm.acreate_partial(Issues, "Find issues")]
+
+    partials = asyncio.run(collect())
+    assert len(partials) > 2
+    assert partials[-1].model_dump() == answer
+    assert [len(partial.issues or []) for partial in partials] == sorted(
+        len(partial.issues or []) for partial in partials
+    )
+    assert acompletion.calls[0]["stream"]
+    # Usage of the consumed stream is estimated
+    assert llm.stats.api_calls == 1
+    assert llm.stats.output_tokens > 0
+
+
+def test_acreate_iterable_yields_every_complete_object(llm, monkeypatch):
+    answer = {"tasks": [{"file": "a.py", "line": 3}, {"file": "b.py", "line": 7}]}
+    acompletion = _recording(_tool_stream("IterableIssue", answer))
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    async def collect():
+        return [issue async for issue in llm.acreate_iterable(Issue, "Find issues")]
+
+    issues = asyncio.run(collect())
+    assert [issue.model_dump() for issue in issues] == answer["tasks"]
+    assert llm.stats.api_calls == 1
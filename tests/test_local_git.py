@@ -0,0 +1,121 @@
+import os
+import subprocess
+
+import pytest
+
+from pr_agent.git_providers.local_git import LocalGitDiffBackend
+from pr_agent.types import EDIT_TYPE
+
+GIT_ENV = {
+    **os.environ,
+    "GIT_AUTHOR_NAME": "Test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "Test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+}
+
+
+def _git(repo, *args):
+    return subprocess.run(
+        ["git", *args], cwd=repo, check=True, capture_output=True, env=GIT_ENV, text=True
+    ).stdout.strip()
+
+
+def _commit(repo, files, message):
+    for name, content in files.items():
+        path = repo / name
+        if content is None:
+            path.unlink()
+        else:
+            path.write_text(content)
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", message)
+    return _git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def fixture_repo(tmp_path):
+    """Repository with a PR branch adding, modifying, renaming and deleting files."""
+    repo = tmp_path / "origin"
+    repo.mkdir()
+    _git(repo, "init", "-q", "-b", "main")
+    # Needed for partial clones over file:// URLs
+    _git(repo, "config", "uploadpack.allowFilter", "true")
+    renamed = "".join(f"line {i}\n" for i in range(20))
+    base_sha = _commit(
+        repo,
+        {"app.py": "print('hello')\n", "old_name.py": renamed, "removed.py": "x = 1\n"},
+        "base",
+    )
+    _git(repo, "checkout", "-q", "-b", "feature")
+    head_sha = _commit(
+        repo,
+        {
+            "app.py": "print('hello')\nprint('world')\n",
+            "old_name.py": None,
+            "new_name.py": renamed + "line 20\n",
+            "removed.py": None,
+            "added.py": "y = 2\n",
+        },
+        "feature",
+    )
+    # Advance the base branch, so the PR is diffed against the merge base
+    _git(repo, "checkout", "-q", "main")
+    main_sha = _commit(repo, {"unrelated.py": "z = 3\n"}, "main")
+    return repo, main_sha, base_sha, head_sha
+
+
+def test_get_diff_files(tmp_path, fixture_repo):
+    repo, main_sha, base_sha, head_sha = fixture_repo
+    backend = LocalGitDiffBackend(tmp_path / "mirrors")
+    # The stored remote differs from the clone URL, as it does when the clone
+    # URL embeds a token: lazy blob fetches must still reach the repository
+    plain_url = (tmp_path / "unreachable").as_uri()
+    diff_files = backend.get_diff_files(
+        repo.as_uri(), "owner/repo", main_sha, head_sha, plain_url=plain_url
+    )
+    files = {file.filename: file for file in diff_files}
+    assert sorted(files) == ["added.py", "app.py", "new_name.py", "removed.py"]
+
+    app = files["app.py"]
+    assert app.edit_type == EDIT_TYPE.MODIFIED
+    assert app.base_file == "print('hello')\n"
+    assert app.head_file == "print('hello')\nprint('world')\n"
+    assert app.patch == "@@ -1 +1,2 @@\n print('hello')\n+print('world')"
+    assert (app.num_plus_lines, app.num_minus_lines) == (1, 0)
+
+    renamed = files["new_name.py"]
+    assert renamed.edit_type == EDIT_TYPE.RENAMED
+    assert renamed.old_filename == "old_name.py"
+    assert renamed.base_file == "".join(f"line {i}\n" for i in range(20))
+    assert renamed.patch.endswith("+line 20")
+
+    assert files["added.py"].edit_type == EDIT_TYPE.ADDED
+    assert (files["added.py"].base_file, files["added.py"].head_file) == ("", "y = 2\n")
+    assert files["removed.py"].edit_type == EDIT_TYPE.DELETED
+    assert (files["removed.py"].base_file, files["removed.py"].head_file) == ("x = 1\n", "")
+    assert files["removed.py"].num_minus_lines == 1
+
+    mirror_path = backend.get_mirror_path("owner/repo")
+    assert _git(mirror_path, "remote", "get-url", "origin") == plain_url
+    assert _git(mirror_path, "config", "remote.origin.promisor") == "true"
+
+
+def test_fetches_new_commits_into_existing_mirror(tmp_path, fixture_repo):
+    repo, main_sha, base_sha, head_sha = fixture_repo
+    backend = LocalGitDiffBackend(tmp_path / "mirrors")
+    plain_url = (tmp_path / "unreachable").as_uri()
+    backend.get_diff_files(repo.as_uri(), "owner/repo", base_sha, head_sha, plain_url=plain_url)
+
+    _git(repo, "checkout", "-q", "feature")
+    new_head_sha = _commit(repo, {"app.py": "print('bye')\n"}, "update")
+    diff_files = backend.get_diff_files(
+        repo.as_uri(),
+        "owner/repo",
+        base_sha,
+        new_head_sha,
+        include=[r"^app\.py$"],
+        plain_url=plain_url,
+    )
+    assert [file.filename for file in diff_files] == ["app.py"]
+    assert diff_files[0].head_file == "print('bye')\n"
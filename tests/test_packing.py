@@ -0,0 +1,103 @@
+from pr_agent.task_inference.packing import (
+    FILE_SEPARATOR,
+    is_low_value_file,
+    pack_diff_files,
+    summarize_file,
+)
+from pr_agent.types import EDIT_TYPE, FilePatchInfo
+
+
+class WordCounter:
+    """Token counter counting whitespace-separated words, for predictable budgets."""
+
+    def count_text(self, text):
+        if isinstance(text, list):
+            return sum(self.count_text(t) for t in text)
+        return len(text.split())
+
+
+counter = WordCounter()
+
+
+def make_file(filename, added=0, context=0, deleted=0, edit_type=EDIT_TYPE.MODIFIED, hunks=1):
+    patch = ""
+    for hunk in range(hunks):
+        patch += f"@@ -{hunk * 100 + 1},{context + deleted} +{hunk * 100 + 1},{context + added} @@\n"
+        patch += "".join(f" context {i}\n" for i in range(context))
+        patch += "".join(f"-deleted {i}\n" for i in range(deleted))
+        patch += "".join(f"+added {i}\n" for i in range(added))
+    return FilePatchInfo(
+        base_file="",
+        head_file="",
+        patch=patch,
+        filename=filename,
+        edit_type=edit_type,
+        num_plus_lines=added * hunks,
+        num_minus_lines=deleted * hunks,
+    )
+
+
+def test_everything_fits_in_full():
+    files = [make_file("a.py", added=5), make_file("b.py", added=3)]
+    packed = pack_diff_files(files, counter, 1000)
+    assert packed.full_files == ["a.py", "b.py"]
+    assert not packed.compressed_files and not packed.summarized_files and not packed.dropped_files
+    assert packed.text == FILE_SEPARATOR.join(f"## File: {f.filename}\n{f.patch}" for f in files)
+    assert packed.tokens <= 1000
+
+
+def test_sets_full_patch_tokens():
+    file = make_file("a.py", added=5)
+    pack_diff_files([file], counter, 1000)
+    assert file.tokens == counter.count_text(f"## File: a.py\n{file.patch}")
+
+
+def test_low_value_and_deleted_files_are_only_summarized():
+    files = [
+        make_file("package-lock.json", added=50),
+        make_file("old.py", deleted=20, edit_type=EDIT_TYPE.DELETED),
+        make_file("a.py", added=2),
+    ]
+    packed = pack_diff_files(files, counter, 10_000)
+    assert packed.full_files == ["a.py"]
+    assert sorted(packed.summarized_files) == ["old.py", "package-lock.json"]
+    assert summarize_file(files[0]) in packed.text
+    assert "+added 0\n" not in packed.text.split("## File: a.py")[0]
+
+
+def test_compresses_context_before_summarizing():
+    file = make_file("a.py", added=3, context=30)
+    full_tokens = counter.count_text(f"## File: a.py\n{file.patch}")
+    packed = pack_diff_files([file], counter, full_tokens - 1)
+    assert packed.compressed_files == ["a.py"]
+    assert " context 0" not in packed.text
+    assert "+added 2" in packed.text
+
+
+def test_budget_goes_to_files_adding_most_code():
+    small, large = make_file("small.py", added=10), make_file("large.py", added=20)
+    large_tokens = counter.count_text(f"## File: large.py\n{large.patch}")
+    summary_tokens = counter.count_text(summarize_file(small))
+    packed = pack_diff_files([small, large], counter, large_tokens + summary_tokens)
+    assert packed.full_files == ["large.py"]
+    assert packed.summarized_files == ["small.py"]
+    # Files keep their original order
+    assert packed.text.index("small.py") < packed.text.index("large.py")
+
+
+def test_drops_files_when_even_summaries_do_not_fit():
+    files = [make_file(f"f{i}.py", added=1) for i in range(5)]
+    budget = counter.count_text(summarize_file(files[0])) * 2
+    packed = pack_diff_files(files, counter, budget)
+    assert packed.dropped_files
+    assert packed.tokens <= budget
+    assert len(packed.dropped_files) + len(packed.summarized_files) + len(packed.full_files) + len(
+        packed.compressed_files
+    ) == len(files)
+
+
+def test_is_low_value_file():
+    assert is_low_value_file(make_file("web/dist/app.js"))
+    assert is_low_value_file(make_file("uv.lock"))
+    assert is_low_value_file(make_file("a.py", edit_type=EDIT_TYPE.DELETED))
+    assert not is_low_value_file(make_file("src/app.py"))
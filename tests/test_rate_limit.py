@@ -0,0 +1,162 @@
+import pytest
+from github import GithubException, RateLimitExceededException
+
+from pr_agent.git_providers import rate_limit
+from pr_agent.git_providers.rate_limit import (
+    SECONDARY_RATE_LIMIT_BACKOFF_SEC,
+    RateLimitGovernor,
+)
+
+CORE_URL = "https://api.github.com/repos/owner/repo"
+
+
+class FakeClock:
+    """Stands in for the `time` module, sleeping advances the clock instantly."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def _rate_limit_headers(clock, remaining, limit=5000, reset_in=1000):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(int(clock.now + reset_in)),
+    }
+
+
+def _responding(*responses):
+    """Request function answering with `responses` in turn, raising exceptions among them."""
+    calls = []
+    responses = iter(responses)
+
+    def request(verb, url, *args, **kwargs):
+        calls.append((verb, url))
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    request.calls = calls
+    return request
+
+
+def _secondary_rate_limit(headers=None):
+    return GithubException(
+        403, {"message": "You have exceeded a secondary rate limit"}, headers=headers or {}
+    )
+
+
+def test_requests_are_not_paced_while_the_budget_is_high(clock):
+    governor = RateLimitGovernor(reserve=50, low_watermark=0.2)
+    request = _responding(*[(_rate_limit_headers(clock, 4000), {})] * 5)
+    for _ in range(5):
+        governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == []
+    assert governor.get_budget()["governor"]["requests"] == 5
+
+
+def test_remaining_budget_is_spread_until_the_reset(clock):
+    governor = RateLimitGovernor(reserve=50, low_watermark=0.2)
+    # 150 requests left for 1000 seconds, 100 of them above the reserve
+    request = _responding(*[(_rate_limit_headers(clock, 150), {})] * 3)
+    governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == []
+    governor.call(request, "GET", CORE_URL)
+    governor.call(request, "GET", CORE_URL)
+    # Each request is scheduled about reset / remaining-above-reserve apart
+    assert clock.sleeps == [pytest.approx(10, rel=0.05)]
+    assert governor.get_budget()["governor"]["throttled_seconds"] == pytest.approx(10, rel=0.05)
+
+
+def test_workers_pause_until_the_reset_at_the_reserve(clock):
+    governor = RateLimitGovernor(reserve=50)
+    reset_at = clock.now + 600
+    request = _responding(*[(_rate_limit_headers(clock, 50, reset_in=600), {})] * 3)
+    governor.call(request, "GET", CORE_URL)
+    governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == []
+    governor.call(request, "GET", CORE_URL)
+    assert clock.now == pytest.approx(reset_at)
+
+
+def test_resources_are_tracked_separately(clock):
+    governor = RateLimitGovernor(reserve=50)
+    request = _responding(
+        (_rate_limit_headers(clock, 10, limit=30, reset_in=60) | {"X-RateLimit-Resource": "search"}, {}),
+        (_rate_limit_headers(clock, 4000), {}),
+        (_rate_limit_headers(clock, 4000), {}),
+    )
+    governor.call(request, "GET", "https://api.github.com/search/issues")
+    # The exhausted search budget does not slow down core requests
+    governor.call(request, "GET", CORE_URL)
+    governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == []
+    budget = governor.get_budget()
+    assert budget["search"]["remaining"] == 10
+    assert budget["core"] == {"limit": 5000, "remaining": 4000, "reset_at": pytest.approx(clock.now + 1000)}
+
+
+def test_secondary_rate_limits_honor_retry_after(clock):
+    governor = RateLimitGovernor()
+    request = _responding(
+        _secondary_rate_limit({"Retry-After": "30"}),
+        ({}, {"ok": True}),
+    )
+    assert governor.call(request, "GET", CORE_URL) == ({}, {"ok": True})
+    assert len(request.calls) == 2
+    assert clock.sleeps == [30]
+    assert governor.get_budget()["governor"]["rate_limited_requests"] == 1
+
+
+def test_secondary_rate_limits_back_off_exponentially_without_retry_after(clock):
+    governor = RateLimitGovernor(max_retries=3)
+    request = _responding(
+        _secondary_rate_limit(),
+        _secondary_rate_limit(),
+        ({}, {"ok": True}),
+    )
+    governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == [SECONDARY_RATE_LIMIT_BACKOFF_SEC, 2 * SECONDARY_RATE_LIMIT_BACKOFF_SEC]
+
+
+def test_primary_rate_limits_wait_for_the_reset(clock):
+    governor = RateLimitGovernor()
+    exception = RateLimitExceededException(
+        403, {"message": "API rate limit exceeded"}, headers=_rate_limit_headers(clock, 0, reset_in=120)
+    )
+    request = _responding(exception, ({}, {}))
+    governor.call(request, "GET", CORE_URL)
+    assert clock.sleeps == [pytest.approx(121)]
+
+
+def test_rate_limits_are_retried_at_most_max_retries_times(clock):
+    governor = RateLimitGovernor(max_retries=2)
+    request = _responding(*[_secondary_rate_limit({"Retry-After": "1"})] * 3)
+    with pytest.raises(GithubException):
+        governor.call(request, "GET", CORE_URL)
+    assert len(request.calls) == 3
+
+
+def test_other_errors_are_not_retried(clock):
+    governor = RateLimitGovernor()
+    request = _responding(GithubException(404, {"message": "Not Found"}, headers={}))
+    with pytest.raises(GithubException):
+        governor.call(request, "GET", CORE_URL)
+    assert len(request.calls) == 1
+    assert clock.sleeps == []
@@ -0,0 +1,131 @@
+import asyncio
+import email.utils
+import time
+
+import pytest
+
+from pr_agent.llm.exception import CircuitOpenError
+from pr_agent.llm.retry import (
+    PERMANENT,
+    RATE_LIMITED,
+    TRANSIENT,
+    CircuitBreaker,
+    RetryPolicy,
+    classify_error,
+    get_retry_after,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.litellm_response_headers = headers or {}
+
+
+class Flaky:
+    """Callable failing with `errors` in turn, then returning "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, timeout):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def _policy(**kwargs):
+    return RetryPolicy(initial_backoff=0, max_backoff=0, max_rate_limit_wait=0, **kwargs)
+
+
+def test_classify_error():
+    assert classify_error(StatusError(429)) == RATE_LIMITED
+    assert classify_error(StatusError(502)) == TRANSIENT
+    assert classify_error(StatusError(503)) == TRANSIENT
+    assert classify_error(TimeoutError()) == TRANSIENT
+    assert classify_error(StatusError(400)) == PERMANENT
+    assert classify_error(ValueError()) == PERMANENT
+    assert classify_error(CircuitOpenError("open")) == PERMANENT
+
+
+def test_get_retry_after():
+    assert get_retry_after(StatusError(429)) is None
+    assert get_retry_after(StatusError(429, {"Retry-After": "7"})) == 7
+    assert get_retry_after(StatusError(429, {"retry-after-ms": "1500"})) == 1.5
+    date = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 50 < get_retry_after(StatusError(429, {"retry-after": date})) <= 60
+    assert get_retry_after(StatusError(429, {"retry-after": "soon"})) is None
+
+
+def test_retries_transient_errors_and_rate_limits():
+    func = Flaky(StatusError(503), StatusError(429))
+    assert _policy().call(func, CircuitBreaker("test")) == "ok"
+    assert func.calls == 3
+
+
+def test_permanent_errors_are_raised_at_once():
+    func = Flaky(StatusError(400))
+    with pytest.raises(StatusError):
+        _policy().call(func, CircuitBreaker("test"))
+    assert func.calls == 1
+
+
+def test_rate_limits_are_raised_at_once_without_retry_rate_limits():
+    func = Flaky(StatusError(429))
+    with pytest.raises(StatusError):
+        _policy().call(func, CircuitBreaker("test"), retry_rate_limits=False)
+    assert func.calls == 1
+
+
+def test_gives_up_after_max_attempts():
+    func = Flaky(*[StatusError(500)] * 5)
+    with pytest.raises(StatusError):
+        _policy(max_attempts=3).call(func, CircuitBreaker("test"))
+    assert func.calls == 3
+
+
+def test_deadline_is_passed_to_the_call():
+    timeouts = []
+    _policy(deadline=10).call(lambda timeout: timeouts.append(timeout), CircuitBreaker("test"))
+    assert 9 < timeouts[0] <= 10
+
+
+def test_async_call():
+    func = Flaky(StatusError(504))
+
+    async def afunc(timeout):
+        return func(timeout)
+
+    assert asyncio.run(_policy().acall(afunc, CircuitBreaker("test"))) == "ok"
+    assert func.calls == 2
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure(StatusError(500))
+    breaker.record_success()
+    breaker.record_failure(StatusError(500))
+    breaker.before_call()
+    breaker.record_failure(StatusError(400))
+    breaker.before_call()
+    breaker.record_failure(StatusError(429))
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    func = Flaky()
+    with pytest.raises(CircuitOpenError):
+        _policy().call(func, breaker)
+    assert func.calls == 0
+
+
+def test_circuit_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure(StatusError(500))
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    breaker.before_call()
@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+
+from pr_agent.llm.exception import CircuitOpenError, ContextWindowExceededError
+from pr_agent.llm.routing import RouteTarget, Router, is_fallback_error
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _targets():
+    return [
+        RouteTarget("primary", max_input_tokens=100),
+        RouteTarget("fallback", max_input_tokens=1000),
+    ]
+
+
+def test_is_fallback_error():
+    assert is_fallback_error(StatusError(429))
+    assert is_fallback_error(CircuitOpenError("open"))
+    assert is_fallback_error(ContextWindowExceededError("too long"))
+    assert not is_fallback_error(StatusError(500))
+    assert not is_fallback_error(ValueError())
+
+
+def test_calls_the_primary_target_first():
+    calls = []
+    router = Router(_targets())
+    assert router.call(lambda target, is_last: calls.append((target.model, is_last)) or "ok", 10) == "ok"
+    assert calls == [("primary", False)]
+    assert router.fallbacks == 0
+
+
+def test_falls_back_on_rate_limits():
+    calls = []
+
+    def func(target, is_last):
+        calls.append((target.model, is_last))
+        if target.model == "primary":
+            raise StatusError(429)
+        return "ok"
+
+    router = Router(_targets())
+    assert router.call(func, 10) == "ok"
+    assert calls == [("primary", False), ("fallback", True)]
+    assert router.fallbacks == 1
+
+
+def test_other_errors_are_raised():
+    def func(target, is_last):
+        raise StatusError(400)
+
+    router = Router(_targets())
+    with pytest.raises(StatusError):
+        router.call(func, 10)
+    assert router.fallbacks == 0
+
+
+def test_skips_targets_the_input_does_not_fit():
+    calls = []
+    router = Router(_targets())
+    router.call(lambda target, is_last: calls.append((target.model, is_last)), 500)
+    assert calls == [("fallback", True)]
+    with pytest.raises(ContextWindowExceededError):
+        router.call(lambda target, is_last: None, 5000)
+    assert router.max_input_tokens == 1000
+    assert Router([RouteTarget("unbounded")]).max_input_tokens is None
+
+
+def test_async_fallback():
+    async def func(target, is_last):
+        if target.model == "primary":
+            raise CircuitOpenError("open")
+        return target.model
+
+    router = Router(_targets())
+    assert asyncio.run(router.acall(func, 10)) == "fallback"
+    assert router.fallbacks == 1
+
+
+def test_slow_calls_are_hedged():
+    calls = 0
+    cancelled = []
+
+    async def func(target, is_last):
+        nonlocal calls
+        calls += 1
+        call = calls
+        try:
+            await asyncio.sleep(1 if call == 1 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(call)
+            raise
+        return call
+
+    router = Router(_targets(), hedge_percentile=90, hedge_initial_delay=0.01)
+    assert asyncio.run(router.acall(func, 10)) == 2
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+    # The slow original request is cancelled
+    assert cancelled == [1]
+
+
+def _finishing_together():
+    """Calls that all return once the hedge has been sent, so they finish in the same wait."""
+    calls = 0
+
+    async def func(target, is_last):
+        nonlocal calls
+        calls += 1
+        call = calls
+        release = func.release
+        if call == 2:
+            asyncio.get_running_loop().call_later(0.01, release.set)
+        await release.wait()
+        return call
+
+    async def run(router, discard):
+        func.release = asyncio.Event()
+        return await router.acall(func, 10, discard)
+
+    return run
+
+
+def test_hedges_finishing_in_the_same_wait_are_discarded():
+    discarded = []
+
+    async def discard(result):
+        discarded.append(result)
+
+    router = Router(_targets(), hedge_percentile=90, hedge_initial_delay=0.01)
+    # The earliest request wins the tie
+    assert asyncio.run(_finishing_together()(router, discard)) == 1
+    assert discarded == [2]
+    assert (router.hedges, router.hedge_wins) == (1, 0)
+
+
+def test_failing_discards_do_not_fail_the_call():
+    async def discard(result):
+        raise RuntimeError("close failed")
+
+    router = Router(_targets(), hedge_percentile=90, hedge_initial_delay=0.01)
+    assert asyncio.run(_finishing_together()(router, discard)) == 1
+
+
+def test_hedge_delay_uses_the_latency_percentile():
+    target = RouteTarget("primary")
+    router = Router([target], hedge_percentile=90, hedge_min_samples=10, hedge_initial_delay=5)
+    assert router.hedge_delay(target) == 5
+    for _ in range(10):
+        target.record_latency(2.0)
+    assert router.hedge_delay(target) == pytest.approx(2.0)
+    assert Router([target]).hedge_delay(target) is None
+    assert router.get_stats()["latency_seconds"]["primary"]["count"] == 10
+
+
+def test_no_hedging_without_a_delay():
+    async def func(target, is_last):
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    router = Router(_targets(), hedge_percentile=90)
+    assert asyncio.run(router.acall(func, 10)) == "ok"
+    assert router.hedges == 0
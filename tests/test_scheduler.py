@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pr_agent.llm.scheduler import WINDOW_SEC, RequestScheduler
+
+
+def test_no_limits_never_wait():
+    scheduler = RequestScheduler()
+    assert [scheduler._reserve(10_000) for _ in range(100)] == [0] * 100
+
+
+def test_requests_per_minute():
+    scheduler = RequestScheduler(requests_per_minute=2)
+    delays = [scheduler._reserve(1) for _ in range(3)]
+    assert delays[:2] == [0, 0]
+    assert delays[2] == pytest.approx(WINDOW_SEC, abs=0.1)
+    assert scheduler.get_stats()["requests"] == 3
+
+
+def test_tokens_per_minute():
+    scheduler = RequestScheduler(tokens_per_minute=1000)
+    assert scheduler._reserve(600) == 0
+    assert scheduler._reserve(300) == 0
+    # Waits for the first request to leave the window
+    assert scheduler._reserve(200) == pytest.approx(WINDOW_SEC, abs=0.1)
+
+
+def test_reservations_are_first_come_first_served():
+    scheduler = RequestScheduler(tokens_per_minute=1000)
+    scheduler._reserve(1000)
+    large = scheduler._reserve(1000)
+    small = scheduler._reserve(1)
+    assert small >= large
+
+
+def test_max_concurrency():
+    scheduler = RequestScheduler(max_concurrency=2)
+    in_flight, peak = 0, 0
+    lock = threading.Lock()
+
+    def request():
+        nonlocal in_flight, peak
+        with scheduler.slot(1):
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == 2
+    assert scheduler.get_stats()["queue_depth"] == 0
+
+
+def test_async_max_concurrency():
+    scheduler = RequestScheduler(max_concurrency=2)
+    in_flight, peak = 0, 0
+
+    async def request():
+        nonlocal in_flight, peak
+        async with scheduler.aslot(1):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
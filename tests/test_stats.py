@@ -0,0 +1,105 @@
+import json
+import threading
+
+import pytest
+
+from pr_agent.llm.stats import APIStats, Histogram
+
+
+def test_histogram_percentiles_are_within_bucket_accuracy():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value / 100)
+    assert histogram.count == 1000
+    assert histogram.mean == pytest.approx(5.005)
+    assert histogram.percentile(50) == pytest.approx(5.0, rel=0.05)
+    assert histogram.percentile(90) == pytest.approx(9.0, rel=0.05)
+    assert histogram.percentile(100) <= histogram.max == 10.0
+    assert Histogram().percentile(50) is None
+
+
+def test_histogram_addition():
+    first, second = Histogram(), Histogram()
+    for value in (1, 2, 3):
+        first.record(value)
+    for value in (10, 20):
+        second.record(value)
+    merged = first + second
+    assert merged.count == 5
+    assert (merged.min, merged.max) == (1, 20)
+    assert merged.total == 36
+    assert merged.summary()["p50"] == pytest.approx(3, rel=0.05)
+    assert (first + Histogram()).summary() == first.summary()
+
+
+def test_record_call():
+    stats = APIStats(model="gpt-4o")
+    stats.record_call("gpt-4o", 100, 50, 0.01, latency=2.0, cached_input_tokens=20)
+    stats.record_call("gpt-4o-mini", 10, 0, 0.001)
+    assert (stats.api_calls, stats.input_tokens, stats.output_tokens) == (2, 110, 50)
+    assert stats.total_cost == pytest.approx(0.011)
+    assert stats.cached_input_tokens == 20
+    assert stats.by_model["gpt-4o-mini"].api_calls == 1
+    # Calls of unknown latency are not in the histograms
+    assert stats.latency.count == 1
+    assert stats.throughput.summary()["mean"] == 25
+    assert [record["model"] for record in stats.history] == ["gpt-4o", "gpt-4o-mini"]
+
+
+def test_history_is_bounded():
+    stats = APIStats(model="gpt-4o", history_size=3)
+    for i in range(10):
+        stats.record_call("gpt-4o", i, 0, 0)
+    assert [record["input_tokens"] for record in stats.history] == [7, 8, 9]
+    assert stats.api_calls == 10
+
+
+def test_history_path(tmp_path):
+    path = tmp_path / "calls" / "history.jsonl"
+    stats = APIStats(model="gpt-4o", history_path=str(path))
+    messages = [{"role": "user", "content": "hi"}]
+    stats.record_call("gpt-4o", 1, 1, 0, input=messages, output="hello")
+    record = json.loads(path.read_text())
+    assert (record["input"], record["output"]) == (messages, "hello")
+    assert "input" not in stats.history[0]
+
+
+def test_update():
+    stats = APIStats(model="gpt-4o")
+    stats.update(cache_hits=2, cost_saved=0.5)
+    assert (stats.cache_hits, stats.cost_saved) == (2, 0.5)
+    with pytest.raises(ValueError):
+        stats.update(unknown=1)
+
+
+def test_concurrent_updates_are_not_lost():
+    stats = APIStats(model="gpt-4o")
+
+    def record():
+        for _ in range(1000):
+            stats.record_call("gpt-4o", 1, 1, 0, latency=0.1)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.api_calls == stats.input_tokens == stats.latency.count == 8000
+
+
+def test_addition_and_export():
+    first, second = APIStats(model="gpt-4o"), APIStats(model="claude")
+    first.record_call("gpt-4o", 10, 5, 0.1, latency=1.0)
+    second.record_call("claude", 20, 5, 0.2, latency=3.0)
+    second.update(cache_misses=1)
+    merged = first + second
+    assert merged.model == "gpt-4o, claude"
+    assert (merged.api_calls, merged.input_tokens, merged.cache_misses) == (2, 30, 1)
+    assert merged.latency.count == 2
+    assert [record["model"] for record in merged.history] == ["gpt-4o", "claude"]
+    exported = merged.export()
+    assert exported["by_model"]["claude"]["cost"] == pytest.approx(0.2)
+    assert exported["latency_seconds"]["max"] == 3.0
+    json.dumps(exported)
+    with pytest.raises(TypeError):
+        first + 1
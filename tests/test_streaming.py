@@ -0,0 +1,83 @@
+from pr_agent.task_inference.chunking import EFFORT_KEY, parse_review
+from pr_agent.task_inference.streaming import KEY_ISSUES_KEY, ReviewStreamParser
+
+ANSWER = f"""Here is my review:
+```yaml
+review:
+  {EFFORT_KEY}: 3
+  score: 85
+  {KEY_ISSUES_KEY}:
+    - relevant_file: |
+        a.py
+      issue_header: Possible bug
+      issue_content: "Index: may be out of range"
+      start_line: 10
+      end_line: 12
+    - relevant_file: b.py
+      issue_header: Performance
+      issue_content: |
+        Quadratic loop
+
+        over all files
+      start_line: 3
+      end_line: 4
+  security_concerns: No
+```
+Let me know if you need more.
+"""
+
+
+def _feed(parser, text, size):
+    issues = []
+    for i in range(0, len(text), size):
+        issues.extend(parser.feed(text[i : i + size]))
+    return issues + parser.close()
+
+
+def test_streamed_review_matches_parsed_review():
+    expected = parse_review(ANSWER)
+    for size in (1, 7, len(ANSWER)):
+        parser = ReviewStreamParser()
+        issues = _feed(parser, ANSWER, size)
+        assert parser.done
+        assert issues == parser.key_issues
+        assert parser.result()["review"] == {
+            name: value.strip() if isinstance(value, str) else value
+            for name, value in expected["review"].items()
+        } | {KEY_ISSUES_KEY: issues}
+        assert issues[0]["relevant_file"] == "a.py"
+        assert issues[1]["issue_content"] == "Quadratic loop\n\nover all files"
+
+
+def test_issues_are_returned_as_soon_as_the_next_one_starts():
+    parser = ReviewStreamParser()
+    head, tail = ANSWER.split("    - relevant_file: b.py")
+    assert parser.feed(head) == []
+    issues = parser.feed("    - relevant_file: b.py\n")
+    assert [issue["issue_header"] for issue in issues] == ["Possible bug"]
+    issues = parser.feed(tail)
+    assert [issue["issue_header"] for issue in issues] == ["Performance"]
+
+
+def test_is_complete_once_required_fields_are_parsed():
+    parser = ReviewStreamParser()
+    parser.feed(ANSWER.split("  security_concerns")[0])
+    assert not parser.is_complete()
+    parser.feed("  security_concerns: No\n")
+    assert parser.is_complete()
+    assert not parser.is_complete(("security_concerns",))
+
+
+def test_unterminated_answer_is_parsed_on_close():
+    parser = ReviewStreamParser()
+    parser.feed(f"review:\n  score: 70\n  {KEY_ISSUES_KEY}:\n    - relevant_file: a.py\n      start_line: 1")
+    assert not parser.done
+    issues = parser.close()
+    assert issues == [{"relevant_file": "a.py", "start_line": 1}]
+    assert parser.result() == {"review": {"score": 70, KEY_ISSUES_KEY: issues}}
+
+
+def test_text_without_review_is_ignored():
+    parser = ReviewStreamParser()
+    assert _feed(parser, "I cannot review this PR.\nscore: 5\n", 4) == []
+    assert parser.result() == {"review": {KEY_ISSUES_KEY: []}}
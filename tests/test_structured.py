@@ -0,0 +1,171 @@
+import asyncio
+import copy
+import json
+
+import litellm
+import pytest
+from pydantic import ValidationError
+
+from pr_agent.llm.litellm import LiteLLMModel
+from pr_agent.task_inference.structured import (
+    InstructorRetryException,
+    ReviewRepairer,
+    apply_repair,
+    build_repair_model,
+    raw_review_data,
+)
+from pr_agent.types import PRReview
+
+EFFORT = "estimated_effort_to_review_[1-5]"
+
+
+def _issue(relevant_file, start_line, end_line):
+    return {
+        "relevant_file": relevant_file,
+        "issue_header": "Possible bug",
+        "issue_content": "Index may be out of range",
+        "start_line": start_line,
+        "end_line": end_line,
+    }
+
+
+# Score out of range, second key issue with its lines swapped
+INVALID_REVIEW = {
+    "review": {
+        EFFORT: 3,
+        "score": 150,
+        "key_issues_to_review": [_issue("a.py", 10, 12), _issue("b.py", 8, 4)],
+    }
+}
+
+
+def _validation_error(data):
+    with pytest.raises(ValidationError) as e:
+        PRReview.model_validate(data)
+    return e.value
+
+
+def _tool_response(name, arguments):
+    return litellm.ModelResponse(
+        model="gpt-4o-mini",
+        choices=[
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": "call_0",
+                            "type": "function",
+                            "function": {"name": name, "arguments": json.dumps(arguments)},
+                        }
+                    ],
+                },
+            }
+        ],
+        usage={"prompt_tokens": 20, "completion_tokens": 10, "total_tokens": 30},
+    )
+
+
+def test_repair_model_asks_for_invalid_fields_only():
+    repair_model = build_repair_model(_validation_error(INVALID_REVIEW))
+    assert set(repair_model.model_fields) == {"score", "key_issue_2"}
+
+
+def test_repair_model_asks_for_the_whole_review_if_it_is_malformed():
+    repair_model = build_repair_model(_validation_error({"answer": "LGTM"}))
+    assert set(repair_model.model_fields) == {"review"}
+
+
+def test_apply_repair_replaces_invalid_fields_only():
+    data = copy.deepcopy(INVALID_REVIEW)
+    repair_model = build_repair_model(_validation_error(data))
+    apply_repair(data, repair_model(score=85, key_issue_2=_issue("b.py", 4, 8)))
+    review = PRReview.model_validate(data).review
+    assert review.score == 85
+    assert review.estimated_effort_to_review == 3
+    assert [issue.model_dump() for issue in review.key_issues_to_review] == [
+        _issue("a.py", 10, 12),
+        _issue("b.py", 4, 8),
+    ]
+
+
+def test_raw_review_data_reads_tool_calls_and_text():
+    assert raw_review_data(_tool_response("PRReview", INVALID_REVIEW)) == INVALID_REVIEW
+    text_response = litellm.ModelResponse(
+        choices=[{"message": {"role": "assistant", "content": f"```json\n{json.dumps(INVALID_REVIEW)}\n```"}}]
+    )
+    assert raw_review_data(text_response) == INVALID_REVIEW
+    assert raw_review_data(None) is None
+
+
+def _answering(*responses):
+    calls = []
+    responses = iter(responses)
+
+    def completion(**kwargs):
+        calls.append(kwargs)
+        return next(responses)
+
+    async def acompletion(**kwargs):
+        return completion(**kwargs)
+
+    completion.calls = calls
+    return completion, acompletion
+
+
+def test_invalid_answers_raise_with_their_completion(monkeypatch):
+    completion, _ = _answering(_tool_response("PRReview", INVALID_REVIEW))
+    monkeypatch.setattr(litellm, "completion", completion)
+    llm = LiteLLMModel(model="gpt-4o-mini", api_key="key")
+    # The answer the repairer starts from
+    with pytest.raises(InstructorRetryException) as e:
+        llm.create(PRReview, "Review this diff", max_retries=0)
+    assert raw_review_data(e.value.last_completion) == INVALID_REVIEW
+
+
+def _repair_round_trip(monkeypatch, run):
+    completion, acompletion = _answering(
+        _tool_response("PRReview", INVALID_REVIEW),
+        _tool_response("PRReviewRepair", {"score": 85, "key_issue_2": _issue("b.py", 4, 8)}),
+    )
+    monkeypatch.setattr(litellm, "completion", completion)
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    llm = LiteLLMModel(model="gpt-4o-mini", api_key="key")
+    messages = [{"role": "user", "content": "Review this diff"}]
+
+    review = run(ReviewRepairer(llm, max_repairs=1), messages).review
+
+    assert review.score == 85
+    assert review.key_issues_to_review[0].relevant_file == "a.py"
+    assert (review.key_issues_to_review[1].start_line, review.key_issues_to_review[1].end_line) == (4, 8)
+    review_call, repair_call = completion.calls
+    assert review_call["tools"][0]["function"]["name"] == "PRReview"
+    # Only the invalid fields are asked for again, with what was wrong with them
+    repair_tool = repair_call["tools"][0]["function"]
+    assert repair_tool["name"] == "PRReviewRepair"
+    assert set(repair_tool["parameters"]["properties"]) == {"score", "key_issue_2"}
+    assert "review.score" in repair_call["messages"][-1]["content"]
+    assert repair_call["messages"][-2]["content"] == json.dumps(INVALID_REVIEW)
+    assert llm.stats.api_calls == 2
+
+
+def test_invalid_fields_are_repaired(monkeypatch):
+    _repair_round_trip(monkeypatch, lambda repairer, messages: repairer.create(messages))
+
+
+def test_invalid_fields_are_repaired_asynchronously(monkeypatch):
+    _repair_round_trip(
+        monkeypatch, lambda repairer, messages: asyncio.run(repairer.acreate(messages))
+    )
+
+
+def test_repairs_are_bounded(monkeypatch):
+    completion, _ = _answering(_tool_response("PRReview", INVALID_REVIEW))
+    monkeypatch.setattr(litellm, "completion", completion)
+    llm = LiteLLMModel(model="gpt-4o-mini", api_key="key")
+    with pytest.raises(ValidationError):
+        ReviewRepairer(llm, max_repairs=0).create([{"role": "user", "content": "Review this diff"}])
+    assert len(completion.calls) == 1
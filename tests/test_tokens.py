@@ -0,0 +1,33 @@
+from pr_agent.llm.tokens import TokenCounter, get_token_counter
+
+MESSAGES = [
+    {"role": "system", "content": "You are a code reviewer."},
+    {"role": "user", "content": "Review this diff:\n+print('hello')"},
+    {"role": "assistant", "content": "Looks good."},
+]
+
+
+def test_counts_match_litellm():
+    import litellm
+
+    counter = TokenCounter("gpt-4o")
+    assert counter.count_messages(MESSAGES) == litellm.token_counter(model="gpt-4o", messages=MESSAGES)
+    assert counter.count_text("hello world") == len(counter.encode("hello world"))
+    assert counter.decode(counter.encode("hello world")) == "hello world"
+    assert counter.count_text(["hello", "world"]) == counter.count_text("hello") + counter.count_text("world")
+
+
+def test_prefix_sums():
+    counter = get_token_counter("gpt-4o")
+    sums = counter.prefix_sums(MESSAGES)
+    assert len(sums) == len(MESSAGES) + 1
+    assert sums[-1] + counter.messages_overhead == counter.count_messages(MESSAGES)
+    assert sums[3] - sums[1] == counter.count_messages(MESSAGES[1:]) - counter.messages_overhead
+
+
+def test_counts_are_memoized():
+    counter = TokenCounter("gpt-4o", cache_size=2)
+    for text in ("a", "b", "c"):
+        counter.count_text(text)
+    assert len(counter._counts) == 2
+    assert get_token_counter("gpt-4o") is get_token_counter("gpt-4o")